@@ -0,0 +1,132 @@
+# The analytics queries that return pandas DataFrames.
+#
+# pandas costs a few hundred milliseconds and tens of MB to import.  This module is only imported from
+# inside the model methods that need it (Product.ProductSales, Product.RevenueRanks, Order.AnnualSales),
+# so migrate, the other management commands, worker boot and the pages without these charts never load
+# pandas.  Keep it out of the module-level imports of models.py, views.py and the modules they import -
+# DjTraders/tests.py checks that django.setup() does not import pandas or plotly.
+from decimal import Decimal
+
+import pandas as pd
+from django.db import models
+from django.db.models import F, Sum, Count, OuterRef, Subquery, Window
+from django.db.models.functions import ExtractYear, ExtractMonth, Coalesce, RowNumber
+
+from .models import Order, OrderDetail, SalesDaily
+from .timewindow import filter_window
+
+
+def product_sales(product, year=None, rollup=None, window=None):
+    '''
+        Product.ProductSales(): TotalRevenue and TotalQuantity per (Year, Month) for product.
+    '''
+    if SalesDaily.Enabled(rollup):
+        cells = filter_window(SalesDaily.objects.filter(product=product), 'day', window, year=year)
+        sales_data = cells.annotate(
+            Year=ExtractYear('day'),
+            Month=ExtractMonth('day'),
+        ).values('Year', 'Month').annotate(
+            TotalRevenue=Sum('revenue'),
+            TotalQuantity=Sum('quantity')
+        ).order_by('Year', 'Month')
+        return pd.DataFrame(list(sales_data))
+
+    lines = filter_window(OrderDetail.objects.filter(product=product), 'order__order_date', window, year=year)
+    sales_data = lines.annotate(
+        Year=ExtractYear('order__order_date'),
+        Month=ExtractMonth('order__order_date'),
+    ).values('Year', 'Month').annotate(
+        TotalRevenue=Sum('line_total'),
+        TotalQuantity=Sum('quantity')
+    ).order_by('Year', 'Month')
+
+    return pd.DataFrame(list(sales_data))
+
+
+def revenue_ranks(n=10, per_year=True):
+    '''
+        Product.RevenueRanks(): top and bottom n products by revenue.
+    '''
+    lines = OrderDetail.objects.all()
+    group_by = ['product__product_id', 'product__product_name']
+    partition_by = None
+    if per_year:
+        lines = lines.annotate(year=ExtractYear('order__order_date'))
+        group_by = ['year'] + group_by
+        partition_by = [F('year')]
+
+    ranked = lines.values(*group_by).annotate(
+        total_revenue=Sum('line_total'),
+    ).annotate(
+        top_rank=Window(RowNumber(), partition_by=partition_by,
+                        order_by=[F('total_revenue').desc(), F('product__product_id').asc()]),
+        bottom_rank=Window(RowNumber(), partition_by=partition_by,
+                           order_by=[F('total_revenue').asc(), F('product__product_id').asc()]),
+    ).filter(models.Q(top_rank__lte=n) | models.Q(bottom_rank__lte=n))
+
+    columns = ['product_id', 'product_name', 'total_revenue', 'top_rank', 'bottom_rank']
+    fields = ['product__product_id', 'product__product_name', 'total_revenue', 'top_rank', 'bottom_rank']
+    if per_year:
+        columns, fields = ['year'] + columns, ['year'] + fields
+
+    ranks = pd.DataFrame.from_records(list(ranked.values_list(*fields)), columns=columns)
+    ranks['total_revenue'] = ranks['total_revenue'].astype('float64')
+    return ranks
+
+
+def annual_sales(year=None, rollup=None, window=None):
+    '''
+        Order.AnnualSales(): TotalRevenue, TotalProductsSold and TotalOrders per (Year, Month).
+    '''
+    # A date range on order_date, applied before grouping.
+    orders = filter_window(Order.objects.all(), 'order_date', window, year=year)
+    if SalesDaily.Enabled(rollup):
+        cells = filter_window(SalesDaily.objects.all(), 'day', window, year=year)
+        sales = cells.annotate(
+            Year=ExtractYear('day'),
+            Month=ExtractMonth('day'),
+        ).values('Year', 'Month').annotate(
+            TotalRevenue=Sum('revenue'),
+            TotalProductsSold=Sum('quantity'),
+        )
+        # An order spans several products, so the order count comes from the orders table itself.
+        orderCounts = orders.annotate(
+            Year=ExtractYear('order_date'),
+            Month=ExtractMonth('order_date'),
+        ).values('Year', 'Month').annotate(TotalOrders=Count('order_id'))
+
+        columns = ['Year', 'Month', 'TotalRevenue', 'TotalProductsSold', 'TotalOrders']
+        annual = pd.DataFrame(list(sales), columns=columns[:4]).merge(
+            pd.DataFrame(list(orderCounts), columns=['Year', 'Month', 'TotalOrders']),
+            on=['Year', 'Month'], how='outer',
+        )
+        if annual.empty:
+            return pd.DataFrame()
+        annual = annual.fillna(0).astype(
+            {'TotalRevenue': 'float64', 'TotalProductsSold': 'int64', 'TotalOrders': 'int64'})
+        return annual.sort_values(['Year', 'Month']).reset_index(drop=True)[columns]
+
+    # Two levels: the total of each order first (one correlated subquery per measure, answered from
+    # the order's own lines), then those order totals summed per calendar month.  Aggregating the
+    # orders -> order_details join directly would count each order once per line.
+    lines = OrderDetail.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    orderRevenue = lines.annotate(total=Sum('line_total')).values('total')
+    orderProducts = lines.annotate(total=Sum('quantity')).values('total')
+
+    annual_data = orders.annotate(
+        Year=ExtractYear('order_date'),
+        Month=ExtractMonth('order_date'),
+        Revenue=Coalesce(Subquery(orderRevenue), Decimal("0.00"),
+                         output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        ProductsSold=Coalesce(Subquery(orderProducts), 0),
+    ).values('Year', 'Month').annotate(
+        TotalRevenue=Sum('Revenue'),
+        TotalProductsSold=Sum('ProductsSold'),
+        TotalOrders=Count('order_id')
+    ).order_by('Year', 'Month')
+
+    annual = pd.DataFrame(list(annual_data))
+    if not annual.empty:
+        # Decimal objects would make plotly treat the revenue column as a different type from the counts.
+        annual['TotalRevenue'] = annual['TotalRevenue'].astype('float64')
+    return annual
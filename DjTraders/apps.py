@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class DjtradersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "DjTraders"
+
+    def ready(self):
+        # Register the signal receivers that maintain denormalized order data,
+        # and the trgm_contains lookup used by the list view searches.
+        from . import signals, search  # noqa: F401
@@ -0,0 +1,138 @@
+# Async versions of the analytics partials the customer and product detail pages load with AJAX.
+#
+# Same URL parameters, templates and context as the function views in views.py.  The queries go through
+# Django's async ORM and the figures are built on charts.figure_executor, so under an ASGI server
+# (uvicorn DjangoTraders.asgi:application) a request waiting on the database does not hold a worker thread.
+# urls.py mounts these under DjTraders/async/..., and on the usual URLs when DJTRADERS_ASYNC_VIEWS is set.
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render
+
+from . import facets
+from .charts import chart_cache, run_figure
+from .models import Customer, Product
+from .timewindow import window_from_request
+from .views import ProductSalesAnalysisFigures, ProductSalesAnalysisRows
+
+# facets.order_years() is cached per process; on a miss it queries the orders table.
+order_years = sync_to_async(facets.order_years)
+
+
+async def OrdersPlaced(request):
+    customer = await Customer.objects.aget(customer_id=int(request.GET.get('customer_id')))
+    # Loaded here so the template's customer.OrdersWithDetails finds the orders already on the instance.
+    await customer.aOrdersWithDetails()
+    return render(request, 'DjTraders/_OrdersPlaced.html',
+                  {'customer': customer})
+
+
+async def OrdersByDate(request, selOrderYear=""):
+    customer_id = int(request.GET.get('customer_id'))
+    selOrderYear = request.GET.get('selOrderYear')
+    window = window_from_request(request)
+
+    customer = await Customer.objects.aget(customer_id=customer_id)
+    OrderYears, TheAnnualOrders, ordersByDatePlot = await asyncio.gather(
+        order_years(),
+        customer.aAnnualOrders(),
+        customer.aOrdersPlacedPlot(selOrderYear, window=window),
+    )
+
+    return render(
+        request,
+        'DjTraders/_OrdersByDate.html',
+        {
+            'customer': customer,
+            'selOrderYear': selOrderYear,
+            'OrderYears': OrderYears,
+            'OrdersByDatePlot': ordersByDatePlot,
+            'AnnualOrdersPlot': TheAnnualOrders,
+        }
+    )
+
+
+async def OrdersByProduct(request):
+    customer = await Customer.objects.aget(customer_id=int(request.GET.get('customer_id')))
+    # One after the other: both plots are drawn from the same rows, which the first chart-cache miss
+    # loads onto the customer (see Customer.aProductFacts).
+    TheProductsRevenuePlot = await customer.aProductReveues()
+    TheProductsPlot = await customer.aProductsSoldPlot()
+
+    return render(
+        request,
+        'DjTraders/_OrdersByProduct.html',
+        {
+            'customer': customer,
+            'ProductsPlot': TheProductsPlot,
+            'ProductsRevenuePlot': TheProductsRevenuePlot,
+        }
+    )
+
+
+async def OrdersByCategory(request):
+    customer = await Customer.objects.aget(customer_id=int(request.GET.get('customer_id')))
+
+    TheCategoryPlot = await customer.aProductCategorySalesPlot()
+    TheCategoryRevenusPlot = await customer.aProductCategoryRevenusPlot()
+
+    return render(
+        request,
+        'DjTraders/_OrdersByCategory.html',
+        {
+            'customer': customer,
+            'CategoryRevenuesPlot': TheCategoryRevenusPlot,
+            'CategoryPlot': TheCategoryPlot,
+        }
+    )
+
+
+async def ProductAnnualMonthlySales(request, pk=None):
+    selYear = request.GET.get('selOrderYear', "")
+    window = window_from_request(request)
+    eachProduct = await aget_object_or_404(Product, pk=pk)
+
+    OrdersYears, yearly_plot, monthly_plot = await asyncio.gather(
+        order_years(),
+        eachProduct.aAnnualProductOrders(),
+        eachProduct.aMonthlyProductOrders(window=window),
+    )
+    return render(
+        request,
+        'DjTraders/_ProductAnnualSales.html',
+        {
+            'product': eachProduct,
+            'selOrderYear': selYear,
+            'OrderYears': OrdersYears,
+            'AnnualySalePlot': yearly_plot,
+            'MonthlySalePlot': monthly_plot,
+        }
+    )
+
+
+async def product_sales_analysis(request, pk):
+    selYear = request.GET.get('selOrderYear')
+    window = window_from_request(request)
+    eachProduct = await Product.objects.aget(pk=pk)
+
+    async def plots(window):
+        rows = [row async for row in ProductSalesAnalysisRows(eachProduct, window)]
+        return await run_figure(ProductSalesAnalysisFigures, eachProduct, rows)
+
+    # Same cache entry as views.product_sales_analysis.
+    OrdersYears, (annual_chart_html, monthly_chart_html) = await asyncio.gather(
+        order_years(),
+        chart_cache.aget_or_render('ProductSalesAnalysis', eachProduct.pk, plots, window),
+    )
+
+    return render(
+        request,
+        'DjTraders/_ProductSalesAnalysis.html',
+        {
+            'product': eachProduct,
+            'ProductAnnualySalesPlot': annual_chart_html,
+            'ProductMonthlySalesPlot': monthly_chart_html,
+            'OrderYears': OrdersYears,
+            'selOrderYear': selYear,
+        }
+    )
@@ -0,0 +1,314 @@
+# Chart rendering shared by every model and view plot method.
+#
+# plotly.offline.plot(fig, output_type='div') and fig.to_html(full_html=False) inline the whole
+# plotly.js bundle (several MB) into every chart.  render_chart() emits only the figure JSON and a
+# one-line call to DjTradersPlot() (static/scripts/DJTraders.js).  plotly.js itself is loaded once
+# by base.html from the PlotlyJS view, which lets browsers cache it for a year.
+import asyncio
+import functools
+import importlib.metadata
+import importlib.util
+import inspect
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# Same escapes as django.utils.html.json_script, so the JSON cannot close the <script> element.
+_json_script_escapes = {
+    ord('>'): '\\u003E',
+    ord('<'): '\\u003C',
+    ord('&'): '\\u0026',
+}
+
+
+def render_chart(fig):
+    '''
+        Returns the HTML for a plotly figure: an empty div, the figure as JSON, and the call that draws it.
+        fig is a plotly Figure or a figures.Figure - anything with to_json().
+    '''
+    div_id = 'plot-' + uuid.uuid4().hex
+    figure_json = fig.to_json().translate(_json_script_escapes)
+    return mark_safe(
+        f'<div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>'
+        f'<script type="application/json" id="{div_id}-figure">{figure_json}</script>'
+        f'<script type="text/javascript">DjTradersPlot("{div_id}");</script>'
+    )
+
+
+def plotly_js_path():
+    '''
+        Location of the plotly.min.js bundle shipped inside the installed plotly package,
+        so the browser always gets the plotly.js version the figures were built for.
+    '''
+    spec = importlib.util.find_spec('plotly')
+    return os.path.join(spec.submodule_search_locations[0], 'package_data', 'plotly.min.js')
+
+
+def plotly_version():
+    '''
+        Version of the installed plotly package - part of the plotly.js URL, so a new bundle gets a new URL.
+    '''
+    return importlib.metadata.version('plotly')
+
+
+# Rendered-chart cache
+#
+# Charts are cached per process, keyed by (chart kind, entity id, arguments such as the year filter,
+# data version).  Any committed write to orders, order lines, products, customers or categories bumps
+# the data version (see signals.py - the rollup rebuilds, which write in bulk, bump it themselves), so a
+# cached chart is never served after its data changed - the old entries simply stop being looked up
+# and fall out of the LRU.  The version lives in Django's cache
+# framework, so with a shared cache backend a write in one worker invalidates every worker.
+DATA_VERSION_KEY = 'DjTraders.chart_data_version'
+
+
+def data_version():
+    return cache.get_or_set(DATA_VERSION_KEY, 1, timeout=None)
+
+
+async def adata_version():
+    return await cache.aget_or_set(DATA_VERSION_KEY, 1, timeout=None)
+
+
+def bump_data_version():
+    '''
+        Moves the data version forward and returns the new version.
+    '''
+    try:
+        return cache.incr(DATA_VERSION_KEY)
+    except ValueError:
+        cache.set(DATA_VERSION_KEY, 2, timeout=None)
+        return 2
+
+
+class ChartCache:
+    '''
+        Bounded LRU cache of rendered chart HTML with hit/miss statistics.
+    '''
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def key(kind, entity_id, args, kwargs, version):
+        return (kind, entity_id, tuple(args), tuple(sorted(kwargs.items())), version)
+
+    def lookup(self, key):
+        '''
+            The cached HTML for key, or None.  Counts the hit or miss.
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def get_or_render(self, kind, entity_id, render, *args, **kwargs):
+        key = self.key(kind, entity_id, args, kwargs, data_version())
+        html = self.lookup(key)
+        if html is None:
+            html = render(*args, **kwargs)
+            self.store(key, html)
+        return html
+
+    async def aget_or_render(self, kind, entity_id, render, *args, **kwargs):
+        '''
+            get_or_render() for the async views: render is a coroutine function.
+            Same keys as get_or_render(), so sync and async views share the cached charts.
+        '''
+        key = self.key(kind, entity_id, args, kwargs, await adata_version())
+        html = self.lookup(key)
+        if html is None:
+            html = await render(*args, **kwargs)
+            self.store(key, html)
+        return html
+
+    def store(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'data_version': data_version(),
+            }
+
+
+chart_cache = ChartCache(maxsize=getattr(settings, 'DJTRADERS_CHART_CACHE_SIZE', 256))
+
+
+# How render_charts() splits a cached plot method: rows and figure name methods of the entity.
+# rows(*args, **kwargs) returns what the chart needs from the database, figure(rows) builds the chart HTML
+# from it without touching the database.  figure None means rows only loads the data onto the entity
+# (Customer.ProductFacts) and the plot method itself then draws without querying.
+ChartParts = namedtuple('ChartParts', ['kind', 'rows', 'figure'])
+
+
+def cached_chart(kind, rows=None, figure=None):
+    '''
+        Decorator for model plot methods - caches the rendered chart for (kind, self.pk, arguments).
+        Also works on staticmethods (the entity id is then None), and on the async twins of the plot
+        methods (declared with the same kind, so both find each other's charts).
+        rows / figure name the methods the plot is made of, so render_charts() can run the query
+        and the figure build separately (see ChartParts).
+    '''
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                if args and isinstance(args[0], models.Model):
+                    entity, rest = args[0], args[1:]
+                    return await chart_cache.aget_or_render(
+                        kind, entity.pk, lambda *a, **kw: method(entity, *a, **kw), *rest, **kwargs)
+                return await chart_cache.aget_or_render(kind, None, method, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if args and isinstance(args[0], models.Model):
+                entity, rest = args[0], args[1:]
+                return chart_cache.get_or_render(
+                    kind, entity.pk, lambda *a, **kw: method(entity, *a, **kw), *rest, **kwargs)
+            return chart_cache.get_or_render(kind, None, method, *args, **kwargs)
+        wrapper.chart = ChartParts(kind, rows, figure) if rows else None
+        return wrapper
+    return decorator
+
+
+# Figure construction, off the request's thread (see async_views.py and render_charts() below).
+#
+# The rows are fetched first, by the caller - with the async ORM in the async views.  Building the figure
+# and serializing it to JSON is CPU work, so it runs on this small pool instead of the event loop, which
+# keeps accepting and dispatching other requests meanwhile.  Nothing on the pool touches the database.
+# The pool is bounded (DJTRADERS_FIGURE_WORKERS) so a burst of chart requests queues up instead of
+# starting a thread per request.
+figure_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'DJTRADERS_FIGURE_WORKERS', 4),
+    thread_name_prefix='DjTraders-figures',
+)
+
+
+async def run_figure(build, *args, **kwargs):
+    '''
+        Awaits build(*args, **kwargs) run on figure_executor.  build must not touch the database.
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(figure_executor, functools.partial(build, *args, **kwargs))
+
+
+# Chart batches for the sync views.
+#
+# A partial that draws two charts used to draw them one after the other, query and figure build each.
+# render_charts() runs the queries in the calling thread - on the request's own connection, so inside
+# its transaction and seen by CaptureQueriesContext - and builds each figure on figure_executor as soon
+# as its rows are in, while the next chart's query runs.  A chart that raises, or whose figure is not
+# built within DJTRADERS_CHART_TIMEOUT seconds, is replaced by chart_fallback() and the rest of the page
+# still renders.  A figure build that timed out before it started is cancelled; one already running
+# finishes (it is CPU work only) and stores its HTML in chart_cache, so the next request finds it there.
+logger = logging.getLogger(__name__)
+
+
+def chart_fallback(name, reason):
+    '''
+        HTML shown in place of a chart that could not be drawn in time (reason 'timeout') or failed ('error').
+    '''
+    if reason == 'timeout':
+        message = 'This chart is taking longer than usual - reload the page to see it.'
+    else:
+        message = 'This chart could not be drawn.'
+    return mark_safe(f'<div class="chart-unavailable" data-chart="{escape(name)}">{message}</div>')
+
+
+def _start_chart(render, version):
+    '''
+        The chart HTML, or a Future of it when the figure is being built on figure_executor.
+        Cached plot methods with ChartParts are looked up in chart_cache and their rows fetched here;
+        any other render is called as is.
+    '''
+    method, args, kwargs = render, (), {}
+    if isinstance(render, functools.partial):
+        method, args, kwargs = render.func, render.args, render.keywords
+    parts = getattr(method, 'chart', None)
+    entity = getattr(method, '__self__', None)
+    if parts is None or not isinstance(entity, models.Model):
+        return render()
+
+    key = chart_cache.key(parts.kind, entity.pk, args, kwargs, version)
+    html = chart_cache.lookup(key)
+    if html is not None:
+        return html
+
+    rows = getattr(entity, parts.rows)(*args, **kwargs)
+    if parts.figure:
+        build = functools.partial(getattr(entity, parts.figure), list(rows))
+    else:
+        build = functools.partial(method.__wrapped__, entity, *args, **kwargs)
+    future = figure_executor.submit(build)
+    future.add_done_callback(
+        lambda done: done.cancelled() or done.exception() or chart_cache.store(key, done.result()))
+    return future
+
+
+def render_charts(charts, timeout=None):
+    '''
+        Draws the charts of one page.
+        charts is a dict {name: render}, render a callable without arguments returning the chart HTML:
+        a bound plot method (or functools.partial of one) declared with cached_chart(kind, rows, figure)
+        has its query run here and its figure built concurrently, anything else is simply called.
+        Returns {name: HTML}, with chart_fallback() for the charts that raised or whose figure was not
+        built within timeout seconds (default DJTRADERS_CHART_TIMEOUT, 10).
+    '''
+    if timeout is None:
+        timeout = getattr(settings, 'DJTRADERS_CHART_TIMEOUT', 10)
+    version = data_version()
+
+    html = {}
+    for name, render in charts.items():
+        try:
+            html[name] = _start_chart(render, version)
+        except Exception:
+            logger.exception("Chart %s failed", name)
+            html[name] = chart_fallback(name, 'error')
+
+    futures = [result for result in html.values() if isinstance(result, Future)]
+    wait(futures, timeout=timeout)
+    for name, result in html.items():
+        if not isinstance(result, Future):
+            continue
+        if not result.done():
+            result.cancel()
+            logger.warning("Chart %s not drawn within %s s", name, timeout)
+            html[name] = chart_fallback(name, 'timeout')
+        elif result.exception() is not None:
+            logger.error("Chart %s failed", name, exc_info=result.exception())
+            html[name] = chart_fallback(name, 'error')
+        else:
+            html[name] = result.result()
+    return html
@@ -0,0 +1,117 @@
+# Bulk export of the order history: one row per order line, joined with its order, customer, product
+# and category, as NDJSON or CSV (the ExportOrders view, DjTraders/export/orders.ndjson and .csv).
+#
+# The export is streamed: the rows are read through a server-side cursor (QuerySet.iterator()) chunk_size
+# rows at a time, and every chunk is encoded and sent before the next one is fetched, so a multi-million-line
+# export needs the memory of one chunk (DJTRADERS_EXPORT_CHUNK_SIZE rows), not of the whole result.
+# The iteration runs in a transaction: in autocommit mode Django declares the PostgreSQL cursor WITH HOLD,
+# and PostgreSQL materializes a held cursor's whole result when the statement commits.
+# Rows come in order line id order: the primary key index serves that order, so the database can start
+# sending rows at once instead of sorting the whole joined result first.
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import OrderDetail
+from .timewindow import filter_window
+
+# (column name in the export, field lookup from OrderDetail)
+COLUMNS = [
+    ('order_id', 'order_id'),
+    ('order_date', 'order__order_date'),
+    ('customer_id', 'order__customer_id'),
+    ('customer_name', 'order__customer__customer_name'),
+    ('country', 'order__customer__country'),
+    ('order_detail_id', 'order_detail_id'),
+    ('product_id', 'product_id'),
+    ('product_name', 'product__product_name'),
+    ('category_name', 'product__category__category_name'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'unit_price'),
+    ('line_total', 'line_total'),
+]
+
+NAMES = [name for name, _ in COLUMNS]
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def chunk_size():
+    return getattr(settings, 'DJTRADERS_EXPORT_CHUNK_SIZE', 2000)
+
+
+def order_lines(window=None, customer_id=None, product_id=None):
+    '''
+        values_list() of the exported columns, for the order lines in window (a TimeWindow on the
+        order date), optionally of one customer and / or one product.
+    '''
+    lines = OrderDetail.objects.all()
+    if customer_id is not None:
+        lines = lines.filter(order__customer_id=customer_id)
+    if product_id is not None:
+        lines = lines.filter(product_id=product_id)
+    lines = filter_window(lines, 'order__order_date', window)
+    return lines.order_by('order_detail_id').values_list(*[lookup for _, lookup in COLUMNS])
+
+
+class _Echo:
+    # csv.writer writes each row to this "file" and returns what it wrote (see the Django docs'
+    # "Streaming large CSV files").
+    def write(self, value):
+        return value
+
+
+def encoder(fmt):
+    '''
+        (header, encode) for fmt 'ndjson' or 'csv': the text sent before the first row, and a function
+        turning one row of order_lines() into one line of text.  NDJSON sends prices as decimal strings,
+        exactly as stored.
+    '''
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        return writer.writerow(NAMES), writer.writerow
+
+    def encode(row):
+        return json.dumps(dict(zip(NAMES, row)), cls=DjangoJSONEncoder) + '\n'
+    return '', encode
+
+
+def stream(lines, fmt):
+    '''
+        The export as an iterator of text chunks, one per chunk_size() rows.
+        The transaction stays open until the last chunk is sent, or the response closes the iterator.
+    '''
+    header, encode = encoder(fmt)
+    size = chunk_size()
+    chunk = [header]
+    with transaction.atomic(using=lines.db):
+        for row in lines.iterator(chunk_size=size):
+            chunk.append(encode(row))
+            if len(chunk) >= size:
+                yield ''.join(chunk)
+                chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def astream(lines, fmt):
+    '''
+        stream() for ASGI, where Django would read a synchronous iterator to the end before sending any of it.
+        Each chunk is fetched and encoded by stream() in a thread; thread_sensitive keeps every step on the same
+        thread, and so on the connection that holds the cursor and its transaction - closing stream() ends both,
+        also when the client goes away mid-export.
+    '''
+    chunks = stream(lines, fmt)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
@@ -0,0 +1,102 @@
+# Facet counts for the list view dropdowns (customer country/city, product category),
+# and the order year dropdown of the analytics views.
+#
+# Each facet is a list of {<field>: value, 'count': n} rows, computed with one GROUP BY query
+# and kept in a per-process cache.  signals.py clears the cache when a Customer, Product or
+# Category row saved or deleted in this process is committed; the TTL bounds how long another
+# worker process can show stale counts.
+#
+# The order years are also kept in Django's cache framework, so with a shared cache backend they
+# are computed once for all workers, and only again after an order with a new year is written
+# (or after DJTRADERS_ORDER_YEARS_TTL, for orders written with queryset.update() or raw SQL,
+# which send no signals).
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F
+
+from .models import Customer, Order, Product
+
+ORDER_YEARS_KEY = 'DjTraders.order_years'
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _facet_ttl():
+    return getattr(settings, 'DJTRADERS_FACET_TTL', 300)
+
+
+def _cached(key, compute):
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+        if hit and now - hit[0] < _facet_ttl():
+            return hit[1]
+
+    rows = compute()
+    with _lock:
+        _cache[key] = (now, rows)
+    return rows
+
+
+def invalidate(*models):
+    '''
+        Drops the cached facets built from the given models (all facets if none given).
+    '''
+    if not models or Order in models:
+        cache.delete(ORDER_YEARS_KEY)
+    with _lock:
+        if not models:
+            _cache.clear()
+            return
+        for key in list(_cache):
+            if key[0] in models:
+                del _cache[key]
+
+
+def customer_facet(field):
+    '''
+        Distinct values of a Customer field (e.g. 'country', 'city') with the number of customers for each.
+    '''
+    def compute():
+        return list(
+            Customer.objects.values(field).annotate(count=Count('customer_id')).order_by(field)
+        )
+    return _cached((Customer, field), compute)
+
+
+def category_facet():
+    '''
+        Categories that have products, with the number of products in each.
+    '''
+    def compute():
+        return list(
+            Product.objects.values(category_name=F('category__category_name')).annotate(
+                count=Count('product_id')
+            ).order_by('category_name')
+        )
+    return _cached((Product, 'category'), compute)
+
+
+def order_years():
+    '''
+        Every year an order was placed, as [{'Year': year}, ...] (see Order.AllOrderYears).
+    '''
+    def compute():
+        years = cache.get(ORDER_YEARS_KEY)
+        if years is None:
+            years = Order.AllOrderYears()
+            cache.set(ORDER_YEARS_KEY, years, timeout=getattr(settings, 'DJTRADERS_ORDER_YEARS_TTL', 3600))
+        return years
+    return _cached((Order, 'year'), compute)
+
+
+def record_order_year(order_date):
+    '''
+        Called when an order is written - only an order in a year not seen before changes the year list.
+    '''
+    if order_date and {'Year': order_date.year} not in order_years():
+        invalidate(Order)
@@ -0,0 +1,258 @@
+# Plotly figure specs built straight from column lists.
+#
+# The chart methods draw at most a few hundred points, so building a pandas DataFrame and letting
+# plotly express resolve columns, validate every property and merge the default template costs far
+# more than the query that produced the data.  bar() and line() build the same {'data', 'layout'}
+# JSON that px.bar / px.line produce for the options the charts use (a categorical or continuous
+# color column, wide form y columns, text_auto, hover data) from plain lists such as the columns of
+# a values_list() - only the standard library is imported.
+#
+# Figure has the two plotly.graph_objects.Figure methods the chart code uses, update_layout() and
+# to_json(), so render_chart() draws either kind of figure.
+import json
+import numbers
+from array import array
+
+# plotly express' default qualitative colors (px.colors.qualitative.Plotly)
+COLORWAY = ['#636efa', '#EF553B', '#00cc96', '#ab63fa', '#FFA15A',
+            '#19d3f3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
+
+# The continuous color scales the charts use, as px.colors.sequential lists.  'Plasma' is the default
+# of the plotly template.  (plotly.js has its own, different scales under some of the same names.)
+COLORSCALES = {
+    'Plasma': ['#0d0887', '#46039f', '#7201a8', '#9c179e', '#bd3786',
+               '#d8576b', '#ed7953', '#fb9f3a', '#fdca26', '#f0f921'],
+    'Jet': ['rgb(0,0,131)', 'rgb(0,60,170)', 'rgb(5,255,255)',
+            'rgb(255,255,0)', 'rgb(250,0,0)', 'rgb(128,0,0)'],
+    'Blues': ['rgb(247,251,255)', 'rgb(222,235,247)', 'rgb(198,219,239)', 'rgb(158,202,225)',
+              'rgb(107,174,214)', 'rgb(66,146,198)', 'rgb(33,113,181)', 'rgb(8,81,156)', 'rgb(8,48,107)'],
+    'Reds': ['rgb(255,245,240)', 'rgb(254,224,210)', 'rgb(252,187,161)', 'rgb(252,146,114)',
+             'rgb(251,106,74)', 'rgb(239,59,44)', 'rgb(203,24,29)', 'rgb(165,15,21)', 'rgb(103,0,13)'],
+}
+
+_AXIS = {
+    'gridcolor': 'white', 'linecolor': 'white', 'ticks': '', 'title': {'standoff': 15},
+    'zerolinecolor': 'white', 'automargin': True, 'zerolinewidth': 2,
+}
+
+# The parts of plotly's default 'plotly' template that a 2D bar or line chart uses.  The full template
+# (7.5 kB, mostly 3D / map / table defaults) was repeated in every chart's JSON.
+TEMPLATE = {
+    'data': {
+        'bar': [{'error_x': {'color': '#2a3f5f'}, 'error_y': {'color': '#2a3f5f'},
+                 'marker': {'line': {'color': '#E5ECF6', 'width': 0.5},
+                            'pattern': {'fillmode': 'overlay', 'size': 10, 'solidity': 0.2}},
+                 'type': 'bar'}],
+        'scatter': [{'fillpattern': {'fillmode': 'overlay', 'size': 10, 'solidity': 0.2}, 'type': 'scatter'}],
+    },
+    'layout': {
+        'autotypenumbers': 'strict',
+        'colorway': COLORWAY,
+        'font': {'color': '#2a3f5f'},
+        'hovermode': 'closest',
+        'hoverlabel': {'align': 'left'},
+        'paper_bgcolor': 'white',
+        'plot_bgcolor': '#E5ECF6',
+        'coloraxis': {'colorbar': {'outlinewidth': 0, 'ticks': ''}},
+        'xaxis': _AXIS,
+        'yaxis': _AXIS,
+        'title': {'x': 0.05},
+    },
+}
+
+
+def _plain(value):
+    '''
+        json.dumps fallback: Decimal -> float, date -> ISO string, numpy arrays and scalars -> lists / numbers.
+    '''
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def floats(column):
+    '''
+        A column of numbers as a typed array of floats, None counted as 0.  Sums of DecimalFields come
+        back as Decimals, which json.dumps would pass to _plain() one value at a time.
+    '''
+    return array('d', (0.0 if value is None else value for value in column))
+
+
+def _set_path(target, path, value):
+    # update_layout(yaxis_tickprefix='$') sets layout['yaxis']['tickprefix'], like plotly's magic underscores.
+    *parents, last = path.split('_')
+    for name in parents:
+        target = target.setdefault(name, {})
+    if last == 'title' and not isinstance(value, dict):
+        value = {'text': value}
+    if isinstance(value, dict) and isinstance(target.get(last), dict):
+        target[last].update(value)
+    else:
+        target[last] = value
+
+
+class Figure:
+    '''
+        A plotly figure as plain data: a list of trace dicts and a layout dict.
+    '''
+
+    def __init__(self, data=None, layout=None):
+        self.data = data or []
+        self.layout = {'template': TEMPLATE}
+        self.update_layout(**(layout or {}))
+
+    def update_layout(self, **properties):
+        for path, value in properties.items():
+            if value is not None:
+                _set_path(self.layout, path, value)
+        return self
+
+    def to_dict(self):
+        return {'data': self.data, 'layout': self.layout}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), default=_plain, separators=(',', ':'))
+
+
+def _is_continuous(values):
+    # px treats a numeric color column as a continuous scale and anything else as categories.
+    return all(isinstance(v, numbers.Number) and not isinstance(v, bool) for v in values if v is not None)
+
+
+def _hover(labels, *parts):
+    # px names each column once: a color column that is also the x or y column is not repeated.
+    shown, items = set(), []
+    for role, value in parts:
+        if labels[role] not in shown:
+            shown.add(labels[role])
+            items.append(f"{labels[role]}={value}")
+    return '<br>'.join(items) + '<extra></extra>'
+
+
+def _base_layout(labels, title, height, width, barmode=None):
+    layout = {
+        'xaxis': {'anchor': 'y', 'domain': [0.0, 1.0], 'title': {'text': labels['x']}},
+        'yaxis': {'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': labels['y']}},
+        'legend': {'tracegroupgap': 0},
+        'title': title,
+        'height': height,
+        'width': width,
+        'barmode': barmode,
+    }
+    if title is None:
+        layout['margin'] = {'t': 60}
+    return layout
+
+
+def bar(x, y, color=None, labels=None, text_auto=False, color_continuous_scale=None,
+        barmode='relative', title=None, height=None, width=None):
+    '''
+        The figure px.bar draws for the columns x and y.
+
+        y is one column, or a dict {name: column} for several columns (wide form: one trace per column,
+        like px.bar(df, y=[...])).  color is a column of categories (one trace and legend entry per distinct
+        value, in order of appearance) or of numbers (one trace on a continuous color_continuous_scale).
+        labels renames 'x', 'y', 'color', and for wide form 'value' and 'variable', as in plotly express.
+    '''
+    labels = {'x': 'x', 'y': 'y', 'color': 'color', 'value': 'value', 'variable': 'variable', **(labels or {})}
+    x = list(x)
+    common = {'orientation': 'v', 'textposition': 'auto', 'xaxis': 'x', 'yaxis': 'y', 'type': 'bar'}
+    if text_auto:
+        common['texttemplate'] = '%{y}'
+
+    traces = []
+    coloraxis = None
+    if isinstance(y, dict):
+        # Wide form: one trace per column, named after it.
+        for i, (name, column) in enumerate(y.items()):
+            traces.append({
+                'alignmentgroup': 'True', 'legendgroup': name, 'name': name, 'offsetgroup': name,
+                'showlegend': True, 'x': x, 'y': list(column),
+                'marker': {'color': COLORWAY[i % len(COLORWAY)], 'pattern': {'shape': ''}},
+                'hovertemplate': f"{labels['variable']}={name}<br>{labels['x']}=%{{x}}"
+                                 f"<br>{labels['value']}=%{{y}}<extra></extra>",
+                **common,
+            })
+        labels = {**labels, 'y': labels['value']}
+    elif color is None:
+        traces.append({
+            'alignmentgroup': 'True', 'legendgroup': '', 'name': '', 'offsetgroup': '',
+            'showlegend': False, 'x': x, 'y': list(y),
+            'marker': {'color': COLORWAY[0], 'pattern': {'shape': ''}},
+            'hovertemplate': f"{labels['x']}=%{{x}}<br>{labels['y']}=%{{y}}<extra></extra>",
+            **common,
+        })
+    else:
+        y, color = list(y), list(color)
+        if color_continuous_scale is not None or _is_continuous(color):
+            traces.append({
+                'alignmentgroup': 'True', 'legendgroup': '', 'name': '', 'offsetgroup': '',
+                'showlegend': False, 'x': x, 'y': y,
+                'marker': {'color': color, 'coloraxis': 'coloraxis', 'pattern': {'shape': ''}},
+                'hovertemplate': _hover(labels, ('x', '%{x}'), ('color', '%{marker.color}'), ('y', '%{y}'))
+                                 if labels['color'] == labels['y'] else
+                                 _hover(labels, ('x', '%{x}'), ('y', '%{y}'), ('color', '%{marker.color}')),
+                **common,
+            })
+            scale = COLORSCALES[color_continuous_scale or 'Plasma']
+            steps = len(scale) - 1
+            coloraxis = {
+                'colorbar': {'title': {'text': labels['color']}},
+                'colorscale': [[i / steps, c] for i, c in enumerate(scale)],
+            }
+        else:
+            # One trace per category, keeping the rows' order within each.
+            groups = {}
+            for xv, yv, cv in zip(x, y, color):
+                group = groups.setdefault(cv, ([], []))
+                group[0].append(xv)
+                group[1].append(yv)
+            for i, (category, (gx, gy)) in enumerate(groups.items()):
+                name = str(category)
+                traces.append({
+                    'alignmentgroup': 'True', 'legendgroup': name, 'name': name, 'offsetgroup': name,
+                    'showlegend': True, 'x': gx, 'y': gy,
+                    'marker': {'color': COLORWAY[i % len(COLORWAY)], 'pattern': {'shape': ''}},
+                    'hovertemplate': _hover(labels, ('x', '%{x}'), ('y', '%{y}')) if labels['color'] == labels['x']
+                                     else _hover(labels, ('color', name), ('x', '%{x}'), ('y', '%{y}')),
+                    **common,
+                })
+
+    layout = _base_layout(labels, title, height, width, barmode)
+    if isinstance(y, dict):
+        layout['legend']['title'] = {'text': labels['variable']}
+    elif coloraxis is not None:
+        layout['coloraxis'] = coloraxis
+    elif color is not None:
+        layout['legend']['title'] = {'text': labels['color']}
+        if labels['color'] == labels['x']:
+            # Colored by the x column itself: px pins the x categories to their order of appearance.
+            layout['xaxis'].update(categoryorder='array', categoryarray=list(dict.fromkeys(x)))
+    return Figure(traces, layout)
+
+
+def line(x, y, labels=None, hover_data=None, title=None, height=None, width=None):
+    '''
+        The figure px.line draws for the columns x and y.
+        hover_data is a dict {name: column} of extra columns shown on hover.
+    '''
+    labels = {'x': 'x', 'y': 'y', **(labels or {})}
+    trace = {
+        'legendgroup': '', 'name': '', 'orientation': 'v', 'showlegend': False, 'mode': 'lines',
+        'x': list(x), 'y': list(y),
+        'line': {'color': COLORWAY[0], 'dash': 'solid'}, 'marker': {'symbol': 'circle'},
+        'xaxis': 'x', 'yaxis': 'y', 'type': 'scatter',
+    }
+    hover = f"{labels['x']}=%{{x}}<br>{labels['y']}=%{{y}}"
+    if hover_data:
+        columns = [list(column) for column in hover_data.values()]
+        trace['customdata'] = [list(row) for row in zip(*columns)]
+        for i, name in enumerate(hover_data):
+            hover += f"<br>{name}=%{{customdata[{i}]}}"
+    trace['hovertemplate'] = hover + '<extra></extra>'
+    return Figure([trace], _base_layout(labels, title, height, width))
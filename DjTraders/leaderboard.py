@@ -0,0 +1,171 @@
+# In-memory Top Ten customers, by number of orders and by revenue.
+#
+# Every customer's score is kept in a dict, the current top K in a min-heap keyed by score, so a
+# new order (scores only go up) costs O(log K): the customer either already is in the top K, or
+# is compared with the weakest member and may replace it.  Anything that can lower a score (edits,
+# deletes) marks the board stale and it is rebuilt from customer_summary on the next read.
+#
+# Boards are per process, and tied to the chart data version (charts.py) every committed write moves
+# forward.  Writes made in this process are applied through signals.py, which then hands the board the
+# version its own write produced (adopt_version).  Any other change of the version - a write in another
+# worker, a bulk rebuild - means the board missed something, and it is rebuilt on the next read.
+# DJTRADERS_LEADERBOARD_TTL still bounds the age of a board, for writes that bypass the ORM entirely.
+import heapq
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+
+from .charts import data_version
+from .models import Customer, CustomerSummary
+
+
+class TopK:
+    '''
+        The k highest scores over all members.  Ties rank the lower member id first.
+    '''
+
+    def __init__(self, k):
+        self.k = k
+        self.scores = {}
+        self._heap = []        # (score, -member) of the top k, plus stale entries
+        self._members = set()
+
+    def load(self, scores):
+        self.scores = dict(scores)
+        best = heapq.nlargest(self.k, self.scores.items(), key=lambda item: (item[1], -item[0]))
+        self._members = {member for member, score in best}
+        self._heap = [(score, -member) for member, score in best]
+        heapq.heapify(self._heap)
+
+    def _weakest(self):
+        # Drop heap entries left behind by members that were raised or pushed out.
+        while self._heap:
+            score, negMember = self._heap[0]
+            if -negMember in self._members and self.scores[-negMember] == score:
+                return self._heap[0]
+            heapq.heappop(self._heap)
+        return None
+
+    def increase(self, member, amount):
+        score = self.scores.get(member, 0) + amount
+        self.scores[member] = score
+        entry = (score, -member)
+        if member in self._members:
+            heapq.heappush(self._heap, entry)
+        elif len(self._members) < self.k:
+            self._members.add(member)
+            heapq.heappush(self._heap, entry)
+        elif entry > self._weakest():
+            _, weakest = heapq.heappop(self._heap)
+            self._members.discard(-weakest)
+            self._members.add(member)
+            heapq.heappush(self._heap, entry)
+        # Keep the stale entries from piling up.
+        if len(self._heap) > 4 * self.k + 16:
+            self._heap = [(self.scores[m], -m) for m in self._members]
+            heapq.heapify(self._heap)
+
+    def top(self, n=None):
+        '''
+            [(member, score), ...] best first.
+        '''
+        ranked = sorted(self._members, key=lambda m: (-self.scores[m], m))
+        return [(m, self.scores[m]) for m in ranked[:n]]
+
+
+class Leaderboard:
+    '''
+        Top customers by order count and by lifetime revenue, built from customer_summary.
+    '''
+
+    def __init__(self, k=10):
+        self.k = k
+        self._lock = threading.Lock()
+        self._orders = TopK(k)
+        self._revenue = TopK(k)
+        self._names = {}
+        self._builtAt = None
+        self._version = None   # data version the board reflects
+
+    def _ttl(self):
+        return getattr(settings, 'DJTRADERS_LEADERBOARD_TTL', 300)
+
+    def _ensure_built(self):
+        # The version is read before the rows: a write committed in between leaves the board
+        # newer than its version, never older.
+        version = data_version()
+        if (self._builtAt is not None and version == self._version
+                and time.monotonic() - self._builtAt < self._ttl()):
+            return
+        rows = list(CustomerSummary.objects.values_list('customer_id', 'order_count', 'lifetime_revenue'))
+        self._orders.load((cid, orders) for cid, orders, revenue in rows)
+        self._revenue.load((cid, revenue) for cid, orders, revenue in rows)
+        self._names = {}
+        self._builtAt = time.monotonic()
+        self._version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._builtAt = None
+
+    def adopt_version(self, version):
+        '''
+            A write made in this process moved the data version to version, and has already been applied
+            to the board (or marked it stale).  Unless another process wrote in between, the board is
+            current under the new version.
+        '''
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def forget_customer(self, customer_id):
+        '''
+            A customer's name or country changed.
+        '''
+        with self._lock:
+            self._names.pop(customer_id, None)
+
+    def record_order(self, customer_id):
+        with self._lock:
+            if self._builtAt is not None:
+                self._orders.increase(customer_id, 1)
+
+    def record_revenue(self, customer_id, amount):
+        with self._lock:
+            if self._builtAt is not None and amount:
+                self._revenue.increase(customer_id, Decimal(amount))
+
+    def _rows(self, board, n, field):
+        with self._lock:
+            self._ensure_built()
+            ranked = board.top(n)
+            missing = [cid for cid, _ in ranked if cid not in self._names]
+            if missing:
+                # Only customers entering the top K are looked up.
+                for cid, name, country in Customer.objects.filter(pk__in=missing).values_list(
+                        'customer_id', 'customer_name', 'country'):
+                    self._names[cid] = (name, country)
+            return [
+                {'customer_name': self._names.get(cid, ('', ''))[0],
+                 'country': self._names.get(cid, ('', ''))[1],
+                 field: score}
+                for cid, score in ranked
+            ]
+
+    def top_by_orders(self, n=10):
+        '''
+            [{'customer_name', 'country', 'nOrders'}, ...] best first - the rows the Top Ten Customers
+            page and CustomersListJSON show.
+        '''
+        return self._rows(self._orders, n, 'nOrders')
+
+    def top_by_revenue(self, n=10):
+        '''
+            [{'customer_name', 'country', 'revenue'}, ...] best first.
+        '''
+        return self._rows(self._revenue, n, 'revenue')
+
+
+leaderboard = Leaderboard(k=getattr(settings, 'DJTRADERS_LEADERBOARD_SIZE', 10))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from DjTraders.models import OrderDetail
+
+
+class Command(BaseCommand):
+    help = (
+        "Sets order_details.unit_price from the current product price on lines that have none, "
+        "then rebuilds the sales_daily and customer_summary rollups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Width of the order_detail_id range updated per statement.',
+        )
+
+    def handle(self, *args, **options):
+        nUpdated = OrderDetail.BackfillUnitPrice(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Set unit_price on {nUpdated} order line(s)."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from DjTraders.models import Product
+
+
+class Command(BaseCommand):
+    help = "Backfills last_ordered_at and is_available for all products from the order history."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of products written per bulk_update batch.',
+        )
+
+    def handle(self, *args, **options):
+        nUpdated = Product.BackfillLastOrdered(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Updated last_ordered_at for {nUpdated} product(s)."))
@@ -0,0 +1,93 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from DjTraders.charts import chart_cache
+from DjTraders.models import Order, SalesDaily
+from DjTraders.views import ProductAnnualSales
+
+
+class Command(BaseCommand):
+    help = (
+        "Times Order.AnnualSales and the ProductAnnualSales page on a synthetic order history "
+        "(10M order lines by default), from the order lines and from the sales_daily rollup. "
+        "The synthetic rows are rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10_000_000, help='Synthetic order lines to insert.')
+        parser.add_argument('--lines-per-order', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement.')
+        parser.add_argument('--year', type=int, default=2010, help='Year for the drill-down measurements.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic orders.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The annual sales benchmark needs PostgreSQL (generate_series).")
+
+        year = options['year']
+        with transaction.atomic():
+            self.seed(options['lines'], options['lines_per_order'])
+            self.stdout.write("Rebuilding sales_daily ...")
+            rollupRows = SalesDaily.Rebuild()
+            self.stdout.write(f"sales_daily: {rollupRows} rows")
+
+            for rollup in (False, True):
+                source = 'sales_daily' if rollup else 'order lines'
+                self.report(f"AnnualSales()            [{source}]", options['repeat'],
+                            lambda: Order.AnnualSales(rollup=rollup))
+                self.report(f"AnnualSales(year={year})  [{source}]", options['repeat'],
+                            lambda: Order.AnnualSales(year=year, rollup=rollup))
+
+            # The whole page, with the chart cache cleared before every run so the chart is rebuilt.
+            request = RequestFactory().get('/DjTraders/ProductAnnualSales', {'year': year})
+            self.report(f"ProductAnnualSales view  [year={year}]", options['repeat'],
+                        lambda: (chart_cache.clear(), ProductAnnualSales(request)))
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def seed(self, lines, linesPerOrder):
+        nOrders = max(1, lines // linesPerOrder)
+        self.stdout.write(f"Inserting {nOrders} synthetic orders with {lines} order lines ...")
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COALESCE(MAX(order_id), 0) FROM orders')
+            firstId = cursor.fetchone()[0] + 1
+            # Dates spread over 1996 .. 2023, customers and products taken from the existing rows.
+            cursor.execute(
+                '''
+                INSERT INTO orders (order_id, customer_id, order_date)
+                SELECT %s + g, c.ids[1 + g %% array_length(c.ids, 1)], DATE '1996-01-01' + (g %% 10227)
+                FROM generate_series(0, %s - 1) AS g,
+                     (SELECT array_agg(customer_id) AS ids FROM customers) AS c
+                ''',
+                [firstId, nOrders],
+            )
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('orders', 'order_id'), (SELECT MAX(order_id) FROM orders))"
+            )
+            cursor.execute(
+                '''
+                INSERT INTO order_details (order_id, product_id, quantity, unit_price)
+                SELECT %s + g %% %s, p.ids[k.i], 1 + g %% 20, p.prices[k.i]
+                FROM generate_series(0, %s - 1) AS g,
+                     (SELECT array_agg(product_id ORDER BY product_id) AS ids,
+                             array_agg(price ORDER BY product_id) AS prices FROM products) AS p,
+                     LATERAL (SELECT 1 + (g * 7) %% array_length(p.ids, 1) AS i) AS k
+                ''',
+                [firstId, nOrders, lines],
+            )
+            cursor.execute('ANALYZE orders')
+            cursor.execute('ANALYZE order_details')
+
+    def report(self, label, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(f"{label}: median {statistics.median(timings):10.1f} ms   "
+                          f"min {min(timings):10.1f} ms")
@@ -0,0 +1,120 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from DjTraders import figures
+from DjTraders.charts import render_chart
+
+
+class Command(BaseCommand):
+    help = (
+        "Times building and rendering each kind of chart the analytics pages draw, the plotly express way "
+        "(rows -> pandas DataFrame -> px.bar / px.line -> update_layout) against figures.bar / figures.line "
+        "fed with the same rows as columns. No database access - the rows are synthetic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, nargs='+', default=[12, 100], help='Rows per chart.')
+        parser.add_argument('--repeat', type=int, default=200, help='Timed runs per measurement.')
+
+    def handle(self, *args, **options):
+        import pandas as pd
+        import plotly.express as px
+
+        # Warm up: the first px call imports and validates most of plotly.graph_objects.
+        self.measure(lambda: render_chart(px.bar(x=[1], y=[1])), 1)
+        self.measure(lambda: render_chart(figures.bar(x=[1], y=[1])), 1)
+
+        self.stdout.write(f"{'chart':28} {'points':>6} {'plotly express':>15} {'figures':>10} {'speedup':>8}")
+        for points in options['points']:
+            rows = [
+                {'Year': str(1996 + i), 'Month': 1 + i % 12, 'Name': f'Customer {i}',
+                 'OrderTotal': Decimal(1000 + 37 * i) / 4, 'TotalOrders': 3 + i % 7, 'TotalProductsSold': 40 + i}
+                for i in range(points)
+            ]
+            for label, slow, fast in self.charts(pd, px):
+                slowMs = self.measure(lambda: render_chart(slow(rows)), options['repeat'])
+                fastMs = self.measure(lambda: render_chart(fast(rows)), options['repeat'])
+                self.stdout.write(f"{label:28} {points:6} {slowMs:12.3f} ms {fastMs:7.3f} ms {slowMs / fastMs:7.1f}x")
+
+    def charts(self, pd, px):
+        '''
+            (label, plotly express builder, figures builder) for each chart shape.
+        '''
+        def categorical_px(rows):
+            fig = px.bar(pd.DataFrame(rows), x='Year', y='OrderTotal', color='Year', text_auto=True)
+            fig.update_layout(title='Annual Orders', xaxis_title="Order Year", yaxis_title="Order Total")
+            fig.update_layout(coloraxis_showscale=False, yaxis_tickprefix='$', yaxis_tickformat=',.2f')
+            return fig
+
+        def categorical_fast(rows):
+            years = [row['Year'] for row in rows]
+            fig = figures.bar(x=years, y=[row['OrderTotal'] for row in rows], color=years, text_auto=True,
+                              labels={'x': 'Year', 'y': 'OrderTotal', 'color': 'Year'})
+            fig.update_layout(title='Annual Orders', xaxis_title="Order Year", yaxis_title="Order Total")
+            fig.update_layout(coloraxis_showscale=False, yaxis_tickprefix='$', yaxis_tickformat=',.2f')
+            return fig
+
+        def continuous_px(rows):
+            fig = px.bar(pd.DataFrame(rows), x='Name', y='TotalOrders', color='TotalOrders',
+                         color_continuous_scale=px.colors.sequential.Jet, text_auto=True)
+            fig.update_layout(title='Top Customers by Number of Orders Placed')
+            return fig
+
+        def continuous_fast(rows):
+            orders = [row['TotalOrders'] for row in rows]
+            fig = figures.bar(x=[row['Name'] for row in rows], y=orders, color=orders,
+                              color_continuous_scale='Jet', text_auto=True,
+                              labels={'x': 'Name', 'y': 'TotalOrders', 'color': 'TotalOrders'})
+            fig.update_layout(title='Top Customers by Number of Orders Placed')
+            return fig
+
+        measures = ['OrderTotal', 'TotalProductsSold', 'TotalOrders']
+
+        def grouped_px(rows):
+            # Wide form needs one dtype across the measures, as in Order.AnnualSales.
+            frame = pd.DataFrame(rows).astype({'OrderTotal': 'float64'})
+            fig = px.bar(frame, x='Year', y=measures, text_auto=True, barmode='group',
+                         labels={'value': 'Metrics', 'variable': 'Metrics Type'}, title='Annual Sales Data')
+            fig.update_layout(xaxis_title="Time Period", yaxis_title="Values", legend_title="Metrics",
+                              yaxis_tickprefix='$')
+            return fig
+
+        def grouped_fast(rows):
+            fig = figures.bar(x=[row['Year'] for row in rows],
+                              y={m: [row[m] for row in rows] for m in measures}, text_auto=True, barmode='group',
+                              labels={'x': 'Year', 'value': 'Metrics', 'variable': 'Metrics Type'},
+                              title='Annual Sales Data')
+            fig.update_layout(xaxis_title="Time Period", yaxis_title="Values", legend_title="Metrics",
+                              yaxis_tickprefix='$')
+            return fig
+
+        def line_px(rows):
+            return px.line(pd.DataFrame(rows), x='Month', y='OrderTotal', title='Monthly Sales Comparison',
+                           hover_data=['Year', 'TotalOrders'])
+
+        def line_fast(rows):
+            return figures.line(x=[row['Month'] for row in rows], y=[row['OrderTotal'] for row in rows],
+                                labels={'x': 'Month', 'y': 'OrderTotal'}, title='Monthly Sales Comparison',
+                                hover_data={'Year': [row['Year'] for row in rows],
+                                            'TotalOrders': [row['TotalOrders'] for row in rows]})
+
+        return [
+            ('bar, color by category', categorical_px, categorical_fast),
+            ('bar, continuous color', continuous_px, continuous_fast),
+            ('grouped bar', grouped_px, grouped_fast),
+            ('line with hover data', line_px, line_fast),
+        ]
+
+    def measure(self, run, repeat):
+        '''
+            Median milliseconds per run.
+        '''
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
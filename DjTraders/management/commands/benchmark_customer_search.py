@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from DjTraders.models import Customer
+from DjTraders.search import search_filter, search_ordering
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares Customers list search latency for icontains vs the pg_trgm search "
+        "on a synthetic customers table (1M rows by default). "
+        "The synthetic rows are rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Synthetic customers to insert.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per search term.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic customers.')
+        parser.add_argument('terms', nargs='*', default=['cust 4242', 'berlin', 'zz'])
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The search benchmark needs PostgreSQL with the pg_trgm extension.")
+
+        with transaction.atomic():
+            self.seed(options['rows'])
+            for term in options['terms']:
+                plain = self.time_search(term, options['repeat'], trigram=False)
+                trigram = self.time_search(term, options['repeat'], trigram=True)
+                self.stdout.write(
+                    f"{term!r:>14}: icontains {plain:9.2f} ms   pg_trgm {trigram:9.2f} ms   "
+                    f"speedup x{plain / trigram if trigram else 0:.1f}"
+                )
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def seed(self, rows):
+        self.stdout.write(f"Inserting {rows} synthetic customers ...")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                INSERT INTO customers (customer_name, contact_name, address, city, postal_code, country, is_active)
+                SELECT 'Cust ' || g || ' ' || md5(g::text),
+                       'Contact ' || md5((g * 7)::text),
+                       g || ' Main Street',
+                       (ARRAY['Berlin', 'London', 'Madrid', 'Paris', 'Seattle', 'Lima'])[1 + g % 6],
+                       lpad((g % 99999)::text, 5, '0'),
+                       (ARRAY['Germany', 'UK', 'Spain', 'France', 'USA', 'Peru'])[1 + g % 6],
+                       true
+                FROM generate_series(1, %s) AS g
+                ''',
+                [rows],
+            )
+            cursor.execute('ANALYZE customers')
+
+    def time_search(self, term, repeat, trigram):
+        customers = Customer.objects.all()
+        if trigram:
+            customers = search_ordering(search_filter(customers, 'customer_name', term), 'customer_name')
+        else:
+            customers = customers.filter(customer_name__icontains=term).order_by('customer_name')
+        page = customers[:15]
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(page)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
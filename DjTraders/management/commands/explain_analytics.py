@@ -0,0 +1,102 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from DjTraders import facets, views
+from DjTraders.charts import chart_cache
+from DjTraders.models import Category, Customer, Product
+
+# Indexes whose effect is measured: the foreign key / covering indexes (0008, covers rebuilt with line_total
+# in 0011) and the order_date ones (0007).
+INDEX_NAMES = [
+    'order_details_product_line_cover',
+    'order_details_order_line_cover',
+    'products_category_idx',
+    'orders_order_date_idx',
+    'orders_customer_date_idx',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs every analytics view once, captures its SQL and reports the summed EXPLAIN ANALYZE "
+        "execution time with the join indexes and without them (dropped inside a transaction that is "
+        "rolled back). DROP INDEX takes an exclusive lock on the tables - run it against a copy of the data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', help='Year selection for the views that take one (default: the latest year).')
+        parser.add_argument('--plans', action='store_true', help='Print the plan of every query.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("EXPLAIN (ANALYZE, FORMAT JSON) timings need PostgreSQL.")
+
+        years = facets.order_years()
+        year = options['year'] or (str(years[-1]['Year']) if years else '')
+        customer = Customer.objects.filter(order__isnull=False).first()
+        product = Product.objects.filter(orderdetail__isnull=False).first()
+        category = Category.objects.first()
+        if not (customer and product and category):
+            raise CommandError("Needs at least one customer with orders, one product with order lines and a category.")
+
+        factory = RequestFactory()
+        customerArgs = {'customer_id': customer.pk}
+        analytics = [
+            ('OrdersPlaced', views.OrdersPlaced, factory.get('/', customerArgs), {}),
+            ('OrdersByDate', views.OrdersByDate, factory.get('/', {**customerArgs, 'selOrderYear': year}), {}),
+            ('OrdersByProduct', views.OrdersByProduct, factory.get('/', customerArgs), {}),
+            ('OrdersByCategory', views.OrdersByCategory, factory.get('/', customerArgs), {}),
+            ('CustomerDetail', views.DjTradersCustomerDetailView.as_view(), factory.get('/'), {'pk': customer.pk}),
+            ('ProductAnnualMonthlySales', views.ProductAnnualMonthlySales,
+             factory.get('/', {'selOrderYear': year}), {'pk': product.pk}),
+            ('product_sales_analysis', views.product_sales_analysis,
+             factory.get('/', {'selOrderYear': year}), {'pk': product.pk}),
+            ('plot_top_bottom_product_analysis', views.plot_top_bottom_product_analysis,
+             factory.get('/', {'selOrderYear': year}), {}),
+            ('CategoryAnalysis', views.CategoryAnalysis, factory.get('/'), {'pk': category.pk}),
+            ('ProductAnnualSales', views.ProductAnnualSales, factory.get('/', {'year': year}), {}),
+        ]
+
+        self.stdout.write(f"{'view':34} {'queries':>7} {'without idx':>12} {'with idx':>12}")
+        for label, view, request, kwargs in analytics:
+            statements = self.capture(view, request, kwargs)
+            with transaction.atomic():
+                withIndexes = self.explain(statements, options['plans'])
+                self.drop_indexes()
+                withoutIndexes = self.explain(statements, options['plans'])
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"{label:34} {len(statements):7} {withoutIndexes:10.1f}ms {withIndexes:10.1f}ms"
+            )
+
+    def capture(self, view, request, kwargs):
+        '''
+            The SELECT statements the view runs with empty caches.
+        '''
+        chart_cache.clear()
+        facets.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            view(request, **kwargs)
+        return [q['sql'] for q in queries.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+
+    def explain(self, statements, showPlans):
+        total = 0.0
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                total += plan[0]['Execution Time']
+                if showPlans:
+                    self.stdout.write(json.dumps(plan[0]['Plan'], indent=2))
+        return total
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for name in INDEX_NAMES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
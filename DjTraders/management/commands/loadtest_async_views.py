@@ -0,0 +1,127 @@
+import asyncio
+import importlib.util
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from DjTraders.models import Customer
+
+# The customer detail page's AJAX partials: (sync path, async path).
+PARTIALS = [
+    ('/DjTraders/OrdersPlaced', '/DjTraders/async/OrdersPlaced'),
+    ('/DjTraders/OrdersByDate', '/DjTraders/async/OrdersByDate'),
+    ('/DjTraders/OrdersByProduct', '/DjTraders/async/OrdersByProduct'),
+    ('/DjTraders/OrdersByCategory', '/DjTraders/async/OrdersByCategory'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts one uvicorn worker (DjangoTraders.asgi) and loads the customer detail partials "
+        "(OrdersPlaced, OrdersByDate, OrdersByProduct, OrdersByCategory) at increasing concurrency, "
+        "through the sync views and through their async versions (DjTraders/async/...). "
+        "Reports requests per second and latency percentiles. Needs uvicorn (pip install uvicorn)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64],
+                            help='Concurrent clients per run.')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per run.')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--customers', type=int, default=50,
+                            help='Customers the requests rotate over (the chart partials are cached per customer).')
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec('uvicorn') is None:
+            raise CommandError("The load test runs the site under uvicorn: pip install uvicorn")
+
+        customerIds = list(Customer.objects.filter(order__isnull=False).distinct()
+                           .order_by('customer_id').values_list('customer_id', flat=True)[:options['customers']])
+        if not customerIds:
+            raise CommandError("Needs at least one customer with orders.")
+
+        server = self.start_server(options['port'])
+        try:
+            self.stdout.write(f"{'views':6} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6}")
+            for concurrency in options['concurrency']:
+                for variant in ('sync', 'async'):
+                    paths = [
+                        f"{partial[variant == 'async']}?customer_id={customerId}"
+                        for customerId in customerIds for partial in PARTIALS
+                    ]
+                    elapsed, latencies, errors = asyncio.run(
+                        self.run(options['port'], paths, options['requests'], concurrency))
+                    latencies.sort()
+                    self.stdout.write(
+                        f"{variant:6} {concurrency:7} {len(latencies) / elapsed:8.1f} "
+                        f"{statistics.median(latencies):8.1f} {latencies[int(len(latencies) * 0.95) - 1]:8.1f} "
+                        f"{errors:6}"
+                    )
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    def start_server(self, port):
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'DjangoTraders.asgi:application',
+             '--port', str(port), '--workers', '1', '--log-level', 'warning', '--no-access-log'],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE},
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("uvicorn exited during startup.")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f"uvicorn did not start listening on port {port}.")
+
+    async def run(self, port, paths, total, concurrency):
+        '''
+            total GET requests over paths (round robin) from concurrency clients.
+            Returns (seconds, [latency ms of each successful request], error count).
+        '''
+        queue = asyncio.Queue()
+        for i in range(total):
+            queue.put_nowait(paths[i % len(paths)])
+        latencies, errors = [], 0
+
+        async def client():
+            nonlocal errors
+            while not queue.empty():
+                path = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    status = await self.get(port, path)
+                except OSError:
+                    status = None
+                if status == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies or [0.0], errors
+
+    async def get(self, port, path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            statusLine = await reader.readline()
+            while await reader.read(65536):
+                pass
+            return int(statusLine.split()[1])
+        finally:
+            writer.close()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from DjTraders.models import CustomerSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the customer_summary table from orders and order_details."
+
+    def handle(self, *args, **options):
+        rows = CustomerSummary.Rebuild()
+        self.stdout.write(self.style.SUCCESS(f"customer_summary rebuilt: {rows} rows."))
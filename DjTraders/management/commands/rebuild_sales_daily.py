@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from DjTraders.models import SalesDaily
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the sales_daily rollup table from orders, order_details and products."
+
+    def handle(self, *args, **options):
+        rows = SalesDaily.Rebuild()
+        self.stdout.write(self.style.SUCCESS(f"sales_daily rebuilt: {rows} rows."))
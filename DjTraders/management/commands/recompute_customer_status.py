@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from DjTraders.models import Customer
+
+
+class Command(BaseCommand):
+    help = "Recomputes the stored is_active flag for all customers from their latest order date."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of customers written per bulk_update batch.',
+        )
+
+    def handle(self, *args, **options):
+        nUpdated = Customer.RecomputeActiveStatus(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Updated is_active for {nUpdated} customer(s)."))
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DjTraders', '0003_auto_20241103_2333'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='last_ordered_at',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
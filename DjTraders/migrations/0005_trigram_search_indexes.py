@@ -0,0 +1,54 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations
+
+from ._indexes import create_concurrently, drop_concurrently
+
+# The GIN trigram indexes are built concurrently, without blocking writes to customers and products
+# for the length of the build - hence atomic = False.
+# categories is managed = False, so Django will not create indexes for it - added by hand (see _indexes.py).
+CATEGORY_INDEXES = [
+    ('categories_name_trgm', 'categories', 'USING gin (category_name gin_trgm_ops)'),
+]
+
+
+def create_category_index(apps, schema_editor):
+    create_concurrently(schema_editor, CATEGORY_INDEXES)
+
+
+def drop_category_index(apps, schema_editor):
+    drop_concurrently(schema_editor, CATEGORY_INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('DjTraders', '0004_product_last_ordered_at'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='customer',
+            index=GinIndex(fields=['customer_name'], opclasses=['gin_trgm_ops'], name='customers_name_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='customer',
+            index=GinIndex(fields=['contact_name'], opclasses=['gin_trgm_ops'], name='customers_contact_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='customer',
+            index=GinIndex(fields=['city'], opclasses=['gin_trgm_ops'], name='customers_city_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='customer',
+            index=GinIndex(fields=['country'], opclasses=['gin_trgm_ops'], name='customers_country_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=GinIndex(fields=['product_name'], opclasses=['gin_trgm_ops'], name='products_name_trgm'),
+        ),
+        migrations.RunPython(create_category_index, drop_category_index),
+    ]
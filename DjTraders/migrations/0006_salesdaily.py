@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DjTraders', '0005_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='DjTraders.category')),
+                ('customer', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='DjTraders.customer')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='DjTraders.product')),
+            ],
+            options={
+                'db_table': 'sales_daily',
+                'managed': True,
+                'indexes': [
+                    models.Index(fields=['product', 'day'], name='sales_daily_product_day'),
+                    models.Index(fields=['customer', 'day'], name='sales_daily_customer_day'),
+                ],
+                'constraints': [
+                    models.UniqueConstraint(fields=('day', 'product', 'customer'), name='sales_daily_cell'),
+                ],
+            },
+        ),
+        # Fill the table from the existing order history.
+        migrations.RunSQL(
+            '''
+            INSERT INTO sales_daily (day, product_id, customer_id, category_id, quantity, revenue, order_count)
+            SELECT o.order_date, d.product_id, o.customer_id, p.category_id,
+                   COALESCE(SUM(d.quantity), 0),
+                   COALESCE(SUM(d.quantity * p.price), 0),
+                   COUNT(DISTINCT d.order_id)
+            FROM order_details d
+            JOIN orders o ON o.order_id = d.order_id
+            JOIN products p ON p.product_id = d.product_id
+            GROUP BY o.order_date, d.product_id, o.customer_id, p.category_id
+            ''',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+from ._indexes import create_concurrently, drop_concurrently
+
+# orders is managed = False, so Django will not create indexes for it - add them by hand.
+# They serve the order_date range predicates built by timewindow.py.
+# Built concurrently, without blocking order writes (see _indexes.py) - hence atomic = False.
+INDEXES = [
+    ('orders_order_date_idx', 'orders', '(order_date)'),
+    ('orders_customer_date_idx', 'orders', '(customer_id, order_date)'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    create_concurrently(schema_editor, INDEXES)
+
+
+def drop_indexes(apps, schema_editor):
+    drop_concurrently(schema_editor, INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('DjTraders', '0006_salesdaily'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+from ._indexes import create_concurrently, drop_concurrently
+
+# The Northwind tables were created outside Django (orders and order_details are still
+# managed = False), so no migration ever indexed the foreign keys every analytics query joins on.
+# Built concurrently, without blocking writes (see _indexes.py) - hence atomic = False.
+#
+# orders(customer_id) is served by orders_customer_date_idx (customer_id, order_date) from 0007.
+INDEXES = [
+    # Revenue / quantity aggregates per product read only the index (index-only scan).
+    ('order_details_product_cover', 'order_details', '(product_id) INCLUDE (quantity, order_id)'),
+    # Order totals and the order -> lines joins.
+    ('order_details_order_cover', 'order_details', '(order_id) INCLUDE (product_id, quantity)'),
+    ('products_category_idx', 'products', '(category_id)'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    create_concurrently(schema_editor, INDEXES)
+
+
+def drop_indexes(apps, schema_editor):
+    drop_concurrently(schema_editor, INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('DjTraders', '0007_orders_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
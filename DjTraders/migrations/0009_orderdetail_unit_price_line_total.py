@@ -0,0 +1,96 @@
+import django.db.models.expressions
+from django.db import migrations, models, transaction
+
+# Lines updated per statement by the backfill - each batch commits on its own (atomic = False),
+# so no single UPDATE holds locks on the whole table.
+BATCH_SIZE = 10000
+
+
+def backfill_unit_price(apps, schema_editor):
+    '''
+        Existing lines get the product's current price as their unit_price - what the revenue
+        queries used to multiply by - so line_total is set on the whole history.
+    '''
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(order_detail_id), MAX(order_detail_id) FROM order_details '
+                       'WHERE unit_price IS NULL')
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+        for start in range(low, high + 1, BATCH_SIZE):
+            cursor.execute(
+                '''
+                UPDATE order_details d SET unit_price = p.price
+                FROM products p
+                WHERE p.product_id = d.product_id AND d.unit_price IS NULL
+                  AND d.order_detail_id >= %s AND d.order_detail_id < %s
+                ''',
+                [start, start + BATCH_SIZE],
+            )
+
+
+def rebuild_sales_daily(apps, schema_editor):
+    # sales_daily (0006) now sums line_total, like "manage.py rebuild_sales_daily".
+    with transaction.atomic(using=schema_editor.connection.alias):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM sales_daily')
+            cursor.execute(
+                '''
+                INSERT INTO sales_daily (day, product_id, customer_id, category_id, quantity, revenue, order_count)
+                SELECT o.order_date, d.product_id, o.customer_id, p.category_id,
+                       COALESCE(SUM(d.quantity), 0),
+                       COALESCE(SUM(d.line_total), 0),
+                       COUNT(DISTINCT d.order_id)
+                FROM order_details d
+                JOIN orders o ON o.order_id = d.order_id
+                JOIN products p ON p.product_id = d.product_id
+                GROUP BY o.order_date, d.product_id, o.customer_id, p.category_id
+                '''
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('DjTraders', '0008_northwind_join_indexes'),
+    ]
+
+    # order_details is managed = False, so the columns are added by hand and the model state separately.
+    # Existing lines are backfilled here; "manage.py backfill_order_unit_price" fills lines written
+    # later by programs that do not set unit_price.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='ALTER TABLE order_details ADD COLUMN IF NOT EXISTS unit_price numeric(10, 2);',
+                    reverse_sql='ALTER TABLE order_details DROP COLUMN IF EXISTS unit_price;',
+                ),
+                migrations.RunSQL(
+                    sql='ALTER TABLE order_details ADD COLUMN IF NOT EXISTS line_total numeric(12, 2) '
+                        'GENERATED ALWAYS AS (quantity * unit_price) STORED;',
+                    reverse_sql='ALTER TABLE order_details DROP COLUMN IF EXISTS line_total;',
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='orderdetail',
+                    name='unit_price',
+                    field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+                ),
+                migrations.AddField(
+                    model_name='orderdetail',
+                    name='line_total',
+                    field=models.GeneratedField(
+                        db_persist=True,
+                        expression=django.db.models.expressions.CombinedExpression(
+                            models.F('quantity'), '*', models.F('unit_price')),
+                        output_field=models.DecimalField(decimal_places=2, max_digits=12),
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill_unit_price, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_sales_daily, migrations.RunPython.noop),
+    ]
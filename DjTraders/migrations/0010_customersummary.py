@@ -0,0 +1,53 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('DjTraders', '0009_orderdetail_unit_price_line_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSummary',
+            fields=[
+                ('customer', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='summary', serialize=False, to='DjTraders.customer')),
+                ('order_count', models.IntegerField(default=0)),
+                ('first_order_date', models.DateField(blank=True, null=True)),
+                ('last_order_date', models.DateField(blank=True, null=True)),
+                ('lifetime_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('distinct_products', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'customer_summary',
+                'managed': True,
+                'indexes': [
+                    models.Index(fields=['-order_count'], name='customer_summary_orders'),
+                    models.Index(fields=['-lifetime_revenue'], name='customer_summary_revenue'),
+                ],
+            },
+        ),
+        # Fill the table from the existing order history (unit_price was backfilled by 0009).
+        migrations.RunSQL(
+            '''
+            INSERT INTO customer_summary
+                (customer_id, order_count, first_order_date, last_order_date, lifetime_revenue, distinct_products)
+            SELECT o.customer_id, o.order_count, o.first_order_date, o.last_order_date,
+                   COALESCE(l.revenue, 0), COALESCE(l.products, 0)
+            FROM (
+                SELECT customer_id, COUNT(*) AS order_count,
+                       MIN(order_date) AS first_order_date, MAX(order_date) AS last_order_date
+                FROM orders
+                GROUP BY customer_id
+            ) o
+            LEFT JOIN (
+                SELECT ord.customer_id, SUM(d.line_total) AS revenue, COUNT(DISTINCT d.product_id) AS products
+                FROM order_details d
+                JOIN orders ord ON ord.order_id = d.order_id
+                GROUP BY ord.customer_id
+            ) l ON l.customer_id = o.customer_id
+            ''',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
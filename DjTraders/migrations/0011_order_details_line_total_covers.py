@@ -0,0 +1,42 @@
+from django.db import migrations
+
+from ._indexes import create_concurrently, drop_concurrently
+
+# The revenue aggregates read order_details.line_total (0009), which the covering indexes from 0008
+# do not include - every revenue query went back to the table for it.  The covers are rebuilt with
+# line_total (an index's INCLUDE list cannot be altered), then the old ones are dropped.
+# Built concurrently, without blocking writes (see _indexes.py) - hence atomic = False.
+INDEXES = [
+    # Revenue / quantity aggregates per product read only the index (index-only scan).
+    ('order_details_product_line_cover', 'order_details', '(product_id) INCLUDE (quantity, order_id, line_total)'),
+    # Order totals and the order -> lines joins.
+    ('order_details_order_line_cover', 'order_details', '(order_id) INCLUDE (product_id, quantity, line_total)'),
+]
+
+OLD_INDEXES = [
+    ('order_details_product_cover', 'order_details', '(product_id) INCLUDE (quantity, order_id)'),
+    ('order_details_order_cover', 'order_details', '(order_id) INCLUDE (product_id, quantity)'),
+]
+
+
+def replace_covers(apps, schema_editor):
+    create_concurrently(schema_editor, INDEXES)
+    drop_concurrently(schema_editor, OLD_INDEXES)
+
+
+def restore_covers(apps, schema_editor):
+    create_concurrently(schema_editor, OLD_INDEXES)
+    drop_concurrently(schema_editor, INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('DjTraders', '0010_customersummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_covers, restore_covers),
+    ]
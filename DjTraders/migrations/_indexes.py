@@ -0,0 +1,38 @@
+# Index builds for the tables created outside Django, shared by the migrations that add them.
+# (Modules starting with "_" are not loaded as migrations.)
+#
+# The indexes are built with CREATE INDEX CONCURRENTLY, which does not block writes to the table
+# but cannot run inside a transaction - a migration using these needs atomic = False.  Every step
+# is idempotent: an index that already exists is kept, and an INVALID one left behind by an
+# interrupted concurrent build is dropped and rebuilt.
+#
+# indexes is a list of (name, table, definition) - the definition is the SQL after "ON table".
+
+
+def create_concurrently(schema_editor, indexes):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name, table, definition in indexes:
+            cursor.execute(
+                '''
+                SELECT i.indisvalid FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)
+                ''',
+                [name],
+            )
+            row = cursor.fetchone()
+            if row and row[0]:
+                continue
+            if row:
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}')
+
+
+def drop_concurrently(schema_editor, indexes):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name, table, definition in indexes:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
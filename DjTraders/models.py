@@ -5,18 +5,20 @@
 # #   * Make sure each ForeignKey and OneToOneField has `on_delete` set to the desired behavior
 # #   * Remove `managed = False` lines if you wish to allow Django to create, modify, and delete the table
 # # Feel free to rename the models, but don't rename db_table values or field names.
-from django.db import models
-from django.db.models import F, Sum, Count, Max
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.db.models import F, Sum, Count, Max, Min, Case, When, Value, Prefetch, OuterRef, Subquery
 from decimal import Decimal
 #from django.utils import timezone
 from datetime import timedelta
 import datetime
 #from datetime import datetime
 from django.db.models.functions import ExtractYear, ExtractMonth, Cast, Coalesce
-import plotly.express as px
-from plotly.offline import plot
+from . import figures
+from .charts import render_chart, cached_chart, run_figure, bump_data_version
+from .timewindow import filter_window
 import calendar
-import pandas as pd
 
 class Category(models.Model):
     category_id = models.AutoField(primary_key=True)
@@ -53,34 +55,121 @@ class Customer(models.Model):
     class Meta:
         managed = True
         db_table = 'customers'
+        # Trigram indexes for the Customers list search (see search.py)
+        indexes = [
+            GinIndex(fields=['customer_name'], opclasses=['gin_trgm_ops'], name='customers_name_trgm'),
+            GinIndex(fields=['contact_name'], opclasses=['gin_trgm_ops'], name='customers_contact_trgm'),
+            GinIndex(fields=['city'], opclasses=['gin_trgm_ops'], name='customers_city_trgm'),
+            GinIndex(fields=['country'], opclasses=['gin_trgm_ops'], name='customers_country_trgm'),
+        ]
      
     def CustomerOrders(self):
         orders = Order.objects.all().filter(customer = self.customer_id)
         return orders
     
+    def OrdersWithDetails(self):
+        '''
+            Loads all of this customer's orders for the Orders Placed accordion in two queries,
+            however many orders there are:
+                1. the orders, each with OrderAmount summed in the database, and
+                2. all their order lines (as order.lines) with the product joined in and LineTotal from line_total.
+            The list is kept on the instance; aOrdersWithDetails() loads it with the async ORM.
+        '''
+        if getattr(self, '_ordersWithDetails', None) is None:
+            self._ordersWithDetails = list(self.OrdersWithDetailsRows())
+        return self._ordersWithDetails
+
+    async def aOrdersWithDetails(self):
+        if getattr(self, '_ordersWithDetails', None) is None:
+            self._ordersWithDetails = [order async for order in self.OrdersWithDetailsRows()]
+        return self._ordersWithDetails
+
+    def OrdersWithDetailsRows(self):
+        orderLines = OrderDetail.objects.select_related('product').annotate(
+            LineTotal = F('line_total'),
+        ).order_by('order_detail_id')
+
+        orders = self.CustomerOrders().annotate(
+            OrderAmount = Coalesce(Sum('orderdetail__line_total'), Decimal("0.00"),
+                                   output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        ).order_by('order_date', 'order_id').prefetch_related(
+            Prefetch('orderdetail_set', queryset=orderLines, to_attr='lines')
+        )
+        return orders
+
+    def Summary(self):
+        '''
+            This customer's CustomerSummary row - an unsaved all-zero one if the customer never ordered.
+        '''
+        try:
+            return self.summary
+        except CustomerSummary.DoesNotExist:
+            return CustomerSummary(customer=self)
+
     def NumberOfOrders(self):
-        orders = Order.objects.all().filter(customer = self.customer_id)
-        return orders.count()
+        return self.Summary().order_count
     
     def get_customer_latest_order_date(self):
-        customer_latest_order = Order.objects.filter(customer=self).aggregate(latest_order_date=Max('order_date'))
-        return customer_latest_order['latest_order_date']
+        return self.Summary().last_order_date
  
+    @staticmethod
+    def ActivityCutoffDate():
+        '''
+            A customer (or product) is "active" if it has an order placed after this date.
+        '''
+        return datetime.datetime.now().date() - timedelta(days=365)
+
+    @staticmethod
+    def WithActivityStatus(customers):
+        '''
+            Annotates a customer queryset with the latest order date and the active/inactive status,
+            so a whole page of customers gets its status from the list query itself.
+            The date comes from customer_summary (a join, no aggregation over the orders).
+            Customers that never placed an order are reported as Active (same as get_activeStatus).
+        '''
+        one_year_ago = Customer.ActivityCutoffDate()
+        return customers.annotate(
+            latest_order_date = F('summary__last_order_date'),
+        ).annotate(
+            activeStatus = Case(
+                When(latest_order_date__isnull=True, then=Value("Active")),
+                When(latest_order_date__gt=one_year_ago, then=Value("Active")),
+                default=Value("Inactive"),
+                output_field=models.CharField(),
+            ),
+        )
+
     def get_activeStatus(self):
-        one_year_ago = datetime.datetime.now().date() - timedelta(days=365)
+        '''
+            Returns "Active" or "Inactive" without writing to the database.
+            Uses the annotation from WithActivityStatus() when present, otherwise queries the orders.
+            The app never reads the stored is_active flag (it goes stale as the cutoff date moves);
+            it is kept for reports that read the table and refreshed in bulk by RecomputeActiveStatus().
+        '''
+        if hasattr(self, 'activeStatus'):
+            return self.activeStatus
+
         customer_latest_order_date = self.get_customer_latest_order_date()
- 
-        if customer_latest_order_date:
-            if customer_latest_order_date > one_year_ago:
-                self.is_active = True
-                self.save()
-                return "Active"
-            else:
-                self.is_active = False
-                self.save()
-                return "Inactive"
-        else:
-            return "Active"
+        if customer_latest_order_date and customer_latest_order_date <= Customer.ActivityCutoffDate():
+            return "Inactive"
+        return "Active"
+
+    @staticmethod
+    def RecomputeActiveStatus(batch_size=500):
+        '''
+            Recomputes the stored is_active flag for every customer whose flag is out of date,
+            using one annotated query and batched bulk_update calls.
+            Returns the number of customers updated.
+        '''
+        changed = []
+        for customer in Customer.WithActivityStatus(Customer.objects.all()).iterator(chunk_size=batch_size):
+            is_active = customer.activeStatus == "Active"
+            if customer.is_active != is_active:
+                customer.is_active = is_active
+                changed.append(customer)
+
+        Customer.objects.bulk_update(changed, ['is_active'], batch_size=batch_size)
+        return len(changed)
 
     def __str__(self):
         return (
@@ -88,40 +177,47 @@ class Customer(models.Model):
       		+ " [Contact: "+ self.contact_name +  "]"
         )
         
+    # Each plot method below is split in two: ...Rows() returns the (lazy) queryset of the values the chart
+    # needs, ...Figure(rows) builds the chart HTML from them without touching the database.
+    # The plot method runs both; its async twin (a...) fetches the rows with the async ORM and builds the
+    # figure on the figure executor (see charts.run_figure) - for the async views in async_views.py.
+
     # v3.2 Added - Member function in Customers class to generate Orders Plot based on supplied year
-    def OrdersPlacedPlot(self, year):
-        customerOrders = self.CustomerOrders().order_by('order_date').annotate(
-        Year = ExtractYear("order_date"),
-        Month = ExtractMonth("order_date"),
-        CustomerName = F('customer__customer_name'),
-        OrderTotal = Sum(F('orderdetail__product__price')*F('orderdetail__quantity')),
-        NumberOfProducts = Count('orderdetail'),
+    @cached_chart('Customer.OrdersPlacedPlot', 'OrdersPlacedRows', 'OrdersPlacedFigure')
+    def OrdersPlacedPlot(self, year, window=None):
+        return self.OrdersPlacedFigure(list(self.OrdersPlacedRows(year, window)))
+
+    @cached_chart('Customer.OrdersPlacedPlot')
+    async def aOrdersPlacedPlot(self, year, window=None):
+        rows = [row async for row in self.OrdersPlacedRows(year, window)]
+        return await run_figure(self.OrdersPlacedFigure, rows)
+
+    # (order_date, OrderTotal, order_id) for each order placed in the year / time window
+    def OrdersPlacedRows(self, year, window=None):
+        # A date range on order_date, answered from the orders(customer_id, order_date) index.
+        customerOrders = filter_window(self.CustomerOrders(), 'order_date', window, year=year)
+        customerOrders = customerOrders.order_by('order_date').annotate(
+        OrderTotal = Sum('orderdetail__line_total'),
         #   ProductName = F('orderdetail__product__product_name'),
         #   CategoryName = F('orderdetail__product__category__category_name'),
         #   TotalQuantity = Sum('orderdetail__quantity'),
         #   ProductPrice = Sum('orderdetail__product__price'),
         )
-        if year: 
-            customerOrders = customerOrders.filter(Year__contains= year)
+        return customerOrders.values_list('order_date', 'OrderTotal', 'order_id')
 
-        if customerOrders.count()==0:
+    def OrdersPlacedFigure(self, orderRows):
+        if not orderRows:
             return '<div> No Orders placed</div>'
 
-        #print(list(customerOrders.values_list()))
-
-        ordersdFrame = pd.DataFrame(
-            list(customerOrders.values())
-        )
-        #print(ordersdFrame)
+        order_dates, order_totals, order_ids = zip(*orderRows)
 
         # Create the bar chart - x and y are required, 
         # others are optional formatting.
-        fig = px.bar(
-            ordersdFrame,
-            x='order_date',
-            y= 'OrderTotal',
-            color='order_id',
-            labels={'color':'order_id'},
+        fig = figures.bar(
+            x=order_dates,
+            y=figures.floats(order_totals),
+            color=order_ids,
+            labels={'x': 'order_date', 'y': 'OrderTotal', 'color': 'order_id'},
             text_auto=True,
         )
 
@@ -142,31 +238,46 @@ class Customer(models.Model):
             )
 
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
 
         #return the html to place in the context and display
         return plot_html
 
     # v3.2 Generate a list of objects for the total sales revenue from orders placed each year by the current customer - "self".
-    def AnnualOrders(self):
+    @cached_chart('Customer.AnnualOrders', 'AnnualOrdersRows', 'AnnualOrdersFigure')
+    def AnnualOrders(self, rollup=None):
+        return self.AnnualOrdersFigure(list(self.AnnualOrdersRows(rollup)))
+
+    @cached_chart('Customer.AnnualOrders')
+    async def aAnnualOrders(self, rollup=None):
+        rows = [row async for row in self.AnnualOrdersRows(rollup)]
+        return await run_figure(self.AnnualOrdersFigure, rows)
+
+    # (Year, OrderTotal) - one row per year from sales_daily, one row per order otherwise
+    def AnnualOrdersRows(self, rollup=None):
         # Year is extracted from order_date using the "__" for year ()
         # This is another method to get components of a datetime object, in addition to the "ExtractYear" function
-        annualOrders = self.CustomerOrders().annotate(
-            Year = Cast(F("order_date__year"),output_field=models.CharField()),
-            OrderTotal = Sum(F('orderdetail__product__price')*F('orderdetail__quantity'), 
-                            distinct=True),
-        ).values('Year', 'OrderTotal').order_by("Year")
+        if SalesDaily.Enabled(rollup):
+            annualOrders = SalesDaily.objects.filter(customer=self).annotate(
+                Year = Cast(ExtractYear('day'), output_field=models.CharField()),
+            ).values('Year').annotate(OrderTotal = Sum('revenue')).order_by("Year")
+        else:
+            annualOrders = self.CustomerOrders().annotate(
+                Year = Cast(F("order_date__year"),output_field=models.CharField()),
+                OrderTotal = Sum('orderdetail__line_total'),
+            ).values('Year', 'OrderTotal').order_by("Year")
         #print(annualOrders)
+        return annualOrders.values_list('Year', 'OrderTotal')
 
-        #print(list(annualOrders))
-
-        annuals =pd.DataFrame(list(annualOrders)) 
-        print(annuals)
-        annuals = annuals.groupby("Year").agg("sum").reset_index()
-        print(annuals)
+    def AnnualOrdersFigure(self, annualOrders):
+        # One row per order on the raw path - summed per year here.
+        annuals = {}
+        for year, total in annualOrders:
+            annuals[year] = annuals.get(year, 0) + (total or 0)
 
-        fig = px.bar(annuals,x='Year', y='OrderTotal', 
-                        color='Year', text_auto=True,
+        fig = figures.bar(x=list(annuals), y=list(annuals.values()),
+                        color=list(annuals), text_auto=True,
+                        labels={'x': 'Year', 'y': 'OrderTotal', 'color': 'Year'},
                     )
 
         # Format Chart and Axes titles 
@@ -183,30 +294,60 @@ class Customer(models.Model):
             yaxis_tickformat = ',.2f'
         )
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
 
         #return the html to place in the context and display
         return plot_html
 
+    # One row per order line placed by this customer: (ProductName, CategoryName, Quantity, Revenue).
+    # The four product / category plots below are all totals over these rows,
+    # so a request that draws two of them runs the orders -> order_details -> products -> categories join once.
+    # With the sales_daily rollup the rows are per (day, product) instead of per line - the totals are the same.
+    # render_charts() loads them (on the request's thread) before it builds the plots on the figure executor.
+    # The rows are kept on the instance per source - {SalesDaily.Enabled(rollup): rows}.
+    def ProductFacts(self, rollup=None):
+        rollup = SalesDaily.Enabled(rollup)
+        productFacts = self.__dict__.setdefault('_productFacts', {})
+        if rollup not in productFacts:
+            productFacts[rollup] = list(self.ProductFactsRows(rollup))
+        return productFacts[rollup]
+
+    async def aProductFacts(self, rollup=None):
+        rollup = SalesDaily.Enabled(rollup)
+        productFacts = self.__dict__.setdefault('_productFacts', {})
+        if rollup not in productFacts:
+            productFacts[rollup] = [row async for row in self.ProductFactsRows(rollup)]
+        return productFacts[rollup]
+
+    def ProductFactsRows(self, rollup=None):
+        if SalesDaily.Enabled(rollup):
+            return SalesDaily.objects.filter(customer=self).values_list(
+                'product__product_name', 'category__category_name', 'quantity', 'revenue')
+        return OrderDetail.objects.filter(order__customer=self.customer_id).values_list(
+            'product__product_name', 'product__category__category_name', 'quantity', 'line_total')
+
+    # Totals of Quantity and Revenue for each value of column ('ProductName' or 'CategoryName'),
+    # as three columns (names, quantities, revenues) sorted by name.
+    def ProductFactsBy(self, column):
+        position = 0 if column == 'ProductName' else 1
+        totals = {}
+        for row in self.ProductFacts():
+            if row[position] is None:
+                continue
+            quantity, revenue = totals.get(row[position], (0, 0))
+            totals[row[position]] = (quantity + (row[2] or 0), revenue + float(row[3] or 0))
+        names = sorted(totals)
+        return names, [totals[n][0] for n in names], [totals[n][1] for n in names]
+
     # v3.2 Generate a plot of products and their total sales revenue from orders placed by the current customer - "self".
+    @cached_chart('Customer.ProductReveues', 'ProductFacts')
     def ProductReveues(self):
-        # Year is extracted from order_date using the "__" for year ()
-        # This is another method to get components of a datetime object, in addition to the "ExtractYear" function
-        productOrders = self.CustomerOrders().order_by('order_date').annotate(
-            ProductName = F('orderdetail__product__product_name'),
-            CategoryName = F('orderdetail__product__category__category_name'),
-            TotalQuantity = Sum('orderdetail__quantity'),
-            ProductTotal = Sum(F('orderdetail__product__price')*F('orderdetail__quantity'),distinct=True),
-            #Year = Cast(F("order_date__year"), output_field=models.CharField()),
-        ).distinct()
-
-        productOrders = productOrders.values('ProductName', 'ProductTotal', 'CategoryName').order_by('CategoryName')
-        productsData =pd.DataFrame(list(productOrders)) 
-        productsData = productsData.groupby('ProductName').agg("sum").reset_index()
-        print(productsData)
+        names, quantities, revenues = self.ProductFactsBy('ProductName')
+        if not names:
+            return '<div> No Products ordered</div>'
 
-        fig = px.bar(productsData,x='ProductName', y='ProductTotal', 
-                        color='ProductName', text_auto=True,                    )
+        fig = figures.bar(x=names, y=revenues, color=names, text_auto=True,
+                        labels={'x': 'ProductName', 'y': 'ProductTotal', 'color': 'ProductName'})
                 # Format Chart and Axes titles 
         fig.update_layout(
             title = 'Revenues from Products',
@@ -222,30 +363,20 @@ class Customer(models.Model):
         )
 
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
 
         #return the html to place in the context and display
         return plot_html
 
-    # v3.2 Generate a plot of products and their total sales revenue from orders placed by the current customer - "self".
+    # v3.2 Generate a plot of products and the quantities bought in orders placed by the current customer - "self".
+    @cached_chart('Customer.ProductsSoldPlot', 'ProductFacts')
     def ProductsSoldPlot(self):
-        # Year is extracted from order_date using the "__" for year ()
-        # This is another method to get components of a datetime object, in addition to the "ExtractYear" function
-        productOrders = self.CustomerOrders().order_by('order_date').annotate(
-            ProductName = F('orderdetail__product__product_name'),
-            CategoryName = F('orderdetail__product__category__category_name'),
-            TotalQuantity = Sum('orderdetail__quantity'),
-            ProductTotal = Sum(F('orderdetail__product__price')*F('orderdetail__quantity'),distinct=True),
-            #Year = Cast(F("order_date__year"), output_field=models.CharField()),
-        ).distinct()
-        productOrders = productOrders.values('ProductName', 'ProductTotal', 'TotalQuantity')
+        names, quantities, revenues = self.ProductFactsBy('ProductName')
+        if not names:
+            return '<div> No Products ordered</div>'
 
-        productsData =pd.DataFrame(list(productOrders)) 
-        productsData = productsData.groupby('ProductName').agg("sum").reset_index()
-        print(productsData)
-
-        fig = px.bar(productsData,x='ProductName', y='TotalQuantity', 
-                        color='ProductName', text_auto=True)
+        fig = figures.bar(x=names, y=quantities, color=names, text_auto=True,
+                        labels={'x': 'ProductName', 'y': 'TotalQuantity', 'color': 'ProductName'})
                 # Format Chart and Axes titles 
         fig.update_layout(
             title = 'Products Quantities',
@@ -258,34 +389,20 @@ class Customer(models.Model):
             coloraxis_showscale=False,
         )
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
 
         #return the html to place in the context and display
         return plot_html
 
-    # v3.2 Generate a plot of products and their total sales revenue from orders placed by the current customer - "self".
+    # v3.2 Generate a plot of categories and their total sales revenue from orders placed by the current customer - "self".
+    @cached_chart('Customer.ProductCategoryRevenusPlot', 'ProductFacts')
     def ProductCategoryRevenusPlot(self):
-        # Year is extracted from order_date using the "__" for year ()
-        # This is another method to get components of a datetime object, in addition to the "ExtractYear" function
-        categoryOrders = self.CustomerOrders().order_by('order_date').annotate(
-            #ProductName = F('orderdetail__product__product_name'),
-            CategoryName = F('orderdetail__product__category__category_name'),
-            CategoryTotalQuantity = Sum('orderdetail__quantity'),
-            CategoryTotalRevenue = Sum(F('orderdetail__product__price')*F('orderdetail__quantity'),distinct=True),
-            #Year = Cast(F("order_date__year"), output_field=models.CharField()),
-        ).distinct()
-
-        categoryOrders = categoryOrders.values('CategoryName', 'CategoryTotalRevenue')
-
-        print(list(categoryOrders))
-
-        categoryData =pd.DataFrame(list(categoryOrders)) 
-        categoryData = categoryData.groupby("CategoryName").agg("sum").reset_index()
+        names, quantities, revenues = self.ProductFactsBy('CategoryName')
+        if not names:
+            return '<div> No Products ordered</div>'
 
-        print(categoryData)
-
-        fig = px.bar(categoryData,x='CategoryName', y='CategoryTotalRevenue', 
-                        color='CategoryName', text_auto=True,)
+        fig = figures.bar(x=names, y=revenues, color=names, text_auto=True,
+                        labels={'x': 'CategoryName', 'y': 'CategoryTotalRevenue', 'color': 'CategoryName'})
                 # Format Chart and Axes titles 
         fig.update_layout(
             title = 'Category Sales Revenues',
@@ -298,34 +415,20 @@ class Customer(models.Model):
             coloraxis_showscale=False,
         )
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
 
         #return the html to place in the context and display
         return plot_html
 
-    # v3.2 Generate a plot of products and their total sales revenue from orders placed by the current customer - "self".
+    # v3.2 Generate a plot of categories and the quantities bought in orders placed by the current customer - "self".
+    @cached_chart('Customer.ProductCategorySalesPlot', 'ProductFacts')
     def ProductCategorySalesPlot(self):
-        # Year is extracted from order_date using the "__" for year ()
-        # This is another method to get components of a datetime object, in addition to the "ExtractYear" function
-        categoryOrders = self.CustomerOrders().order_by('order_date').annotate(
-            #ProductName = F('orderdetail__product__product_name'),
-            CategoryName = F('orderdetail__product__category__category_name'),
-            CategoryTotalQuantity = Sum('orderdetail__quantity'),
-            #ProductTotal = Sum(F('orderdetail__product__price')*F('orderdetail__quantity'),distinct=True),
-            #Year = Cast(F("order_date__year"), output_field=models.CharField()),
-        ).distinct()
-
-        categoryOrders = categoryOrders.values('CategoryName', 'CategoryTotalQuantity').order_by("CategoryTotalQuantity")
+        names, quantities, revenues = self.ProductFactsBy('CategoryName')
+        if not names:
+            return '<div> No Products ordered</div>'
 
-        print(list(categoryOrders))
-
-        categoryData =pd.DataFrame(list(categoryOrders)) 
-        categoryData = categoryData.groupby("CategoryName").agg("sum").reset_index()
-
-        print(categoryData)
-
-        fig = px.bar(categoryData,x='CategoryName', y='CategoryTotalQuantity', 
-                        color='CategoryName', text_auto=True,)
+        fig = figures.bar(x=names, y=quantities, color=names, text_auto=True,
+                        labels={'x': 'CategoryName', 'y': 'CategoryTotalQuantity', 'color': 'CategoryName'})
                 # Format Chart and Axes titles 
         fig.update_layout(
             title = 'Category Sales',
@@ -339,11 +442,33 @@ class Customer(models.Model):
         )
 
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
 
         #return the html to place in the context and display
         return plot_html
 
+    # Async twins of the four product / category plots: the facts are loaded with the async ORM, then the
+    # plot method itself (uncached, through __wrapped__) runs on the figure executor without touching the database.
+    @cached_chart('Customer.ProductReveues')
+    async def aProductReveues(self):
+        await self.aProductFacts()
+        return await run_figure(Customer.ProductReveues.__wrapped__, self)
+
+    @cached_chart('Customer.ProductsSoldPlot')
+    async def aProductsSoldPlot(self):
+        await self.aProductFacts()
+        return await run_figure(Customer.ProductsSoldPlot.__wrapped__, self)
+
+    @cached_chart('Customer.ProductCategoryRevenusPlot')
+    async def aProductCategoryRevenusPlot(self):
+        await self.aProductFacts()
+        return await run_figure(Customer.ProductCategoryRevenusPlot.__wrapped__, self)
+
+    @cached_chart('Customer.ProductCategorySalesPlot')
+    async def aProductCategorySalesPlot(self):
+        await self.aProductFacts()
+        return await run_figure(Customer.ProductCategorySalesPlot.__wrapped__, self)
+
 class Product(models.Model):
     product_id = models.AutoField(primary_key=True)
     product_name = models.CharField(max_length=255, blank=True, null=True)
@@ -360,6 +485,9 @@ class Product(models.Model):
     
     is_available = models.BooleanField(default=True, null=True)
     
+    # Date of the most recent order containing this product - maintained on OrderDetail insert.
+    last_ordered_at = models.DateField(blank=True, null=True)
+    
     def __str__(self):
         return self.product_name
     
@@ -379,55 +507,78 @@ class Product(models.Model):
     
     def get_product_latest_order_date(self):
         product_latest_order = OrderDetail.objects.filter(product=self).aggregate(latest_order_date=Max('order__order_date'))
-        print(product_latest_order['latest_order_date'])
         return product_latest_order['latest_order_date']
  
     def get_availabilityStatus(self):
-        one_year_ago = datetime.datetime.now().date() - timedelta(days=365)
-        product_latest_order_date = self.get_product_latest_order_date()
- 
-        if product_latest_order_date:
-            if product_latest_order_date > one_year_ago:
-                self.is_available = True
-                self.save()
-                return "Available"
-            else:
-                self.is_available = False
-                self.save()
-                return "Unavailable"
-        else:
-            return "Available"
+        '''
+            Returns "Available" or "Unavailable" from the stored last_ordered_at date.
+            No queries and no writes - last_ordered_at is maintained when order lines are added
+            (see signals.py) and backfilled by the backfill_product_last_ordered command.
+        '''
+        if self.last_ordered_at and self.last_ordered_at <= Customer.ActivityCutoffDate():
+            return "Unavailable"
+        return "Available"
+
+    @staticmethod
+    def RecordOrdered(product_id, order_date):
+        '''
+            Moves last_ordered_at forward for a product that was just ordered.
+            A single conditional UPDATE, so an older order never moves the date back.
+            The app derives availability from last_ordered_at (get_availabilityStatus); the stored
+            is_available flag is only a snapshot for reports that read the table.
+        '''
+        return Product.objects.filter(
+            models.Q(last_ordered_at__isnull=True) | models.Q(last_ordered_at__lt=order_date),
+            product_id=product_id,
+        ).update(
+            last_ordered_at=order_date,
+            is_available=order_date > Customer.ActivityCutoffDate(),
+        )
+
+    @staticmethod
+    def BackfillLastOrdered(batch_size=500):
+        '''
+            Recomputes last_ordered_at and is_available for every product from the order history,
+            using one aggregate query and batched bulk_update calls.
+            Returns the number of products updated.
+        '''
+        one_year_ago = Customer.ActivityCutoffDate()
+        changed = []
+        allProducts = Product.objects.annotate(latest_order_date=Max('orderdetail__order__order_date'))
+        for product in allProducts.iterator(chunk_size=batch_size):
+            is_available = product.latest_order_date is None or product.latest_order_date > one_year_ago
+            if product.last_ordered_at != product.latest_order_date or product.is_available != is_available:
+                product.last_ordered_at = product.latest_order_date
+                product.is_available = is_available
+                changed.append(product)
+
+        Product.objects.bulk_update(changed, ['last_ordered_at', 'is_available'], batch_size=batch_size)
+        return len(changed)
 
     class Meta:
         managed = True
         db_table = 'products'
+        # Trigram index for the Products list search (see search.py)
+        indexes = [
+            GinIndex(fields=['product_name'], opclasses=['gin_trgm_ops'], name='products_name_trgm'),
+        ]
         
-    def ProductSales(self, year=None):
+    def ProductSales(self, year=None, rollup=None, window=None):
         """
-        Calculate sales metrics for this product: revenue and quantity sold.
-        Optional year parameter to filter by year.
+        Calculate sales metrics for this product: revenue and quantity sold, per (Year, Month).
+        Optional year parameter (or time window, see timewindow.py) to filter by.
+        rollup=True reads the pre-aggregated sales_daily table.
+        Returns a pandas DataFrame - see analytics.py.
         """
-        sales_data = OrderDetail.objects.filter(product=self).annotate(
-            Year=ExtractYear('order__order_date'),
-            Month=ExtractMonth('order__order_date'),
-            Revenue=F('quantity') * F('product__price'),
-            # Revenue=Sum(F('quantity') * F('product__price'), distinct=True)
-        ).values('Year', 'Month').annotate(
-            TotalRevenue=Sum('Revenue'),
-            # TotalRevenue='Revenue',
-            TotalQuantity=Sum('quantity')
-        ).order_by('Year', 'Month')
-
-        if year:
-            sales_data = sales_data.filter(Year=year)
-
-        return pd.DataFrame(list(sales_data))
+        from .analytics import product_sales
+        return product_sales(self, year=year, rollup=rollup, window=window)
 
-    def GenerateProductSalesPlot(self, year=None):
+    @cached_chart('Product.GenerateProductSalesPlot')
+    def GenerateProductSalesPlot(self, year=None, window=None):
         """
         Generate a bar chart for product sales.
         """
-        sales_data = self.ProductSales(year=year)
+        sales_data = self.ProductSales(year=year, window=window)
 
         if sales_data.empty:
             return "<div>No sales data available for this product.</div>"
@@ -439,13 +590,12 @@ class Product(models.Model):
             title = f"Annual Sales for {self.product_name}"
             x_axis = 'Year'
 
-        fig = px.bar(
-            sales_data,
-            x=x_axis,
-            y=['TotalRevenue', 'TotalQuantity'],
+        fig = figures.bar(
+            x=sales_data[x_axis],
+            y={column: sales_data[column] for column in ['TotalRevenue', 'TotalQuantity']},
             text_auto=True,
             barmode='group',
-            labels={'value': 'Metrics', 'variable': 'Metrics Type'},
+            labels={'x': x_axis, 'value': 'Metrics', 'variable': 'Metrics Type'},
             title=title
         )
         fig.update_layout(
@@ -455,29 +605,44 @@ class Product(models.Model):
             yaxis_tickprefix='$' if 'Revenue' in sales_data.columns else ''
         )
 
-        return plot(fig, output_type='div')
- 
-    def AnnualProductOrders(self, year=None):
-        allOrders = OrderDetail.objects.filter(product=self)
-        if year:
-            allOrders = allOrders.filter(order__order_date__year=year)
- 
-        allOrders = allOrders.annotate(
-            Year=ExtractYear(F("order__order_date")),
-            OrderTotal=Sum(F('product__price') * F('quantity'))
-        ).values('Year', 'OrderTotal').order_by('Year')
+        return render_chart(fig)
  
-        dataFrame = pd.DataFrame(list(allOrders))
-        if dataFrame.empty:
+    @cached_chart('Product.AnnualProductOrders', 'AnnualProductOrdersRows', 'AnnualProductOrdersFigure')
+    def AnnualProductOrders(self, year=None, rollup=None, window=None):
+        return self.AnnualProductOrdersFigure(list(self.AnnualProductOrdersRows(year, rollup, window)))
+
+    @cached_chart('Product.AnnualProductOrders')
+    async def aAnnualProductOrders(self, year=None, rollup=None, window=None):
+        rows = [row async for row in self.AnnualProductOrdersRows(year, rollup, window)]
+        return await run_figure(self.AnnualProductOrdersFigure, rows)
+
+    # (Year, OrderTotal) rows for the year / time window
+    def AnnualProductOrdersRows(self, year=None, rollup=None, window=None):
+        if SalesDaily.Enabled(rollup):
+            allOrders = filter_window(SalesDaily.objects.filter(product=self), 'day', window, year=year)
+            allOrders = allOrders.annotate(
+                Year=ExtractYear('day'),
+            ).values('Year').annotate(OrderTotal=Sum('revenue')).order_by('Year')
+        else:
+            allOrders = filter_window(OrderDetail.objects.filter(product=self), 'order__order_date',
+                                      window, year=year)
+            allOrders = allOrders.annotate(
+                Year=ExtractYear(F("order__order_date")),
+                OrderTotal=Sum('line_total')
+            ).values('Year', 'OrderTotal').order_by('Year')
+        return allOrders.values_list('Year', 'OrderTotal')
+
+    def AnnualProductOrdersFigure(self, rows):
+        if not rows:
             return '<div>No annual data available.</div>'
  
-        fig = px.bar(
-            dataFrame,
-            x='Year',
-            y='OrderTotal',
+        years, totals = zip(*rows)
+        fig = figures.bar(
+            x=years,
+            y=figures.floats(totals),
             text_auto=True,
-            color='Year',
-            labels={'OrderTotal': 'Total Revenue', 'Year': 'Year'}
+            color=years,
+            labels={'x': 'Year', 'y': 'Total Revenue', 'color': 'Year'}
         )
         fig.update_layout(
             title='Annual Sales',
@@ -486,32 +651,44 @@ class Product(models.Model):
             yaxis_tickprefix='$',
             coloraxis_showscale=False,
         )
-        return plot(fig, output_type='div')
-
-    def MonthlyProductOrders(self, year=None):
-        allOrders = OrderDetail.objects.filter(product=self)
-        if year:
-            allOrders = allOrders.filter(order__order_date__year=year)
- 
-        allOrders = allOrders.annotate(
-            Month=ExtractMonth(F("order__order_date")),
-            OrderTotal=Sum(F('product__price') * F('quantity'))
-        ).values('Month', 'OrderTotal').order_by('Month')
- 
-        dataFrame = pd.DataFrame(list(allOrders))
-        if not dataFrame.empty:
-            dataFrame['Month'] = dataFrame['Month'].apply(lambda x: calendar.month_name[x])
-       
-        if dataFrame.empty:
+        return render_chart(fig)
+
+    @cached_chart('Product.MonthlyProductOrders', 'MonthlyProductOrdersRows', 'MonthlyProductOrdersFigure')
+    def MonthlyProductOrders(self, year=None, rollup=None, window=None):
+        return self.MonthlyProductOrdersFigure(list(self.MonthlyProductOrdersRows(year, rollup, window)))
+
+    @cached_chart('Product.MonthlyProductOrders')
+    async def aMonthlyProductOrders(self, year=None, rollup=None, window=None):
+        rows = [row async for row in self.MonthlyProductOrdersRows(year, rollup, window)]
+        return await run_figure(self.MonthlyProductOrdersFigure, rows)
+
+    # (Month, OrderTotal) rows for the year / time window
+    def MonthlyProductOrdersRows(self, year=None, rollup=None, window=None):
+        if SalesDaily.Enabled(rollup):
+            allOrders = filter_window(SalesDaily.objects.filter(product=self), 'day', window, year=year)
+            allOrders = allOrders.annotate(
+                Month=ExtractMonth('day'),
+            ).values('Month').annotate(OrderTotal=Sum('revenue')).order_by('Month')
+        else:
+            allOrders = filter_window(OrderDetail.objects.filter(product=self), 'order__order_date',
+                                      window, year=year)
+            allOrders = allOrders.annotate(
+                Month=ExtractMonth(F("order__order_date")),
+                OrderTotal=Sum('line_total')
+            ).values('Month', 'OrderTotal').order_by('Month')
+        return allOrders.values_list('Month', 'OrderTotal')
+
+    def MonthlyProductOrdersFigure(self, rows):
+        if not rows:
             return '<div>No monthly data available.</div>'
  
-        fig = px.bar(
-            dataFrame,
-            x='Month',
-            y='OrderTotal',
+        months = [calendar.month_name[month] for month, total in rows]
+        fig = figures.bar(
+            x=months,
+            y=[total for month, total in rows],
             text_auto=True,
-            color='Month',
-            labels={'OrderTotal': 'Total Revenue', 'Month': 'Month'}
+            color=months,
+            labels={'x': 'Month', 'y': 'Total Revenue', 'color': 'Month'}
         )
         fig.update_layout(
             title='Monthly Sales',
@@ -520,50 +697,69 @@ class Product(models.Model):
             yaxis_tickprefix='$',
             coloraxis_showscale=False,
         )
-        return plot(fig, output_type='div')
+        return render_chart(fig)
 
-    def total_sales(self, year=None):
-        allOrders = Order.objects.all()
- 
-        if year:
-            allOrders = allOrders.filter(order__order_date__year=year)
+    @staticmethod
+    def RevenueRanks(n=10, per_year=True):
+        '''
+            Top n and bottom n products by revenue, ranked in the database with row_number() windows,
+            so only the ranked rows (at most 2n per year) come back.
+
+            per_year=True ranks the products within every year in one pass (columns: year, product_id,
+            product_name, total_revenue, top_rank, bottom_rank) so any year can be picked from the result.
+            per_year=False ranks revenue over all years.
+            Returns a pandas DataFrame - see analytics.py.
+        '''
+        from .analytics import revenue_ranks
+        return revenue_ranks(n=n, per_year=per_year)
+
+    def total_sales(self, year=None, window=None):
+        allOrders = filter_window(OrderDetail.objects.filter(product=self), 'order__order_date', window, year=year)
  
         total_quantity = allOrders.aggregate(
             total_quantity=Coalesce(Sum('quantity'), 0)
         )['total_quantity']
  
         total_revenue = allOrders.aggregate(
-            total_revenue=Coalesce(Sum(F('quantity') * F('product__price')), 0)
+            total_revenue=Coalesce(Sum('line_total'), Decimal("0.00"),
+                                   output_field=models.DecimalField(max_digits=12, decimal_places=2))
         )['total_revenue']
  
         return total_quantity, total_revenue
 
+    @cached_chart('Product.ProductCategoryRevenuesAnalysisPlot',
+                  'ProductCategoryRevenuesAnalysisRows', 'ProductCategoryRevenuesAnalysisFigure')
     def ProductCategoryRevenuesAnalysisPlot(self):
+        return self.ProductCategoryRevenuesAnalysisFigure(list(self.ProductCategoryRevenuesAnalysisRows()))
+
+    # (CategoryName, CategoryTotalRevenue) for each category
+    def ProductCategoryRevenuesAnalysisRows(self):
         category_orders = (
             OrderDetail.objects
             .values('product__category__category_name')  
             .annotate(
-                CategoryTotalRevenue=Sum(F('product__price') * F('quantity')),  
+                CategoryTotalRevenue=Sum('line_total'),
             )
             .order_by('product__category__category_name')  
         )
+        return category_orders.values_list('product__category__category_name', 'CategoryTotalRevenue')
 
-        category_data = pd.DataFrame(list(category_orders))
-        if category_data.empty:
+    def ProductCategoryRevenuesAnalysisFigure(self, category_data):
+        if not category_data:
             return "<div>No data available for Product Category Revenues</div>"
        
-        print(category_data)
+        categories, revenues = zip(*category_data)
 
-        fig = px.bar(
-            category_data,
-            x='product__category__category_name',
-            y='CategoryTotalRevenue',
-            color='product__category__category_name',
+        fig = figures.bar(
+            x=categories,
+            y=figures.floats(revenues),
+            color=categories,
             text_auto=True,
             title='Category Sales Revenues for Product',
             labels={
-                'product__category__category_name': 'Category',
-                'CategoryTotalRevenue': 'Sales Revenue',
+                'x': 'Category',
+                'y': 'Sales Revenue',
+                'color': 'Category',
             },
         )
 
@@ -574,32 +770,39 @@ class Product(models.Model):
             title_x=0.5,
         )
 
-        return plot(fig, output_type='div')
+        return render_chart(fig)
 
+    @cached_chart('Product.ProductCategorySalesAnalysisPlot',
+                  'ProductCategorySalesAnalysisRows', 'ProductCategorySalesAnalysisFigure')
     def ProductCategorySalesAnalysisPlot(self):
+        return self.ProductCategorySalesAnalysisFigure(list(self.ProductCategorySalesAnalysisRows()))
+
+    # (CategoryName, CategoryTotalQuantity) for each category
+    def ProductCategorySalesAnalysisRows(self):
         category_orders = (
             OrderDetail.objects
             .values('product__category__category_name')
             .annotate(CategoryTotalQuantity=Sum('quantity'))
             .order_by('product__category__category_name')
         )
- 
-        category_data = pd.DataFrame(list(category_orders))
-        if category_data.empty:
+        return category_orders.values_list('product__category__category_name', 'CategoryTotalQuantity')
+
+    def ProductCategorySalesAnalysisFigure(self, category_data):
+        if not category_data:
             return "<div>No data available for Product Category Sales</div>"
        
-        print(category_data)
+        categories, quantities = zip(*category_data)
  
-        fig = px.bar(
-            category_data,
-            x='product__category__category_name',
-            y='CategoryTotalQuantity',
-            color='product__category__category_name',
+        fig = figures.bar(
+            x=categories,
+            y=quantities,
+            color=categories,
             text_auto=True,
             title='Category Sales for Product',
             labels={
-                'product__category__category_name': 'Category',
-                'CategoryTotalQuantity': '# of Products Sold',
+                'x': 'Category',
+                'y': '# of Products Sold',
+                'color': 'Category',
             },
         )
  
@@ -610,7 +813,7 @@ class Product(models.Model):
             title_x=0.5,
         )
        
-        return plot(fig, output_type='div')
+        return render_chart(fig)
         
 
 class Order(models.Model):
@@ -633,60 +836,52 @@ class Order(models.Model):
         return orderdetails
     
     def OrderTotal(self):
+        # Sum of the order lines' line_total, computed in the database.
         orderDetails = OrderDetail.objects.filter(order = self.order_id)
-        
-        total = Decimal("0.0")
-        
-        for line in orderDetails:
-            total += line.Total #(quantity*product.price)
-        
-        return total
-        # return orderDetails.aggregate(
-        #     total=Sum('LineTotal')
-        # )['total']
+        return orderDetails.aggregate(
+            total=Coalesce(Sum('line_total'), Decimal("0.00"),
+                           output_field=models.DecimalField(max_digits=12, decimal_places=2))
+        )['total']
     
+    @staticmethod
     def AllOrderYears():
         '''
-            Returns a queryset of each distinct year an order was placed, 
-            in chronological order
+            Returns each distinct year an order was placed, in chronological order,
+            as a list of {'Year': year} rows.
+
+            Walks the years with MIN(order_date) >= Jan 1st of the next year instead of
+            EXTRACT(year) + DISTINCT over the whole table - with a B-tree index on order_date
+            each step is one index probe.  Views use the cached facets.order_years().
         '''
-        allYears = Order.objects.all().annotate(
-            Year = ExtractYear("order_date")
-        ).order_by('Year').distinct()
-        
-        return allYears.values('Year')
+        years = []
+        first = Order.objects.aggregate(first=Min('order_date'))['first']
+        while first is not None:
+            years.append({'Year': first.year})
+            first = Order.objects.filter(
+                order_date__gte=datetime.date(first.year + 1, 1, 1)
+            ).aggregate(first=Min('order_date'))['first']
+        return years
     
     @staticmethod
-    def AnnualSales(year=None):
+    def AnnualSales(year=None, rollup=None, window=None):
         """
         Calculate annual sales metrics: revenue, products sold, and orders count.
-        Optional year parameter to filter data.
+        Optional year parameter (or time window, see timewindow.py) to filter data.
+        rollup=True reads revenue and products sold from the sales_daily table.
+        Returns a pandas DataFrame - see analytics.py.
         """
-        # Annotate data with year, month, and computed values
-        annual_data = Order.objects.annotate(
-            Year=ExtractYear('order_date'),
-            Month=ExtractMonth('order_date'),
-            Revenue=Sum(F('orderdetail__product__price') * F('orderdetail__quantity')),
-            ProductsSold=Sum('orderdetail__quantity'),
-        ).values('Year', 'Month').annotate(
-            TotalRevenue=Sum('Revenue'),
-            TotalProductsSold=Sum('ProductsSold'),
-            TotalOrders=Count('order_id')
-        ).order_by('Year', 'Month')
-
-        if year:
-            annual_data = annual_data.filter(Year=year)
-
-        return pd.DataFrame(list(annual_data))
+        from .analytics import annual_sales
+        return annual_sales(year=year, rollup=rollup, window=window)
 
     @staticmethod
-    def GenerateAnnualSalesPlot(year=None):
+    @cached_chart('Order.GenerateAnnualSalesPlot')
+    def GenerateAnnualSalesPlot(year=None, window=None):
         """
         Generate a bar chart showing total revenue, orders, and products sold per year.
         Optional year parameter to drill down into monthly data.
         """
         # Get sales data
-        sales_data = Order.AnnualSales(year=year)
+        sales_data = Order.AnnualSales(year=year, window=window)
 
         if sales_data.empty:
             return "<div>No sales data available.</div>"
@@ -700,13 +895,12 @@ class Order(models.Model):
             x_axis = 'Year'
 
         # Create bar plot
-        fig = px.bar(
-            sales_data,
-            x=x_axis,
-            y=['TotalRevenue', 'TotalProductsSold', 'TotalOrders'],
+        fig = figures.bar(
+            x=sales_data[x_axis],
+            y={column: sales_data[column] for column in ['TotalRevenue', 'TotalProductsSold', 'TotalOrders']},
             text_auto=True,
             barmode='group',
-            labels={'value': 'Metrics', 'variable': 'Metrics Type'},
+            labels={'x': x_axis, 'value': 'Metrics', 'variable': 'Metrics Type'},
             title=title
         )
         fig.update_layout(
@@ -717,7 +911,7 @@ class Order(models.Model):
         )
 
         # Generate HTML plot
-        return plot(fig, output_type='div')
+        return render_chart(fig)
    
 
 class OrderDetail(models.Model):
@@ -725,18 +919,343 @@ class OrderDetail(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(blank=True, null=True)
+    # The product's price when the line was ordered - editing a product's price does not change past revenue.
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # quantity * unit_price, computed and stored by the database.  Revenue aggregates sum this column,
+    # so they no longer join products.
+    line_total = models.GeneratedField(
+        expression=F('quantity') * F('unit_price'),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        db_persist=True,
+    )
 
     class Meta:
         managed = False
         db_table = 'order_details'
-    
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.product.price
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def BackfillUnitPrice(batch_size=10000):
+        '''
+            Sets unit_price to the product's current price on the lines that have none
+            (lines written by programs that do not set it - migration 0009 backfilled the history).
+            Works through the table in primary key ranges of batch_size, so no single UPDATE holds
+            locks on the whole table.  update() sends no signals, so the rollups, which counted those
+            lines with no revenue, are rebuilt afterwards.  Returns the number of lines updated.
+        '''
+        bounds = OrderDetail.objects.filter(unit_price__isnull=True).aggregate(
+            low=Min('order_detail_id'), high=Max('order_detail_id'))
+        if bounds['low'] is None:
+            return 0
+
+        productPrice = Product.objects.filter(pk=OuterRef('product_id')).values('price')
+        nUpdated = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            nUpdated += OrderDetail.objects.filter(
+                unit_price__isnull=True,
+                order_detail_id__gte=start,
+                order_detail_id__lt=start + batch_size,
+            ).update(unit_price=Subquery(productPrice))
+        if nUpdated:
+            # The rebuilds also move the chart data version forward (see charts.py).
+            SalesDaily.Rebuild()
+            CustomerSummary.Rebuild()
+        return nUpdated
+
     @property
     def Total(self):
-        return self.quantity*self.product.price
+        return self.quantity*(self.unit_price if self.unit_price is not None else self.product.price)
     
     @property
     def product_name(self):
         if (self.product):
             return self.product.product_name
         else:
-            return ''
\ No newline at end of file
+            return ''
+
+class SalesDaily(models.Model):
+    '''
+        Pre-aggregated sales: one row per (day, product, customer) with the product's category.
+        quantity and revenue are the sums over the order lines of that cell, order_count is
+        the number of distinct orders in it.
+
+        The table is kept in step by signals.py as order lines, orders and products are written,
+        and can be rebuilt from scratch with "manage.py rebuild_sales_daily".  The analytics
+        methods read from it when called with rollup=True (or DJTRADERS_SALES_ROLLUP = True).
+    '''
+    day = models.DateField()
+    # No database constraints - this is a derived table, it must never block deleting a product or customer.
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False)
+    customer = models.ForeignKey(Customer, on_delete=models.DO_NOTHING, db_constraint=False)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False)
+    quantity = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+
+    class Meta:
+        managed = True
+        db_table = 'sales_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'customer'], name='sales_daily_cell'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='sales_daily_product_day'),
+            models.Index(fields=['customer', 'day'], name='sales_daily_customer_day'),
+        ]
+
+    # Delta upsert - concurrent writers to the same cell add up instead of overwriting each other.
+    UPSERT_SQL = '''
+        INSERT INTO sales_daily (day, product_id, customer_id, category_id, quantity, revenue, order_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (day, product_id, customer_id) DO UPDATE SET
+            category_id = EXCLUDED.category_id,
+            quantity = sales_daily.quantity + EXCLUDED.quantity,
+            revenue = sales_daily.revenue + EXCLUDED.revenue,
+            order_count = sales_daily.order_count + EXCLUDED.order_count
+    '''
+
+    REBUILD_SQL = '''
+        INSERT INTO sales_daily (day, product_id, customer_id, category_id, quantity, revenue, order_count)
+        SELECT o.order_date, d.product_id, o.customer_id, p.category_id,
+               COALESCE(SUM(d.quantity), 0),
+               COALESCE(SUM(d.line_total), 0),
+               COUNT(DISTINCT d.order_id)
+        FROM order_details d
+        JOIN orders o ON o.order_id = d.order_id
+        JOIN products p ON p.product_id = d.product_id
+        GROUP BY o.order_date, d.product_id, o.customer_id, p.category_id
+    '''
+
+    def __str__(self):
+        return f"{self.day} product {self.product_id} customer {self.customer_id}"
+
+    @staticmethod
+    def Enabled(rollup=None):
+        '''
+            Whether an analytics method should read from sales_daily.
+            rollup=None means "use the DJTRADERS_SALES_ROLLUP setting".
+        '''
+        if rollup is None:
+            return getattr(settings, 'DJTRADERS_SALES_ROLLUP', False)
+        return rollup
+
+    @staticmethod
+    def Rebuild():
+        '''
+            Recomputes the whole table from orders, order_details and products.
+            Returns the number of rollup rows.
+        '''
+        with transaction.atomic():
+            SalesDaily.objects.all().delete()
+            with connection.cursor() as cursor:
+                cursor.execute(SalesDaily.REBUILD_SQL)
+            transaction.on_commit(bump_data_version)
+        return SalesDaily.objects.count()
+
+    @staticmethod
+    def LineCell(order_detail_id):
+        '''
+            The stored state of an order line as the rollup sees it, or None if the line does not exist.
+        '''
+        return OrderDetail.objects.filter(pk=order_detail_id).values(
+            'order_id', 'product_id', 'quantity', 'line_total',
+            day=F('order__order_date'),
+            customer_id=F('order__customer_id'),
+            category_id=F('product__category_id'),
+        ).first()
+
+    @staticmethod
+    def Apply(day, product_id, customer_id, category_id, quantity, revenue, orders):
+        '''
+            Adds the deltas to a cell.  A cell left with no orders, quantity or revenue is deleted.
+        '''
+        if not (quantity or revenue or orders):
+            # Nothing to add - and the upsert would put back a cell an earlier delta emptied.
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(SalesDaily.UPSERT_SQL,
+                           [day, product_id, customer_id, category_id, quantity, revenue, orders])
+        if orders < 0 or quantity < 0 or revenue < 0:
+            # A cell is only empty once nothing of any order is left in it.
+            SalesDaily.objects.filter(
+                day=day, product_id=product_id, customer_id=customer_id,
+                order_count__lte=0, quantity=0, revenue=0,
+            ).delete()
+
+    @staticmethod
+    def ApplyLine(cell, order_detail_id, sign, counted=None):
+        '''
+            Adds (sign=1) or removes (sign=-1) one order line, described by LineCell(), from its cell.
+            The order only counts once per product - the order count changes when no other line
+            of the same order has the same product.
+
+            counted is the set of (order_id, product_id) already taken out by the same delete.  When an
+            order or a queryset of lines is deleted, all the lines are gone before the first post_delete,
+            so each of them would look like the last line of its order and take the order out again.
+        '''
+        quantity = cell['quantity'] or 0
+        revenue = cell['line_total'] or 0
+        sameOrder = OrderDetail.objects.filter(
+            order_id=cell['order_id'], product_id=cell['product_id']
+        ).exclude(pk=order_detail_id).exists()
+        if counted is not None:
+            key = (cell['order_id'], cell['product_id'])
+            sameOrder = sameOrder or key in counted
+            counted.add(key)
+        SalesDaily.Apply(
+            cell['day'], cell['product_id'], cell['customer_id'], cell['category_id'],
+            sign * quantity, sign * revenue, 0 if sameOrder else sign,
+        )
+
+    @staticmethod
+    def MoveOrder(order_id, old_day, old_customer_id, new_day, new_customer_id):
+        '''
+            Moves an order's lines to another day and/or customer after the order was edited.
+        '''
+        products = OrderDetail.objects.filter(order_id=order_id).values(
+            'product_id', category_id=F('product__category_id'),
+        ).annotate(Quantity=Coalesce(Sum('quantity'), 0), Revenue=Coalesce(Sum('line_total'), Decimal("0.00")))
+        with transaction.atomic():
+            for each in products:
+                revenue = each['Revenue']
+                SalesDaily.Apply(old_day, each['product_id'], old_customer_id, each['category_id'],
+                                 -each['Quantity'], -revenue, -1)
+                SalesDaily.Apply(new_day, each['product_id'], new_customer_id, each['category_id'],
+                                 each['Quantity'], revenue, 1)
+
+    @staticmethod
+    def RecategorizeProduct(product):
+        '''
+            Moves the product's cells to its current category.  Revenue is the sum of the lines' own
+            unit prices, so a price edit does not change it.
+        '''
+        SalesDaily.objects.filter(product_id=product.pk).exclude(category_id=product.category_id).update(
+            category_id=product.category_id,
+        )
+
+
+class CustomerSummary(models.Model):
+    '''
+        Per-customer totals over the whole order history: number of orders, first and last order date,
+        lifetime revenue and the number of distinct products bought.
+
+        New orders and order lines are added in with delta upserts; edits and deletes recompute the
+        customer's row (Refresh).  Both are driven by signals.py.  "manage.py rebuild_customer_summary"
+        recomputes every row.  Customers without orders have no row - use Customer.Summary().
+    '''
+    customer = models.OneToOneField(Customer, on_delete=models.DO_NOTHING, primary_key=True,
+                                    db_constraint=False, related_name='summary')
+    order_count = models.IntegerField(default=0)
+    first_order_date = models.DateField(blank=True, null=True)
+    last_order_date = models.DateField(blank=True, null=True)
+    lifetime_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    distinct_products = models.IntegerField(default=0)
+
+    class Meta:
+        managed = True
+        db_table = 'customer_summary'
+        indexes = [
+            models.Index(fields=['-order_count'], name='customer_summary_orders'),
+            models.Index(fields=['-lifetime_revenue'], name='customer_summary_revenue'),
+        ]
+
+    # Delta upsert; the dates only move outwards, NULL means "no change".
+    UPSERT_SQL = '''
+        INSERT INTO customer_summary
+            (customer_id, order_count, first_order_date, last_order_date, lifetime_revenue, distinct_products)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (customer_id) DO UPDATE SET
+            order_count = customer_summary.order_count + EXCLUDED.order_count,
+            first_order_date = CASE
+                WHEN customer_summary.first_order_date IS NULL
+                  OR EXCLUDED.first_order_date < customer_summary.first_order_date
+                THEN COALESCE(EXCLUDED.first_order_date, customer_summary.first_order_date)
+                ELSE customer_summary.first_order_date END,
+            last_order_date = CASE
+                WHEN customer_summary.last_order_date IS NULL
+                  OR EXCLUDED.last_order_date > customer_summary.last_order_date
+                THEN COALESCE(EXCLUDED.last_order_date, customer_summary.last_order_date)
+                ELSE customer_summary.last_order_date END,
+            lifetime_revenue = customer_summary.lifetime_revenue + EXCLUDED.lifetime_revenue,
+            distinct_products = customer_summary.distinct_products + EXCLUDED.distinct_products
+    '''
+
+    REBUILD_SQL = '''
+        INSERT INTO customer_summary
+            (customer_id, order_count, first_order_date, last_order_date, lifetime_revenue, distinct_products)
+        SELECT o.customer_id, o.order_count, o.first_order_date, o.last_order_date,
+               COALESCE(l.revenue, 0), COALESCE(l.products, 0)
+        FROM (
+            SELECT customer_id, COUNT(*) AS order_count,
+                   MIN(order_date) AS first_order_date, MAX(order_date) AS last_order_date
+            FROM orders
+            GROUP BY customer_id
+        ) o
+        LEFT JOIN (
+            SELECT ord.customer_id, SUM(d.line_total) AS revenue, COUNT(DISTINCT d.product_id) AS products
+            FROM order_details d
+            JOIN orders ord ON ord.order_id = d.order_id
+            GROUP BY ord.customer_id
+        ) l ON l.customer_id = o.customer_id
+    '''
+
+    def __str__(self):
+        return f"Summary of customer {self.customer_id}"
+
+    @staticmethod
+    def Rebuild():
+        '''
+            Recomputes every customer's row.  Returns the number of rows.
+        '''
+        with transaction.atomic():
+            CustomerSummary.objects.all().delete()
+            with connection.cursor() as cursor:
+                cursor.execute(CustomerSummary.REBUILD_SQL)
+            transaction.on_commit(bump_data_version)
+        return CustomerSummary.objects.count()
+
+    @staticmethod
+    def Apply(customer_id, orders=0, order_date=None, revenue=0, products=0):
+        with connection.cursor() as cursor:
+            cursor.execute(CustomerSummary.UPSERT_SQL,
+                           [customer_id, orders, order_date, order_date, revenue, products])
+
+    @staticmethod
+    def RecordOrder(customer_id, order_date):
+        CustomerSummary.Apply(customer_id, orders=1, order_date=order_date)
+
+    @staticmethod
+    def RecordLine(cell, order_detail_id):
+        '''
+            Adds a new order line (described by SalesDaily.LineCell()) to its customer's row.
+            The product counts as new when the customer has no other line with it.
+        '''
+        boughtBefore = OrderDetail.objects.filter(
+            order__customer=cell['customer_id'], product_id=cell['product_id']
+        ).exclude(pk=order_detail_id).exists()
+        CustomerSummary.Apply(cell['customer_id'], revenue=cell['line_total'] or 0,
+                              products=0 if boughtBefore else 1)
+
+    @staticmethod
+    def Refresh(customer_id):
+        '''
+            Recomputes one customer's row from its orders - used after edits and deletes,
+            which deltas cannot express (e.g. deleting the latest order).
+        '''
+        orders = Order.objects.filter(customer=customer_id).aggregate(
+            order_count=Count('order_id'),
+            first_order_date=Min('order_date'),
+            last_order_date=Max('order_date'),
+        )
+        lines = OrderDetail.objects.filter(order__customer=customer_id).aggregate(
+            lifetime_revenue=Coalesce(Sum('line_total'), Decimal("0.00")),
+            distinct_products=Count('product', distinct=True),
+        )
+        if not orders['order_count']:
+            CustomerSummary.objects.filter(customer=customer_id).delete()
+            return
+        CustomerSummary.objects.update_or_create(customer_id=customer_id, defaults={**orders, **lines})
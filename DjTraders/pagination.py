@@ -0,0 +1,137 @@
+# Keyset (seek) pagination for the Customers and Products list views.
+#
+# Django's Paginator runs COUNT(*) and then OFFSET n for every page, so deep pages get slower
+# as the table grows.  Keyset pagination orders by (name, primary key) and asks for the rows
+# after (or before) the last row seen, so page N costs the same as page 1.
+#
+# The position is carried in an opaque, signed "cursor" query parameter.  Exact counts are
+# only computed when the request asks for them with count=exact.
+from django.core import signing
+from django.db.models import F, Q
+from django.http import Http404
+
+CURSOR_SALT = 'DjTraders.keyset'
+
+
+class KeysetPage:
+    '''
+        Stands in for Django's Page object in the template context.
+    '''
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, last_cursor=None, count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.last_cursor = last_cursor
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(direction, key=None):
+    '''
+        direction is "n" (rows after key) or "p" (rows before key).
+        A "p" cursor without a key means the last page.
+    '''
+    return signing.dumps({'d': direction, 'k': key}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token):
+    try:
+        cursor = signing.loads(token, salt=CURSOR_SALT)
+        direction, key = cursor['d'], cursor['k']
+    except (signing.BadSignature, KeyError, TypeError):
+        raise Http404("Invalid page cursor.")
+    if direction not in ('n', 'p') or not (key is None or (isinstance(key, list) and len(key) == 2)):
+        raise Http404("Invalid page cursor.")
+    return direction, key
+
+
+class KeysetPaginationMixin:
+    '''
+        ListView mixin that pages by (keyset_field, pk) instead of by offset.
+
+        keyset_field may be NULL - NULLs sort first.
+        Ranked search results (see search.py) are not ordered by the key,
+        so they fall back to the regular offset paginator.
+    '''
+    keyset_field = None
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_field or 'search_rank' in queryset.query.annotations:
+            return super().paginate_queryset(queryset, page_size)
+
+        pk_name = queryset.model._meta.pk.name
+        token = self.request.GET.get(self.cursor_kwarg)
+        direction, key = decode_cursor(token) if token else ('n', None)
+
+        if direction == 'n':
+            rows = queryset.order_by(F(self.keyset_field).asc(nulls_first=True), pk_name)
+            if key is not None:
+                rows = rows.filter(self.after(key, pk_name))
+        else:
+            rows = queryset.order_by(F(self.keyset_field).desc(nulls_last=True), '-' + pk_name)
+            if key is not None:
+                rows = rows.filter(self.before(key, pk_name))
+
+        # One extra row tells us whether there is another page in this direction.
+        object_list = list(rows[:page_size + 1])
+        more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        if direction == 'p':
+            object_list.reverse()
+
+        next_cursor = previous_cursor = None
+        if object_list:
+            if (direction == 'n' and more) or (direction == 'p' and key is not None):
+                next_cursor = encode_cursor('n', self.key_of(object_list[-1], pk_name))
+            if (direction == 'n' and key is not None) or (direction == 'p' and more):
+                previous_cursor = encode_cursor('p', self.key_of(object_list[0], pk_name))
+
+        count = None
+        if self.request.GET.get('count') == 'exact':
+            count = queryset.order_by().count()
+
+        page = KeysetPage(
+            object_list,
+            next_cursor=next_cursor,
+            previous_cursor=previous_cursor,
+            last_cursor=encode_cursor('p') if next_cursor else None,
+            count=count,
+        )
+        return (None, page, object_list, page.has_other_pages())
+
+    def key_of(self, obj, pk_name):
+        return [getattr(obj, self.keyset_field), getattr(obj, pk_name)]
+
+    def after(self, key, pk_name):
+        value, pk = key
+        if value is None:
+            return Q(**{f'{self.keyset_field}__isnull': True, f'{pk_name}__gt': pk}) | Q(
+                **{f'{self.keyset_field}__isnull': False})
+        return Q(**{f'{self.keyset_field}__gt': value}) | Q(**{self.keyset_field: value, f'{pk_name}__gt': pk})
+
+    def before(self, key, pk_name):
+        value, pk = key
+        if value is None:
+            return Q(**{f'{self.keyset_field}__isnull': True, f'{pk_name}__lt': pk})
+        return (
+            Q(**{f'{self.keyset_field}__lt': value})
+            | Q(**{self.keyset_field: value, f'{pk_name}__lt': pk})
+            | Q(**{f'{self.keyset_field}__isnull': True})
+        )
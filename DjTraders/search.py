@@ -0,0 +1,63 @@
+# pg_trgm-backed search for the Customers and Products list filters.
+#
+# On PostgreSQL, Django's "icontains" becomes UPPER(col) LIKE UPPER('%x%'), which cannot use an index
+# and scans the whole table on every search.  The "trgm_contains" lookup below keeps the same
+# substring semantics but emits col ILIKE '%x%', which the GIN gin_trgm_ops indexes created in
+# migration 0005 can answer.  Matches are ranked by trigram word similarity to the search term.
+#
+# On other databases (or with DJTRADERS_TRIGRAM_SEARCH = False) the filters fall back to icontains.
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, models
+from django.db.models import Lookup
+
+
+@models.CharField.register_lookup
+class TrigramContains(Lookup):
+    lookup_name = 'trgm_contains'
+
+    def get_db_prep_lookup(self, value, connection):
+        escaped = str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return ('%s', ['%' + escaped + '%'])
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        if connection.vendor == 'postgresql':
+            return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+        return f"{lhs} LIKE {rhs} ESCAPE '\\'", lhs_params + rhs_params
+
+
+def trigram_search_enabled():
+    '''
+        Trigram search is used on PostgreSQL unless turned off in settings.
+    '''
+    return connection.vendor == 'postgresql' and getattr(settings, 'DJTRADERS_TRIGRAM_SEARCH', True)
+
+
+def search_filter(queryset, field, term):
+    '''
+        Filters queryset to rows where field contains term (case-insensitive).
+        In trigram mode the rows are also annotated with search_rank, the similarity to term.
+    '''
+    if not term:
+        return queryset
+
+    if not trigram_search_enabled():
+        return queryset.filter(**{f'{field}__icontains': term})
+
+    return queryset.filter(
+        **{f'{field}__trgm_contains': term}
+    ).annotate(
+        search_rank=TrigramWordSimilarity(term, field)
+    )
+
+
+def search_ordering(queryset, *ordering):
+    '''
+        Orders the best matches first when the queryset was ranked by search_filter(),
+        then by the given ordering.
+    '''
+    if 'search_rank' in queryset.query.annotations:
+        return queryset.order_by('-search_rank', *ordering)
+    return queryset.order_by(*ordering)
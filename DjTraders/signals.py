@@ -0,0 +1,165 @@
+# Receivers that keep denormalized columns in step with order writes.
+# Connected in DjtradersConfig.ready().
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+
+from . import facets
+from .charts import bump_data_version
+from .leaderboard import leaderboard
+from .models import Category, Customer, CustomerSummary, Order, OrderDetail, Product, SalesDaily
+
+
+@receiver(post_save, sender=OrderDetail, dispatch_uid='DjTraders.orderdetail_last_ordered')
+def orderdetail_saved(sender, instance, created, **kwargs):
+    '''
+        A new order line moves the product's last_ordered_at forward to the order's date.
+    '''
+    if created:
+        Product.RecordOrdered(instance.product_id, instance.order.order_date)
+
+
+# sales_daily and customer_summary rollups (see SalesDaily, CustomerSummary).  The pre_* receivers
+# remember the line / order as stored before the write, the post_* receivers take the old state out
+# of the rollups and put the new one in.
+@receiver(pre_save, sender=OrderDetail, dispatch_uid='DjTraders.orderdetail_sales_daily_pre_save')
+@receiver(pre_delete, sender=OrderDetail, dispatch_uid='DjTraders.orderdetail_sales_daily_pre_delete')
+def orderdetail_before_write(sender, instance, **kwargs):
+    instance._salesDailyCell = SalesDaily.LineCell(instance.pk) if instance.pk else None
+
+
+@receiver(post_save, sender=OrderDetail, dispatch_uid='DjTraders.orderdetail_sales_daily_save')
+def orderdetail_rollups_saved(sender, instance, created, **kwargs):
+    old = getattr(instance, '_salesDailyCell', None)
+    if old:
+        SalesDaily.ApplyLine(old, instance.pk, -1)
+    cell = SalesDaily.LineCell(instance.pk)
+    SalesDaily.ApplyLine(cell, instance.pk, 1)
+
+    if created:
+        CustomerSummary.RecordLine(cell, instance.pk)
+        # In-memory structures only change once the write is committed.
+        transaction.on_commit(lambda: leaderboard.record_revenue(cell['customer_id'], cell['line_total']))
+    else:
+        for customer_id in {cell['customer_id'], old['customer_id'] if old else None} - {None}:
+            CustomerSummary.Refresh(customer_id)
+        transaction.on_commit(leaderboard.invalidate)
+
+
+@receiver(pre_delete, sender=OrderDetail, dispatch_uid='DjTraders.orderdetail_sales_daily_delete_batch')
+def orderdetail_before_delete(sender, instance, origin=None, **kwargs):
+    # The lines removed by one delete() share the set of (order, product) pairs already taken out of
+    # sales_daily (see SalesDaily.ApplyLine).  origin is what delete() was called on.  All pre_delete
+    # signals of a delete come before its first post_delete, so a started batch means a new delete.
+    batch = getattr(origin, '_salesDailyDelete', None)
+    if batch is None or batch['started']:
+        batch = {'started': False, 'counted': set()}
+        if origin is not None:
+            origin._salesDailyDelete = batch
+    instance._salesDailyDelete = batch
+
+
+@receiver(post_delete, sender=OrderDetail, dispatch_uid='DjTraders.orderdetail_sales_daily_delete')
+def orderdetail_rollups_deleted(sender, instance, **kwargs):
+    old = getattr(instance, '_salesDailyCell', None)
+    if old:
+        batch = instance._salesDailyDelete
+        batch['started'] = True
+        SalesDaily.ApplyLine(old, instance.pk, -1, batch['counted'])
+        CustomerSummary.Refresh(old['customer_id'])
+        transaction.on_commit(leaderboard.invalidate)
+
+
+@receiver(pre_save, sender=Order, dispatch_uid='DjTraders.order_sales_daily_pre_save')
+def order_before_save(sender, instance, **kwargs):
+    instance._salesDailyKey = Order.objects.filter(pk=instance.pk).values_list(
+        'order_date', 'customer_id').first() if instance.pk else None
+
+
+@receiver(post_save, sender=Order, dispatch_uid='DjTraders.order_sales_daily_save')
+def order_rollups_saved(sender, instance, created, **kwargs):
+    if created:
+        CustomerSummary.RecordOrder(instance.customer_id, instance.order_date)
+        customer_id = instance.customer_id
+        transaction.on_commit(lambda: leaderboard.record_order(customer_id))
+        return
+
+    old = getattr(instance, '_salesDailyKey', None)
+    if old and old != (instance.order_date, instance.customer_id):
+        SalesDaily.MoveOrder(instance.pk, *old, instance.order_date, instance.customer_id)
+        for customer_id in {old[1], instance.customer_id}:
+            CustomerSummary.Refresh(customer_id)
+        transaction.on_commit(leaderboard.invalidate)
+
+
+@receiver(post_delete, sender=Order, dispatch_uid='DjTraders.order_summary_delete')
+def order_summary_deleted(sender, instance, **kwargs):
+    CustomerSummary.Refresh(instance.customer_id)
+    transaction.on_commit(leaderboard.invalidate)
+
+
+# The order years are shared by all workers (facets.py): dropped before the commit, another worker could
+# rebuild them from the old rows and cache that for DJTRADERS_ORDER_YEARS_TTL.
+@receiver(post_save, sender=Order, dispatch_uid='DjTraders.order_years_save')
+def order_year_saved(sender, instance, **kwargs):
+    order_date = instance.order_date
+    transaction.on_commit(lambda: facets.record_order_year(order_date))
+
+
+@receiver(post_delete, sender=Order, dispatch_uid='DjTraders.order_years_delete')
+def order_deleted(sender, **kwargs):
+    # The deleted order may have been the last one of its year.
+    transaction.on_commit(lambda: facets.invalidate(Order))
+
+
+@receiver(post_save, sender=Product, dispatch_uid='DjTraders.product_sales_daily_save')
+def product_sales_daily_saved(sender, instance, created, **kwargs):
+    if not created:
+        SalesDaily.RecategorizeProduct(instance)
+
+
+@receiver(post_save, sender=Customer, dispatch_uid='DjTraders.customer_facets_save')
+@receiver(post_delete, sender=Customer, dispatch_uid='DjTraders.customer_facets_delete')
+def customer_changed(sender, **kwargs):
+    # After the commit, like the order years above: a request in between would refill the facets from the old rows.
+    transaction.on_commit(lambda: facets.invalidate(Customer))
+
+
+@receiver(post_delete, sender=Customer, dispatch_uid='DjTraders.customer_summary_delete')
+def customer_deleted(sender, instance, **kwargs):
+    CustomerSummary.objects.filter(customer=instance.pk).delete()
+    transaction.on_commit(leaderboard.invalidate)
+
+
+@receiver(post_save, sender=Customer, dispatch_uid='DjTraders.customer_leaderboard_save')
+def customer_saved(sender, instance, **kwargs):
+    # The leaderboard shows the customer's name and country.
+    customer_id = instance.pk
+    transaction.on_commit(lambda: leaderboard.forget_customer(customer_id))
+
+
+@receiver(post_save, sender=Product, dispatch_uid='DjTraders.product_facets_save')
+@receiver(post_delete, sender=Product, dispatch_uid='DjTraders.product_facets_delete')
+@receiver(post_save, sender=Category, dispatch_uid='DjTraders.category_facets_save')
+@receiver(post_delete, sender=Category, dispatch_uid='DjTraders.category_facets_delete')
+def product_changed(sender, **kwargs):
+    # Category facet rows are built from products, so a category rename clears them too.
+    transaction.on_commit(lambda: facets.invalidate(Product))
+
+
+# Every chart reads orders, order lines and product prices, and shows customer, product and category names.
+# A write to any of them moves the chart data version forward so cached charts are rebuilt (see charts.py).
+# Only once the write is committed: bumped earlier, a chart drawn by another request before the commit
+# would be cached under the new version with the old data.  These receivers are connected last, so the
+# leaderboard has applied the write by the time it is handed the new version.
+def data_changed(**kwargs):
+    transaction.on_commit(version_bumped)
+
+
+def version_bumped():
+    leaderboard.adopt_version(bump_data_version())
+
+
+for model in (Order, OrderDetail, Product, Customer, Category):
+    post_save.connect(data_changed, sender=model, dispatch_uid=f'DjTraders.chart_version_save.{model.__name__}')
+    post_delete.connect(data_changed, sender=model, dispatch_uid=f'DjTraders.chart_version_delete.{model.__name__}')
@@ -0,0 +1,48 @@
+# Test runner for the Northwind schema (TEST_RUNNER in settings.py).
+#
+# The Northwind tables predate the app: migration 0001 only describes them (managed = False) and later
+# migrations alter tables they never created, so a test database cannot be built by running the
+# migrations.  This runner builds it from the current models instead (TEST MIGRATE = False, Django's
+# "syncdb"), with the unmanaged DjTraders models treated as managed for the length of the run.
+#
+# On PostgreSQL the pg_trgm extension is created first, the trigram indexes need it.  On other databases
+# (a SQLite DATABASES override for a quick local run) the models are created without their GIN indexes;
+# search.py falls back to icontains there.
+from django.apps import apps
+from django.contrib.postgres.indexes import GinIndex
+from django.db import connections
+from django.db.models.signals import pre_migrate
+from django.test.runner import DiscoverRunner
+
+
+def create_trigram_extension(using, **kwargs):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+class NorthwindTestRunner(DiscoverRunner):
+
+    def setup_databases(self, **kwargs):
+        models = list(apps.get_app_config('DjTraders').get_models())
+        # (model, managed, indexes) as declared, put back by teardown_databases()
+        self.declared = [(model, model._meta.managed, model._meta.indexes) for model in models]
+
+        postgres = connections['default'].vendor == 'postgresql'
+        for model in models:
+            model._meta.managed = True
+            if not postgres:
+                model._meta.indexes = [index for index in model._meta.indexes if not isinstance(index, GinIndex)]
+
+        for alias in connections:
+            connections[alias].settings_dict['TEST']['MIGRATE'] = False
+        pre_migrate.connect(create_trigram_extension, dispatch_uid='DjTraders.test_trigram_extension')
+        return super().setup_databases(**kwargs)
+
+    def teardown_databases(self, old_config, **kwargs):
+        super().teardown_databases(old_config, **kwargs)
+        pre_migrate.disconnect(dispatch_uid='DjTraders.test_trigram_extension')
+        for model, managed, indexes in self.declared:
+            model._meta.managed = managed
+            model._meta.indexes = indexes
@@ -1,3 +1,1021 @@
-from django.test import TestCase
+import csv
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core import signing
+from django.db import connection, transaction
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import random
+from functools import partial
+
+from . import facets, figures
+from .charts import bump_data_version, chart_cache, data_version, render_charts
+from .export import NAMES
+from .leaderboard import TopK, leaderboard
+import datetime
+from decimal import Decimal
+
+from .models import Category, Customer, CustomerSummary, Order, OrderDetail, Product, SalesDaily
+from .pagination import CURSOR_SALT
+from .search import search_filter
+from .timewindow import time_window, window_from_request
+
+# Libraries only the analytics charts need (see analytics.py and figures.py).
+HEAVY_MODULES = ('pandas', 'plotly')
+
+STARTUP = (
+    "import django, importlib; from django.conf import settings; "
+    "django.setup(); importlib.import_module(settings.ROOT_URLCONF)"
+)
+
+
+class ImportTimeTests(SimpleTestCase):
+    '''
+        django.setup() and the URLconf (models, views, signals) must not import pandas or plotly:
+        every worker boot, management command and non-chart request would pay for them.
+    '''
+
+    def imported_modules(self):
+        # A fresh interpreter, so nothing imported by the test run itself is counted.
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE},
+            capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        # -X importtime lines: "import time: self [us] | cumulative | <indent>package.module"
+        modules = {}
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, cumulative, name = line.split('|')
+                if cumulative.strip().isdigit():
+                    modules[name.strip()] = int(cumulative)
+        return modules
+
+    def test_startup_does_not_import_pandas_or_plotly(self):
+        modules = self.imported_modules()
+        self.assertIn('django', modules)
+        heavy = sorted({name.split('.')[0] for name in modules} & set(HEAVY_MODULES))
+        self.assertEqual(heavy, [], "django.setup() imported " + ", ".join(heavy))
+
+
+class TimeWindowTests(SimpleTestCase):
+    '''
+        Year / quarter / month / from-to selections as half-open date ranges (timewindow.py).
+    '''
+
+    def test_year(self):
+        self.assertEqual(time_window(year="2023"), (datetime.date(2023, 1, 1), datetime.date(2024, 1, 1)))
+
+    def test_quarters(self):
+        self.assertEqual(time_window(year=2023, quarter=1), (datetime.date(2023, 1, 1), datetime.date(2023, 4, 1)))
+        self.assertEqual(time_window(year=2023, quarter=4), (datetime.date(2023, 10, 1), datetime.date(2024, 1, 1)))
+
+    def test_months(self):
+        self.assertEqual(time_window(year=2024, month=2), (datetime.date(2024, 2, 1), datetime.date(2024, 3, 1)))
+        self.assertEqual(time_window(year=2023, month=12), (datetime.date(2023, 12, 1), datetime.date(2024, 1, 1)))
+        # A month wins over a quarter.
+        self.assertEqual(time_window(year=2023, quarter=1, month=12), time_window(year=2023, month=12))
+
+    def test_from_and_to_are_inclusive_days(self):
+        window = time_window(date_from="2023-03-05", date_to="2023-03-31")
+        self.assertEqual(window, (datetime.date(2023, 3, 5), datetime.date(2023, 4, 1)))
+        self.assertEqual(time_window(date_to=datetime.date(2023, 12, 31)), (None, datetime.date(2024, 1, 1)))
+        self.assertEqual(time_window(date_from="2023-03-05"), (datetime.date(2023, 3, 5), None))
+
+    def test_from_and_to_narrow_a_year(self):
+        window = time_window(year=2023, date_from="2022-06-01", date_to="2023-02-14")
+        self.assertEqual(window, (datetime.date(2023, 1, 1), datetime.date(2023, 2, 15)))
+
+    def test_from_after_to_is_an_empty_range(self):
+        start, end = time_window(date_from="2023-05-01", date_to="2023-04-01")
+        self.assertGreaterEqual(start, end)
+
+    def test_nothing_selected(self):
+        self.assertFalse(time_window())
+        self.assertFalse(time_window(year="", quarter="", month="", date_from="", date_to=""))
+        self.assertTrue(time_window(date_to="2023-01-01"))
+
+    def test_half_open_range(self):
+        condition = time_window(year=2023).q('order_date')
+        self.assertEqual(condition.children, [('order_date__gte', datetime.date(2023, 1, 1)),
+                                              ('order_date__lt', datetime.date(2024, 1, 1))])
+
+    def test_invalid_selections(self):
+        for selection in ({'year': "abc"}, {'year': 0}, {'year': 9999}, {'year': 2023, 'quarter': 5},
+                          {'year': 2023, 'month': 13}, {'year': 2023, 'month': 0}, {'quarter': 2},
+                          {'month': 3}, {'date_from': "2023-02-30"}, {'date_to': "yesterday"}):
+            with self.subTest(**selection), self.assertRaises(ValueError):
+                time_window(**selection)
+
+    def test_window_from_request(self):
+        factory = RequestFactory()
+        request = factory.get('/', {'selOrderYear': "2023", 'quarter': "4", 'to': "2023-11-15"})
+        self.assertEqual(window_from_request(request), (datetime.date(2023, 10, 1), datetime.date(2023, 11, 16)))
+        request = factory.get('/', {'year': "2022"})
+        self.assertEqual(window_from_request(request, year_param='year'),
+                         (datetime.date(2022, 1, 1), datetime.date(2023, 1, 1)))
+        for params in ({'selOrderYear': "abc"}, {'month': "3"}, {'selOrderYear': "2023", 'quarter': "Q1"},
+                       {'from': "2023-13-01"}):
+            with self.subTest(**params), self.assertRaises(Http404):
+                window_from_request(factory.get('/', params))
+
+
+@skipUnless(importlib.util.find_spec('plotly') and importlib.util.find_spec('pandas'), "needs plotly and pandas")
+class FiguresTests(SimpleTestCase):
+    '''
+        figures.bar / figures.line must build the same traces and layout as px.bar / px.line
+        for every shape the charts use.  The template is left out - figures.py ships only a part of it.
+    '''
+
+    def assertSameFigure(self, express, figure, *layouts):
+        for properties in layouts:
+            express.update_layout(**properties)
+            figure.update_layout(**properties)
+        expected, actual = json.loads(express.to_json()), json.loads(figure.to_json())
+        expected['layout'].pop('template')
+        actual['layout'].pop('template')
+        self.assertEqual(len(actual['data']), len(expected['data']))
+        for expectedTrace, actualTrace in zip(expected['data'], actual['data']):
+            self.assertEqual(actualTrace, expectedTrace)
+        self.assertEqual(actual['layout'], expected['layout'])
+
+    def test_categorical_color(self):
+        import pandas as pd
+        import plotly.express as px
+        years = ['1996', '1997', '1998']
+        self.assertSameFigure(
+            px.bar(pd.DataFrame({'Year': years, 'OrderTotal': [1.5, 2.0, 0.25]}),
+                   x='Year', y='OrderTotal', color='Year', text_auto=True),
+            figures.bar(x=years, y=[Decimal('1.5'), 2.0, 0.25], color=years, text_auto=True,
+                        labels={'x': 'Year', 'y': 'OrderTotal', 'color': 'Year'}),
+            {'title': 'Annual Orders', 'xaxis_title': 'Order Year', 'yaxis_title': 'Order Total'},
+            {'coloraxis_showscale': False, 'yaxis_tickprefix': '$', 'yaxis_tickformat': ',.2f'},
+        )
+
+    def test_categorical_color_of_another_column(self):
+        import plotly.express as px
+        self.assertSameFigure(
+            px.bar(x=['a', 'b', 'c'], y=[1, 2, 3], color=['x', 'y', 'x'], labels={'color': 'Group'}),
+            figures.bar(x=['a', 'b', 'c'], y=[1, 2, 3], color=['x', 'y', 'x'], labels={'color': 'Group'}),
+            {'title_x': 0.5},
+        )
+
+    def test_continuous_color_scales(self):
+        import plotly.express as px
+        self.assertSameFigure(
+            px.bar(x=['a', 'b'], y=[3, 4], color=[3, 4], color_continuous_scale=px.colors.sequential.Jet,
+                   labels={'color': 'N'}, height=600, width=1000, text_auto=True),
+            figures.bar(x=['a', 'b'], y=[3, 4], color=[3, 4], color_continuous_scale='Jet',
+                        labels={'color': 'N'}, height=600, width=1000, text_auto=True),
+        )
+        self.assertSameFigure(
+            px.bar(x=['a', 'b'], y=[1.0, 2.5], color=[1.0, 2.5], title='Top', color_continuous_scale='Blues',
+                   labels={'x': 'Product Name', 'y': 'Revenue ($)', 'color': 'Revenue ($)'}),
+            figures.bar(x=['a', 'b'], y=[1.0, 2.5], color=[1.0, 2.5], title='Top', color_continuous_scale='Blues',
+                        labels={'x': 'Product Name', 'y': 'Revenue ($)', 'color': 'Revenue ($)'}),
+        )
+        # Dates on x and the default scale.
+        day = datetime.date(2020, 1, 2)
+        self.assertSameFigure(
+            px.bar(x=[day], y=[1.0], color=[7], labels={'color': 'Order'}, height=500, text_auto=True),
+            figures.bar(x=[day], y=[Decimal('1.0')], color=[7], labels={'color': 'Order'}, height=500, text_auto=True),
+        )
+
+    def test_wide_form_grouped_bars(self):
+        import pandas as pd
+        import plotly.express as px
+        data = pd.DataFrame({'Year': [2020, 2021], 'TotalRevenue': [1.0, 2.0], 'TotalQuantity': [3, 4]})
+        columns = ['TotalRevenue', 'TotalQuantity']
+        self.assertSameFigure(
+            px.bar(data, x='Year', y=columns, text_auto=True, barmode='group', title='Sales',
+                   labels={'value': 'Metrics', 'variable': 'Metrics Type'}),
+            figures.bar(x=data['Year'], y={column: data[column] for column in columns}, text_auto=True,
+                        barmode='group', title='Sales',
+                        labels={'x': 'Year', 'value': 'Metrics', 'variable': 'Metrics Type'}),
+            {'xaxis_title': 'Time Period', 'legend_title': 'Metrics', 'yaxis_tickprefix': '$'},
+        )
+
+    def test_line_with_hover_data(self):
+        import pandas as pd
+        import plotly.express as px
+        data = pd.DataFrame({'Month': [1, 2], 'Revenue': [1.0, 2.0], 'year': [2020, 2020],
+                             'Orders': [1, 2], 'Comparison with Avg': [0.5, 1.5]})
+        hover = ['year', 'Orders', 'Comparison with Avg']
+        self.assertSameFigure(
+            px.line(data, x='Month', y='Revenue', title='Monthly', hover_data=hover),
+            figures.line(x=[1, 2], y=[1.0, 2.0], labels={'x': 'Month', 'y': 'Revenue'}, title='Monthly',
+                         hover_data={name: list(data[name]) for name in hover}),
+        )
+
+
+class KeysetPaginationTests(TestCase):
+    '''
+        The Customers and Products lists page by (name, primary key) with signed cursors (pagination.py).
+    '''
+    PAGE_SIZE = 15
+
+    @classmethod
+    def setUpTestData(cls):
+        # Few distinct names, so runs of equal names cross the page boundaries.
+        Customer.objects.bulk_create(
+            Customer(customer_name=f"Customer {i % 7}", country="Norway") for i in range(40))
+        category = Category.objects.create(category_name="Beverages")
+        Product.objects.bulk_create(
+            Product(product_name=None if i % 5 == 0 else f"Product {i % 3}", category=category, price=1)
+            for i in range(23))
+
+    def page(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj']
+
+    def walk(self, url, start=None, step='next_cursor'):
+        '''
+            Follows the cursors from the page at start (a cursor, or None for the first page).
+            Returns the pages' primary keys, in page order.
+        '''
+        pages = []
+        page = self.page(url, **({'cursor': start} if start else {}))
+        while True:
+            pages.append([obj.pk for obj in page])
+            cursor = getattr(page, step)
+            if cursor is None:
+                return pages
+            page = self.page(url, cursor=cursor)
+
+    def expected(self, model, field):
+        # NULL names first, as the views order them.
+        rows = model.objects.values_list(field, 'pk')
+        return [pk for _, pk in sorted(rows, key=lambda row: (row[0] is not None, row[0] or '', row[1]))]
+
+    def test_forward_walk_returns_every_row_once_in_key_order(self):
+        for url, model, field in ((reverse('DjTraders.Customers'), Customer, 'customer_name'),
+                                  (reverse('DjTraders.Products'), Product, 'product_name')):
+            with self.subTest(url=url):
+                pages = self.walk(url)
+                self.assertEqual(sum(pages, []), self.expected(model, field))
+                self.assertTrue(all(len(page) == self.PAGE_SIZE for page in pages[:-1]))
+
+    def test_backward_walk_from_last_page_returns_every_row_once(self):
+        for url, model, field in ((reverse('DjTraders.Customers'), Customer, 'customer_name'),
+                                  (reverse('DjTraders.Products'), Product, 'product_name')):
+            with self.subTest(url=url):
+                last = self.page(url).last_cursor
+                pages = self.walk(url, start=last, step='previous_cursor')
+                self.assertEqual(sum(reversed(pages), []), self.expected(model, field))
+                self.assertEqual(len(pages[0]), self.PAGE_SIZE)
+
+    def test_previous_of_second_page_is_first_page(self):
+        url = reverse('DjTraders.Customers')
+        first = self.page(url)
+        self.assertIsNone(first.previous_cursor)
+        second = self.page(url, cursor=first.next_cursor)
+        back = self.page(url, cursor=second.previous_cursor)
+        self.assertEqual([c.pk for c in back], [c.pk for c in first])
+
+    def test_page_boundaries(self):
+        url = reverse('DjTraders.Customers')
+        Customer.objects.filter(pk__in=self.expected(Customer, 'customer_name')[self.PAGE_SIZE:]).delete()
+
+        # Exactly one page of rows: no other pages.
+        page = self.page(url)
+        self.assertEqual(len(page), self.PAGE_SIZE)
+        self.assertFalse(page.has_other_pages())
+        self.assertIsNone(page.last_cursor)
+
+        # One row more: a second page holding only that row, which links back.
+        extra = Customer.objects.create(customer_name="Customer 9")
+        page = self.page(url)
+        self.assertTrue(page.has_next())
+        second = self.page(url, cursor=page.next_cursor)
+        self.assertEqual([c.pk for c in second], [extra.pk])
+        self.assertFalse(second.has_next())
+        self.assertTrue(second.has_previous())
+
+    def test_exact_count_only_on_request(self):
+        url = reverse('DjTraders.Customers')
+        self.assertIsNone(self.page(url).count)
+        self.assertEqual(self.page(url, count='exact').count, 40)
+
+    def test_invalid_cursors_are_not_found(self):
+        url = reverse('DjTraders.Customers')
+        valid = self.page(url).next_cursor
+        tampered = valid[:-1] + ('A' if valid[-1] != 'A' else 'B')
+        for cursor in (
+            tampered,
+            'not-a-cursor',
+            signing.dumps({'d': 'n', 'k': ["Customer 1", 1]}, salt='another.salt', compress=True),
+            # Signed with the right salt, but not a cursor.
+            signing.dumps({'d': 'n'}, salt=CURSOR_SALT, compress=True),
+            signing.dumps({'d': 'x', 'k': None}, salt=CURSOR_SALT, compress=True),
+            signing.dumps({'d': 'n', 'k': 5}, salt=CURSOR_SALT, compress=True),
+        ):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 404)
+
+
+class ActivityStatusTests(TestCase):
+    '''
+        A customer is Active with an order after the one-year cutoff, or with no order at all.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cutoff = Customer.ActivityCutoffDate()
+        cls.customers = {}
+        for name, day in (("Never ordered", None), ("On the cutoff", cutoff),
+                          ("Day after the cutoff", cutoff + datetime.timedelta(days=1)),
+                          ("Long ago", cutoff - datetime.timedelta(days=400))):
+            customer = Customer.objects.create(customer_name=name, is_active=True)
+            if day is not None:
+                order = Order.objects.create(customer=customer)
+                order.order_date = day
+                order.save()
+            cls.customers[name] = customer
+
+    def statuses(self):
+        return dict(Customer.WithActivityStatus(Customer.objects.all()).values_list('customer_name', 'activeStatus'))
+
+    def test_one_year_cutoff(self):
+        self.assertEqual(self.statuses(), {
+            "Never ordered": "Active",
+            "On the cutoff": "Inactive",
+            "Day after the cutoff": "Active",
+            "Long ago": "Inactive",
+        })
+
+    def test_recompute_stores_the_status(self):
+        before = data_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Customer.RecomputeActiveStatus(), 2)
+        self.assertEqual(
+            dict(Customer.objects.values_list('customer_name', 'is_active')),
+            {name: status == "Active" for name, status in self.statuses().items()})
+        self.assertEqual(Customer.RecomputeActiveStatus(), 0)
+        # No chart reads the stored flag.
+        self.assertEqual(data_version(), before)
+
+
+class LastOrderedTests(TestCase):
+    '''
+        Product.last_ordered_at only ever moves forward (RecordOrdered), and BackfillLastOrdered agrees with it.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Beverages")
+        cls.product = Product.objects.create(product_name="Chai", category=category, price=18)
+        cls.customer = Customer.objects.create(customer_name="Customer")
+
+    def last_ordered(self):
+        self.product.refresh_from_db()
+        return self.product.last_ordered_at, self.product.is_available
+
+    def test_only_moves_forward(self):
+        recent = Customer.ActivityCutoffDate() + datetime.timedelta(days=30)
+        old = Customer.ActivityCutoffDate() - datetime.timedelta(days=30)
+        self.assertEqual(Product.RecordOrdered(self.product.pk, old), 1)
+        self.assertEqual(self.last_ordered(), (old, False))
+        self.assertEqual(Product.RecordOrdered(self.product.pk, recent), 1)
+        self.assertEqual(self.last_ordered(), (recent, True))
+        # An older order - backdated, or arriving late - leaves the date alone.
+        self.assertEqual(Product.RecordOrdered(self.product.pk, old), 0)
+        self.assertEqual(Product.RecordOrdered(self.product.pk, recent), 0)
+        self.assertEqual(self.last_ordered(), (recent, True))
+
+    def test_new_order_line_records_its_order_date(self):
+        order = Order.objects.create(customer=self.customer)
+        OrderDetail.objects.create(order=order, product=self.product, quantity=1)
+        self.assertEqual(self.last_ordered(), (order.order_date, True))
+
+    def test_backfill(self):
+        order = Order.objects.create(customer=self.customer)
+        OrderDetail.objects.create(order=order, product=self.product, quantity=1)
+        Product.objects.update(last_ordered_at=None, is_available=False)
+        before = data_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Product.BackfillLastOrdered(), 1)
+        self.assertEqual(self.last_ordered(), (order.order_date, True))
+        self.assertEqual(Product.BackfillLastOrdered(), 0)
+        # No chart reads the stored date or flag.
+        self.assertEqual(data_version(), before)
+
+
+class SearchTests(TestCase):
+    '''
+        search_filter: substring matches, through the trigram lookup on PostgreSQL and icontains elsewhere.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ("Alfreds Futterkiste", "Ana Trujillo", "Antonio Moreno", "Save 50% Market", "Save 500 Market"):
+            Customer.objects.create(customer_name=name)
+
+    def names(self, term):
+        return sorted(search_filter(Customer.objects.all(), 'customer_name', term)
+                      .values_list('customer_name', flat=True))
+
+    def test_substring_matches(self):
+        self.assertEqual(self.names("TONIO"), ["Antonio Moreno"])
+        self.assertEqual(self.names("an"), ["Ana Trujillo", "Antonio Moreno"])
+        self.assertEqual(self.names("kist"), ["Alfreds Futterkiste"])
+        self.assertEqual(len(self.names("")), 5)
+
+    def test_wildcards_match_literally(self):
+        self.assertEqual(self.names("50%"), ["Save 50% Market"])
+        self.assertEqual(
+            list(Customer.objects.filter(customer_name__trgm_contains="5_0").values_list('customer_name', flat=True)),
+            [])
+
+    def test_trigram_search_only_on_postgresql(self):
+        ranked = 'search_rank' in search_filter(Customer.objects.all(), 'customer_name', "an").query.annotations
+        self.assertEqual(ranked, connection.vendor == 'postgresql')
+        with self.settings(DJTRADERS_TRIGRAM_SEARCH=False):
+            queryset = search_filter(Customer.objects.all(), 'customer_name', "an")
+            self.assertNotIn('search_rank', queryset.query.annotations)
+            self.assertEqual(sorted(queryset.values_list('customer_name', flat=True)), ["Ana Trujillo", "Antonio Moreno"])
+
+
+class ChartDataVersionTests(TestCase):
+    '''
+        Cached charts are keyed by the data version, which writes move forward once committed (signals.py).
+    '''
+
+    def test_write_bumps_version_on_commit(self):
+        before = data_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category_name="Condiments")
+            self.assertEqual(data_version(), before)
+        self.assertGreater(data_version(), before)
+
+    def test_rollup_rebuild_bumps_version(self):
+        before = data_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            SalesDaily.Rebuild()
+        self.assertGreater(data_version(), before)
+
+
+class RenderChartsTests(TestCase):
+    '''
+        render_charts() queries on the request's connection, inside its transaction, and only builds the
+        figures on the figure executor.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Seafood")
+        cls.product = Product.objects.create(product_name="Ikura", category=category, price=31)
+        cls.customer = Customer.objects.create(customer_name="Customer")
+
+    def setUp(self):
+        chart_cache.clear()
+
+    def test_charts_see_the_requests_uncommitted_rows(self):
+        # The TestCase transaction is never committed: a query on another connection would not see the order.
+        order = Order.objects.create(customer=self.customer)
+        OrderDetail.objects.create(order=order, product=self.product, quantity=3)
+        with CaptureQueriesContext(connection) as queries:
+            plots = render_charts({
+                'ProductsRevenuePlot': self.customer.ProductReveues,
+                'ProductsPlot': self.customer.ProductsSoldPlot,
+                'OrdersByDatePlot': partial(self.customer.OrdersPlacedPlot, order.order_date.year),
+            })
+        for name, html in plots.items():
+            with self.subTest(chart=name):
+                self.assertNotIn('chart-unavailable', html)
+                self.assertNotIn('<div> No ', html)
+        self.assertIn('Ikura', plots['ProductsPlot'])
+        # The product facts are loaded once for both product plots, and every query is captured.
+        self.assertEqual(len(queries), 2)
+
+    def test_product_facts_are_kept_per_source(self):
+        day = datetime.date(2023, 2, 1)
+        for _ in range(2):
+            order = Order.objects.create(customer=self.customer)
+            order.order_date = day
+            order.save()
+            OrderDetail.objects.create(order=order, product=self.product, quantity=2)
+        # One row per order line, one per (day, product) from sales_daily.
+        self.assertEqual(len(self.customer.ProductFacts(rollup=False)), 2)
+        self.assertEqual(len(self.customer.ProductFacts(rollup=True)), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.customer.ProductFacts(rollup=False)), 2)
+        with self.settings(DJTRADERS_SALES_ROLLUP=True), self.assertNumQueries(0):
+            self.assertEqual(len(self.customer.ProductFacts()), 1)
+
+    def test_figures_are_cached(self):
+        charts = {'ProductsPlot': self.customer.ProductsSoldPlot}
+        first = render_charts(charts)
+        with self.assertNumQueries(0):
+            self.assertEqual(render_charts(charts), first)
+
+
+class FacetTests(TestCase):
+    '''
+        The cached facet counts of the list views follow committed saves and deletes.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dairy = Category.objects.create(category_name="Dairy")
+        cls.cheese = Product.objects.create(product_name="Cheese", category=cls.dairy, price=10)
+        cls.customers = [
+            Customer.objects.create(customer_name=name, country=country)
+            for name, country in (("A", "Peru"), ("B", "Peru"), ("C", "Chile"))
+        ]
+
+    def setUp(self):
+        facets.invalidate()
+
+    def countries(self):
+        return {row['country']: row['count'] for row in facets.customer_facet('country')}
+
+    def categories(self):
+        return {row['category_name']: row['count'] for row in facets.category_facet()}
+
+    def test_customer_counts_after_save_and_delete(self):
+        self.assertEqual(self.countries(), {"Chile": 1, "Peru": 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customers[0].country = "Chile"
+            self.customers[0].save()
+            self.assertEqual(self.countries(), {"Chile": 1, "Peru": 2})
+        self.assertEqual(self.countries(), {"Chile": 2, "Peru": 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customers[1].delete()
+        self.assertEqual(self.countries(), {"Chile": 2})
+
+    def test_category_counts_after_save_and_delete(self):
+        self.assertEqual(self.categories(), {"Dairy": 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(product_name="Milk", category=self.dairy, price=2)
+            self.assertEqual(self.categories(), {"Dairy": 1})
+        self.assertEqual(self.categories(), {"Dairy": 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cheese.delete()
+        self.assertEqual(self.categories(), {"Dairy": 1})
+
+
+class OrderYearsTests(TestCase):
+    '''
+        The cached order year list (facets.order_years) follows committed orders only.
+    '''
+    YEAR = 2001
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(customer_name="Customer")
+        cls.order = Order.objects.create(customer=cls.customer)
+        cls.order.order_date = datetime.date(cls.YEAR, 3, 1)
+        cls.order.save()
+
+    def setUp(self):
+        facets.invalidate()
+        self.assertEqual(facets.order_years(), [{'Year': self.YEAR}])
+
+    def years(self):
+        return [row['Year'] for row in facets.order_years()]
+
+    def test_new_year_shows_up_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(customer=self.customer)
+            self.assertEqual(self.years(), [self.YEAR])
+        self.assertEqual(self.years(), [self.YEAR, order.order_date.year])
+
+    def test_rolled_back_order_does_not_show_up(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Order.objects.create(customer=self.customer)
+                raise RuntimeError
+        self.assertEqual(self.years(), [self.YEAR])
+
+    def test_delete_clears_the_years(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.delete()
+            self.assertEqual(self.years(), [self.YEAR])
+        self.assertEqual(self.years(), [])
+
+
+class RevenueRanksTests(TestCase):
+    '''
+        Product.RevenueRanks ranks in the database - it must agree with a sort of the order lines in Python.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Grains")
+        cls.products = [
+            Product.objects.create(product_name=f"Product {i}", category=category, price=price)
+            for i, price in enumerate((5, 7, 3, 10, 5, 1))
+        ]
+        customer = Customer.objects.create(customer_name="Customer")
+        # (year, product, quantity) - products 0 and 4 tie in 2020, products 3 and 4 over all years.
+        lines = [(2020, 0, 2), (2020, 4, 2), (2020, 1, 1), (2020, 2, 5), (2020, 5, 3),
+                 (2021, 1, 9), (2021, 3, 1), (2021, 5, 4), (2021, 2, 1), (2021, 0, 4)]
+        for year, product, quantity in lines:
+            order = Order.objects.create(customer=customer)
+            order.order_date = datetime.date(year, 6, 1)
+            order.save()
+            OrderDetail.objects.create(order=order, product=cls.products[product], quantity=quantity)
+
+    def expected(self, n, per_year):
+        totals = {}
+        for line in OrderDetail.objects.select_related('order'):
+            key = (line.order.order_date.year if per_year else None, line.product_id)
+            totals[key] = totals.get(key, 0) + line.line_total
+        ranks = {}
+        for year in {year for year, _ in totals}:
+            revenues = [(revenue, product) for (y, product), revenue in totals.items() if y == year]
+            top = sorted(revenues, key=lambda r: (-r[0], r[1]))[:n]
+            bottom = sorted(revenues, key=lambda r: (r[0], r[1]))[:n]
+            ranks[year] = ([p for _, p in top], [p for _, p in bottom])
+        return ranks
+
+    def test_per_year_matches_a_python_sort(self):
+        ranks = Product.RevenueRanks(n=2, per_year=True)
+        for year, (top, bottom) in self.expected(2, per_year=True).items():
+            with self.subTest(year=year):
+                inYear = ranks[ranks['year'] == year]
+                self.assertEqual(list(inYear[inYear['top_rank'] <= 2].sort_values('top_rank')['product_id']), top)
+                self.assertEqual(list(inYear[inYear['bottom_rank'] <= 2].sort_values('bottom_rank')['product_id']), bottom)
+
+    def test_all_years_matches_a_python_sort(self):
+        ranks = Product.RevenueRanks(n=3, per_year=False)
+        top, bottom = self.expected(3, per_year=False)[None]
+        self.assertEqual(list(ranks[ranks['top_rank'] <= 3].sort_values('top_rank')['product_id']), top)
+        self.assertEqual(list(ranks[ranks['bottom_rank'] <= 3].sort_values('bottom_rank')['product_id']), bottom)
+        self.assertEqual(float(ranks['total_revenue'].max()), 70.0)
+
+    def test_invalid_year_is_not_found(self):
+        url = reverse('DjTraders.TopBottomProductAnalysis')
+        for year in ("abc", "0", "99999"):
+            with self.subTest(year=year):
+                self.assertEqual(self.client.get(url, {'selOrderYear': year}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'selOrderYear': "2021"}).status_code, 200)
+
+
+class AnnualSalesTests(TestCase):
+    '''
+        Order.AnnualSales totals per (Year, Month), from the order lines and from sales_daily.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Confections")
+        cls.products = [Product.objects.create(product_name=f"Product {i}", category=category, price=price)
+                        for i, price in enumerate((2, 3, 5))]
+        customer = Customer.objects.create(customer_name="Customer")
+        # (day, [(product, quantity), ...]) - several lines per order, and a March in two years.
+        for day, lines in (
+            (datetime.date(2022, 3, 4), [(0, 1), (1, 2), (2, 3)]),    # 23.00, 6 sold
+            (datetime.date(2022, 3, 20), [(0, 4), (2, 1)]),           # 13.00, 5 sold
+            (datetime.date(2022, 4, 2), [(1, 1), (1, 1)]),            # 6.00, 2 sold
+            (datetime.date(2023, 3, 9), [(0, 10), (1, 10)]),          # 50.00, 20 sold
+        ):
+            order = Order.objects.create(customer=customer)
+            order.order_date = day
+            order.save()
+            for product, quantity in lines:
+                OrderDetail.objects.create(order=order, product=cls.products[product], quantity=quantity)
+
+    def annual(self, **kwargs):
+        annual = Order.AnnualSales(**kwargs)
+        return [
+            (row.Year, row.Month, float(row.TotalRevenue), int(row.TotalProductsSold), int(row.TotalOrders))
+            for row in annual.itertuples()
+        ]
+
+    def test_each_order_counted_once(self):
+        for rollup in (False, True):
+            with self.subTest(rollup=rollup):
+                self.assertEqual(self.annual(rollup=rollup), [
+                    (2022, 3, 36.0, 11, 2),
+                    (2022, 4, 6.0, 2, 1),
+                    (2023, 3, 50.0, 20, 1),
+                ])
+
+    def test_year_filter_applies_before_grouping(self):
+        for rollup in (False, True):
+            with self.subTest(rollup=rollup):
+                self.assertEqual(self.annual(year=2022, rollup=rollup), [
+                    (2022, 3, 36.0, 11, 2),
+                    (2022, 4, 6.0, 2, 1),
+                ])
+                self.assertEqual(self.annual(year=2021, rollup=rollup), [])
+
+
+class SalesRollupTests(TestCase):
+    '''
+        sales_daily and customer_summary, kept in step by signals.py, must match a rebuild from the orders.
+    '''
+    DAY = datetime.date(2023, 5, 17)
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Dairy")
+        cls.cheese = Product.objects.create(product_name="Cheese", category=category, price=10)
+        cls.milk = Product.objects.create(product_name="Milk", category=category, price=2)
+        cls.customer = Customer.objects.create(customer_name="Customer")
+
+    def place_order(self, day, *lines, customer=None):
+        '''
+            An order placed on day, with one order line per (product, quantity).
+        '''
+        order = Order.objects.create(customer=customer or self.customer)
+        # order_date is auto_now_add - move the order to its day like an edit would.
+        order.order_date = day
+        order.save()
+        for product, quantity in lines:
+            OrderDetail.objects.create(order=order, product=product, quantity=quantity)
+        return order
+
+    def cells(self):
+        return {
+            (row.day, row.product_id, row.customer_id): (row.quantity, row.revenue, row.order_count)
+            for row in SalesDaily.objects.all()
+        }
+
+    def summaries(self):
+        return set(CustomerSummary.objects.values_list(
+            'customer_id', 'order_count', 'first_order_date', 'last_order_date', 'lifetime_revenue'))
+
+    def assertMatchesRebuild(self):
+        cells, summaries = self.cells(), self.summaries()
+        SalesDaily.Rebuild()
+        CustomerSummary.Rebuild()
+        self.assertEqual(cells, self.cells())
+        self.assertEqual(summaries, self.summaries())
+
+    def test_orders_on_one_cell(self):
+        self.place_order(self.DAY, (self.cheese, 1), (self.cheese, 2), (self.milk, 1))
+        self.place_order(self.DAY, (self.cheese, 5))
+        cell = self.cells()[(self.DAY, self.cheese.pk, self.customer.pk)]
+        self.assertEqual(cell[0], 8)
+        self.assertEqual(cell[1], 80)
+        self.assertEqual(cell[2], 2)
+        self.assertMatchesRebuild()
+
+    def test_deleting_one_of_two_orders_on_a_cell(self):
+        first = self.place_order(self.DAY, (self.cheese, 1), (self.cheese, 2))
+        self.place_order(self.DAY, (self.cheese, 5))
+
+        first.delete()
+
+        self.assertEqual(self.cells()[(self.DAY, self.cheese.pk, self.customer.pk)], (5, 50, 1))
+        self.assertMatchesRebuild()
+
+    def test_deleting_an_orders_lines_as_a_queryset(self):
+        first = self.place_order(self.DAY, (self.cheese, 1), (self.cheese, 2), (self.milk, 3))
+        self.place_order(self.DAY, (self.cheese, 5))
+
+        OrderDetail.objects.filter(order=first).delete()
+
+        self.assertEqual(self.cells(), {(self.DAY, self.cheese.pk, self.customer.pk): (5, 50, 1)})
+        self.assertMatchesRebuild()
+
+    def test_deleting_lines_one_at_a_time(self):
+        first = self.place_order(self.DAY, (self.cheese, 1), (self.cheese, 2))
+        self.place_order(self.DAY, (self.cheese, 5))
+
+        lines = list(first.orderdetail_set.all())
+        lines[0].delete()
+        self.assertEqual(self.cells()[(self.DAY, self.cheese.pk, self.customer.pk)], (7, 70, 2))
+        lines[1].delete()
+        self.assertEqual(self.cells()[(self.DAY, self.cheese.pk, self.customer.pk)], (5, 50, 1))
+        self.assertMatchesRebuild()
+
+    def test_deleting_the_last_order_empties_the_cell(self):
+        order = self.place_order(self.DAY, (self.cheese, 1), (self.cheese, 2))
+        order.delete()
+        self.assertEqual(self.cells(), {})
+
+    def test_unit_price_backfill_updates_the_rollups(self):
+        order = self.place_order(self.DAY, (self.cheese, 3))
+        # A line written without unit_price, e.g. by another program: no revenue in the rollups.
+        OrderDetail.objects.filter(order=order).update(unit_price=None)
+        SalesDaily.Rebuild()
+        CustomerSummary.Rebuild()
+
+        self.assertEqual(OrderDetail.BackfillUnitPrice(), 1)
+
+        self.assertEqual(self.cells()[(self.DAY, self.cheese.pk, self.customer.pk)], (3, 30, 1))
+        self.assertEqual(CustomerSummary.objects.get(pk=self.customer.pk).lifetime_revenue, 30)
+
+    def test_edits(self):
+        other = Customer.objects.create(customer_name="Other customer")
+        order = self.place_order(self.DAY, (self.cheese, 1), (self.milk, 2))
+        self.place_order(self.DAY, (self.cheese, 5), (self.milk, 1), customer=other)
+
+        line = order.orderdetail_set.get(product=self.milk)
+        line.quantity = 4
+        line.save()
+        line.product = self.cheese
+        line.save()
+        order.order_date = self.DAY + datetime.timedelta(days=1)
+        order.customer = other
+        order.save()
+
+        self.assertMatchesRebuild()
+
+
+class OrdersPlacedTests(TestCase):
+    '''
+        The Orders Placed accordion of the customer detail page (_OrdersPlaced.html).
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Produce")
+        cls.tofu = Product.objects.create(product_name="Tofu", category=category, price=Decimal("23.25"))
+        cls.customer = Customer.objects.create(customer_name="Customer", contact_name="Contact")
+
+    def place_order(self, customer, *lines):
+        order = Order.objects.create(customer=customer)
+        for product, quantity in lines:
+            OrderDetail.objects.create(order=order, product=product, quantity=quantity)
+        return order
+
+    def orders_placed(self, customer):
+        response = self.client.get(reverse('DjTraders.OrdersPlaced'), {'customer_id': customer.pk})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_prices_stay_on_the_order_snapshot(self):
+        self.place_order(self.customer, (self.tofu, 2))
+        self.tofu.price = Decimal("30.00")
+        self.tofu.save()
+        html = self.orders_placed(self.customer)
+        # Price, line total and order total all as ordered: 2 x 23.25.
+        self.assertIn("$23.25", html)
+        self.assertEqual(html.count("$46.50"), 2)
+        self.assertNotIn("30.00", html)
+
+    def test_query_count_does_not_grow_with_the_orders(self):
+        few = Customer.objects.create(customer_name="Few", contact_name="Contact")
+        many = Customer.objects.create(customer_name="Many", contact_name="Contact")
+        self.place_order(few, (self.tofu, 1))
+        for quantity in range(1, 11):
+            self.place_order(many, (self.tofu, quantity), (self.tofu, 1))
+        # The customer, its orders with their totals, and all their lines with the products.
+        for customer, orders in ((few, 1), (many, 10)):
+            with self.subTest(orders=orders), self.assertNumQueries(3):
+                # Each order is listed in its accordion button and its table header.
+                self.assertEqual(self.orders_placed(customer).count("Order ID:"), 2 * orders)
+
+
+class ExportTests(TestCase):
+    '''
+        The streamed order line export (export.py), as NDJSON and as CSV.
+    '''
+    NAME = 'Gravad lax, "Ikura"\nand Røgede sild'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name="Seafood; smoked")
+        cls.fish = Product.objects.create(product_name=cls.NAME, category=category, price=Decimal("26.10"))
+        cls.tea = Product.objects.create(product_name="Tea", category=category, price=Decimal("4.50"))
+        cls.customers = [Customer.objects.create(customer_name=f"Customer {i}, Ltd.", country="Perú") for i in range(2)]
+        for customer in cls.customers:
+            order = Order.objects.create(customer=customer)
+            OrderDetail.objects.create(order=order, product=cls.fish, quantity=3)
+            OrderDetail.objects.create(order=order, product=cls.tea, quantity=1)
+
+    def export(self, fmt, **params):
+        response = self.client.get(reverse(f'DjTraders.ExportOrders{fmt}'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_lines_parse_back(self):
+        rows = [json.loads(line) for line in self.export('NDJSON').splitlines()]
+        self.assertEqual([row['order_detail_id'] for row in rows],
+                         sorted(OrderDetail.objects.values_list('order_detail_id', flat=True)))
+        self.assertEqual(rows[0]['product_name'], self.NAME)
+        self.assertEqual(rows[0]['country'], "Perú")
+        # Prices as decimal strings, exactly as stored.
+        self.assertEqual((rows[0]['unit_price'], rows[0]['line_total']), ("26.10", "78.30"))
+
+    def test_csv_round_trips(self):
+        rows = list(csv.reader(io.StringIO(self.export('CSV'), newline='')))
+        self.assertEqual(rows[0], NAMES)
+        self.assertEqual(len(rows), 5)
+        line = dict(zip(rows[0], rows[1]))
+        self.assertEqual(line['product_name'], self.NAME)
+        self.assertEqual(line['customer_name'], "Customer 0, Ltd.")
+        self.assertEqual(line['category_name'], "Seafood; smoked")
+        self.assertEqual((line['quantity'], line['line_total']), ("3", "78.30"))
+
+    def test_filters(self):
+        rows = [json.loads(line) for line in self.export(
+            'NDJSON', customer_id=self.customers[1].pk, product_id=self.tea.pk).splitlines()]
+        self.assertEqual([(row['customer_id'], row['product_name']) for row in rows],
+                         [(self.customers[1].pk, "Tea")])
+
+    def test_chunks(self):
+        with self.settings(DJTRADERS_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get(reverse('DjTraders.ExportOrdersCSV'))
+            chunks = list(response.streaming_content)
+        self.assertEqual(len(list(csv.reader(io.StringIO(b''.join(chunks).decode(), newline='')))), 5)
+        self.assertGreater(len(chunks), 1)
+
+
+class TopKTests(SimpleTestCase):
+    '''
+        The leaderboard's in-memory top K (leaderboard.py).
+    '''
+
+    def test_insert_fills_up_to_k(self):
+        board = TopK(3)
+        board.increase(1, 5)
+        board.increase(2, 7)
+        self.assertEqual(board.top(), [(2, 7), (1, 5)])
+        board.increase(3, 1)
+        board.increase(4, 2)
+        self.assertEqual(board.top(), [(2, 7), (1, 5), (4, 2)])
+
+    def test_update_reorders_members(self):
+        board = TopK(3)
+        board.load({1: 5, 2: 7, 3: 6})
+        board.increase(1, 3)
+        self.assertEqual(board.top(), [(1, 8), (2, 7), (3, 6)])
+        self.assertEqual(board.top(2), [(1, 8), (2, 7)])
+
+    def test_evicts_the_weakest_member(self):
+        board = TopK(2)
+        board.load({1: 5, 2: 7, 3: 4})
+        board.increase(3, 2)
+        self.assertEqual(board.top(), [(2, 7), (3, 6)])
+        # A lower score stays out, but is remembered.
+        board.increase(1, 0)
+        self.assertEqual(board.top(), [(2, 7), (3, 6)])
+        board.increase(1, 2)
+        self.assertEqual(board.top(), [(1, 7), (2, 7)])
+
+    def test_ties_rank_the_lower_id_first(self):
+        board = TopK(2)
+        board.load({5: 3, 7: 3, 9: 3})
+        self.assertEqual(board.top(), [(5, 3), (7, 3)])
+        # Tying the weakest member only gets in with a lower id.
+        board.increase(8, 3)
+        self.assertEqual(board.top(), [(5, 3), (7, 3)])
+        board.increase(6, 3)
+        self.assertEqual(board.top(), [(5, 3), (6, 3)])
+
+    def test_matches_a_full_sort(self):
+        rng = random.Random(672)
+        board = TopK(5)
+        board.load({member: rng.randint(0, 20) for member in range(30)})
+        for _ in range(2000):
+            board.increase(rng.randrange(40), rng.randint(0, 3))
+            expected = sorted(board.scores.items(), key=lambda item: (-item[1], item[0]))[:5]
+            self.assertEqual(board.top(), expected)
+        # Stale heap entries are compacted away.
+        self.assertLessEqual(len(board._heap), 4 * 5 + 16)
+
+
+class LeaderboardTests(TestCase):
+    '''
+        The per-process leaderboard follows the chart data version: its own writes are applied in place,
+        any other change of the version rebuilds it.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = [Customer.objects.create(customer_name=f"Customer {i}", country="Peru") for i in range(3)]
+        for i, customer in enumerate(cls.customers):
+            for _ in range(i + 1):
+                Order.objects.create(customer=customer)
+
+    def setUp(self):
+        leaderboard.invalidate()
+
+    def orders(self):
+        return [(row['customer_name'], row['nOrders']) for row in leaderboard.top_by_orders(3)]
+
+    def test_own_write_is_applied_without_a_rebuild(self):
+        self.assertEqual(self.orders(), [("Customer 2", 3), ("Customer 1", 2), ("Customer 0", 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(customer=self.customers[0])
+            Order.objects.create(customer=self.customers[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.orders(), [("Customer 0", 3), ("Customer 2", 3), ("Customer 1", 2)])
+
+    def test_version_moved_elsewhere_rebuilds(self):
+        self.orders()
+        # A write this process did not apply - another worker, a bulk rebuild.
+        CustomerSummary.objects.filter(pk=self.customers[1].pk).update(order_count=10)
+        self.assertEqual(self.orders()[0], ("Customer 2", 3))
+        bump_data_version()
+        self.assertEqual(self.orders()[0], ("Customer 1", 10))
@@ -0,0 +1,128 @@
+# Time-window filters for the analytics queries.
+#
+# A year, quarter, month or from/to selection is turned into a half-open date range and applied as
+# order_date >= start AND order_date < end.  Filtering on an ExtractYear annotation, on
+# order_date__year or with Year__contains (a string LIKE on the year) wraps the column in a function,
+# so the database cannot use the B-tree indexes on orders(order_date) and orders(customer_id, order_date)
+# (migration 0007).  A plain range on the column can.
+import datetime
+from collections import namedtuple
+
+from django.db.models import Q
+from django.http import Http404
+
+
+class TimeWindow(namedtuple('TimeWindow', ['start', 'end'])):
+    '''
+        Dates d with start <= d < end.  Either bound may be None (unbounded).
+        A namedtuple, so a window can be part of a chart cache key.
+    '''
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.start is not None or self.end is not None
+
+    def q(self, field):
+        '''
+            The range predicate on field, e.g. 'order_date' or 'order__order_date'.
+        '''
+        condition = Q()
+        if self.start is not None:
+            condition &= Q(**{f'{field}__gte': self.start})
+        if self.end is not None:
+            condition &= Q(**{f'{field}__lt': self.end})
+        return condition
+
+
+def _number(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+
+def _date(value, name):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name} date: {value!r}")
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def time_window(year=None, quarter=None, month=None, date_from=None, date_to=None):
+    '''
+        The TimeWindow for a selection.  year, quarter (1-4) and month (1-12) may be ints or digit strings,
+        quarter and month need a year.  date_from and date_to are dates or ISO strings, both inclusive;
+        together with a year they narrow it.  Empty values mean "not selected"; invalid ones raise ValueError.
+    '''
+    year = _number(year, 'year')
+    quarter = _number(quarter, 'quarter')
+    month = _number(month, 'month')
+    date_from = _date(date_from, 'from')
+    date_to = _date(date_to, 'to')
+
+    start = end = None
+    if year is not None:
+        if not 1 <= year <= 9998:
+            raise ValueError(f"Invalid year: {year}")
+        if month is not None:
+            if not 1 <= month <= 12:
+                raise ValueError(f"Invalid month: {month}")
+            start = datetime.date(year, month, 1)
+            end = _add_months(start, 1)
+        elif quarter is not None:
+            if not 1 <= quarter <= 4:
+                raise ValueError(f"Invalid quarter: {quarter}")
+            start = datetime.date(year, 3 * quarter - 2, 1)
+            end = _add_months(start, 3)
+        else:
+            start = datetime.date(year, 1, 1)
+            end = datetime.date(year + 1, 1, 1)
+    elif quarter is not None or month is not None:
+        raise ValueError("A quarter or month selection needs a year.")
+
+    if date_from is not None:
+        start = date_from if start is None else max(start, date_from)
+    if date_to is not None:
+        dayAfter = date_to + datetime.timedelta(days=1)
+        end = dayAfter if end is None else min(end, dayAfter)
+
+    return TimeWindow(start, end)
+
+
+def filter_window(queryset, field, window=None, **selection):
+    '''
+        queryset restricted to rows whose date field lies in window
+        (or in time_window(**selection) when no window is given).
+    '''
+    if window is None:
+        window = time_window(**selection)
+    if not window:
+        return queryset
+    return queryset.filter(window.q(field))
+
+
+def window_from_request(request, year_param='selOrderYear'):
+    '''
+        The TimeWindow selected by the request's year (year_param), quarter, month, from and to parameters.
+    '''
+    try:
+        return time_window(
+            year=request.GET.get(year_param),
+            quarter=request.GET.get('quarter'),
+            month=request.GET.get('month'),
+            date_from=request.GET.get('from'),
+            date_to=request.GET.get('to'),
+        )
+    except ValueError as error:
+        raise Http404(str(error))
@@ -1,6 +1,12 @@
 
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+from .charts import plotly_version
+
+# The analytics partials: views.py (sync) by default, async_views.py when DJTRADERS_ASYNC_VIEWS is set -
+# for deployments under an ASGI server.  The async versions are also always served under DjTraders/async/.
+analytics = async_views if getattr(settings, 'DJTRADERS_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     path(
@@ -8,6 +14,11 @@ urlpatterns = [
         views.DjTradersHome, 
         name='DjTraders.Home'),
     
+    path(
+        f'DjTraders/scripts/plotly-{plotly_version()}.min.js',
+        views.PlotlyJS,
+        name='DjTraders.PlotlyJS'),
+
     path(
         'DjTraders/Customers', 
          views.DjTradersCustomersView.as_view(), 
@@ -17,6 +28,23 @@ urlpatterns = [
         'DjTraders/CustomersJSON', 
          views.CustomersListJSON.as_view(), 
          name='DjTraders.CustomersJSON'),
+
+    path(
+        'DjTraders/export/orders.ndjson',
+        views.ExportOrders,
+        {'fmt': 'ndjson'},
+        name='DjTraders.ExportOrdersNDJSON'),
+
+    path(
+        'DjTraders/export/orders.csv',
+        views.ExportOrders,
+        {'fmt': 'csv'},
+        name='DjTraders.ExportOrdersCSV'),
+    
+    path(
+        'DjTraders/ChartCacheStats', 
+         views.ChartCacheStats, 
+         name='DjTraders.ChartCacheStats'),
     
     path(
         'DjTraders/TopTenCustomers', 
@@ -77,23 +105,23 @@ urlpatterns = [
     
     path(
         'DjTraders/OrdersPlaced',
-        views.OrdersPlaced,
+        analytics.OrdersPlaced,
         name='DjTraders.OrdersPlaced'),
 
     path(
         'DjTraders/OrdersByDate',
-        views.OrdersByDate,
+        analytics.OrdersByDate,
         {'selOrderYear': ""},
         name='DjTraders.OrdersByDate'),
 
     path(
         'DjTraders/OrdersByCategory',
-        views.OrdersByCategory,
+        analytics.OrdersByCategory,
         name='DjTraders.OrdersByCategory'),
 
     path(
         'DjTraders/OrdersByProduct',
-        views.OrdersByProduct,
+        analytics.OrdersByProduct,
         name='DjTraders.OrdersByProduct'),
     
     path(
@@ -114,11 +142,11 @@ urlpatterns = [
 
     path(
         route = 'DjTraders/AnnualAndMonthlyProduct/<int:pk>',
-        view = views.ProductAnnualMonthlySales,
+        view = analytics.ProductAnnualMonthlySales,
         name='DjTraders.AnnualAndMonthlyProduct'),
 
     path('DjTraders/ProductSaleAnalysis/<int:pk>',
-        views.product_sales_analysis,
+        analytics.product_sales_analysis,
         name='DjTraders.ProductSaleAnalysis'),
 
     path('DjTraders/CategorySaleAnalysis/<int:pk>',
@@ -129,4 +157,35 @@ urlpatterns = [
         'DjTraders/GetEachProductDetails',
         views.GetProductDetails,
         name='DjTraders.GetEachProductDetails'),
- ]
\ No newline at end of file
+ 
+    # Async versions of the analytics partials (see async_views.py)
+    path(
+        'DjTraders/async/OrdersPlaced',
+        async_views.OrdersPlaced,
+        name='DjTraders.OrdersPlacedAsync'),
+
+    path(
+        'DjTraders/async/OrdersByDate',
+        async_views.OrdersByDate,
+        {'selOrderYear': ""},
+        name='DjTraders.OrdersByDateAsync'),
+
+    path(
+        'DjTraders/async/OrdersByCategory',
+        async_views.OrdersByCategory,
+        name='DjTraders.OrdersByCategoryAsync'),
+
+    path(
+        'DjTraders/async/OrdersByProduct',
+        async_views.OrdersByProduct,
+        name='DjTraders.OrdersByProductAsync'),
+
+    path(
+        route = 'DjTraders/async/AnnualAndMonthlyProduct/<int:pk>',
+        view = async_views.ProductAnnualMonthlySales,
+        name='DjTraders.AnnualAndMonthlyProductAsync'),
+
+    path('DjTraders/async/ProductSaleAnalysis/<int:pk>',
+        async_views.product_sales_analysis,
+        name='DjTraders.ProductSaleAnalysisAsync'),
+ ]
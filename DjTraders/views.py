@@ -1,16 +1,28 @@
 from django.shortcuts import get_object_or_404, render, redirect
 import re
 
-from django.views.generic import View, ListView, DetailView, CreateView, UpdateView, DeleteView
+from django.views.generic import View, TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
 from .models import Customer, Product, Category, Order, OrderDetail
 from .forms import CustomerForm, ProductForm
-import plotly.express as px
-import pandas as pd
-from plotly.offline import plot
-from django.http import JsonResponse
-from django.db.models import Count, F, Sum, ExpressionWrapper, DecimalField
+from .search import search_filter, search_ordering
+from .pagination import KeysetPaginationMixin
+from . import export, facets, figures
+from .leaderboard import leaderboard
+from .timewindow import filter_window, time_window, window_from_request
+from .charts import render_chart, render_charts, plotly_js_path, chart_cache
+from functools import partial
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, FileResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.db.models import Count, F, Sum, DecimalField
 from django.db.models.functions import ExtractYear, ExtractMonth, Cast, Coalesce
 
+# plotly.js is served once per browser: the URL carries the plotly version (see urls.py),
+# so the file can be cached for a year. The charts themselves only carry their figure JSON.
+@cache_control(public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+def PlotlyJS(request):
+    return FileResponse(open(plotly_js_path(), 'rb'), content_type='text/javascript')
+
 def DjTradersHome(request):
     return render(
         request,
@@ -20,20 +32,21 @@ def DjTradersHome(request):
 
 # Paginator documentation and working example is at:
 # https://docs.djangoproject.com/en/5.1/topics/pagination/
+# The list views page by (name, id) keyset instead of offset - see pagination.py
 
-class DjTradersCustomersView(ListView):
+class DjTradersCustomersView(KeysetPaginationMixin, ListView):
     model = Customer
     template_name = 'DjTraders/customers.html'
     context_object_name = 'customers'
     paginate_by=15
+    keyset_field = 'customer_name'
     
+    # Dropdown values with customer counts, cached per process (see facets.py)
     def all_countries(self):
-        Countries = self.model.objects.all().order_by('country').distinct()
-        return Countries.values('country')
+        return facets.customer_facet('country')
     
     def all_cities(self):
-        Cities = self.model.objects.all().order_by('city').distinct()
-        return Cities.values('city')
+        return facets.customer_facet('city')
     
     def get_queryset(self):
         '''
@@ -63,31 +76,25 @@ class DjTradersCustomersView(ListView):
         active_filter = self.request.GET.get('active', None)
         
         customers = self.model.objects.all()
-        
-        if active_filter is not None:
-            is_active = active_filter.lower() == 'true'
-            customers = customers.filter(is_active=is_active)
             
         if customerQuery:
-            customers = self.model.objects.filter(
-                customer_name__icontains=customerQuery
-            )
+            customers = search_filter(customers, 'customer_name', customerQuery)
         elif countryQuery:
-            customers = self.model.objects.filter(
-                country__icontains=countryQuery
-            )
+            customers = search_filter(customers, 'country', countryQuery)
         elif contactQuery:
-            customers = self.model.objects.filter(
-                contact_name__icontains=contactQuery
-            )
+            customers = search_filter(customers, 'contact_name', contactQuery)
         elif cityQuery:
-            customers = self.model.objects.filter(
-                city__icontains=cityQuery
-            )
-        else:
-            customers = self.model.objects.all()
+            customers = search_filter(customers, 'city', cityQuery)
+        
+        # Latest order date and Active/Inactive status come back with the page query - no per-row queries or saves.
+        customers = Customer.WithActivityStatus(customers)
+
+        # Filter on the derived status, the one shown in the list - the stored is_active flag can be out of date.
+        if active_filter is not None:
+            customers = customers.filter(
+                activeStatus="Active" if active_filter.lower() == 'true' else "Inactive")
             
-        return customers.order_by("customer_name")
+        return search_ordering(customers, "customer_name")
     
     def get_context_data(self, **kwargs):
         '''
@@ -133,38 +140,26 @@ class DjTradersCustomersView(ListView):
         context["srchCity"] = searchTermForCity
         
         context['Countries'] = self.all_countries()
-        context['Cities'] = self.all_cities
+        context['Cities'] = self.all_cities()
         context['active_filter'] = self.request.GET.get('active', None)
         #4. Give back the modified context dictionary.
         return context
 
-class CustomerOrders(ListView):
-    model = Customer
+class CustomerOrders(TemplateView):
     template_name = 'DjTraders/customer_orders.html'
-    context_object_name = 'customer_orders'
     
     def CustomerNumOrdersPlot(self):
-        CustomersWithOrders = Customer.objects.all().annotate(
-            nOrders = Count('order')
-        ).order_by('nOrders').reverse()
-        
-        TopTenCustomersWithOrders = CustomersWithOrders[:10]
-        nCustomers =  CustomersWithOrders[:10].count()
+        # The top ten come from the in-memory leaderboard (see leaderboard.py).
+        TopTenCustomersWithOrders = leaderboard.top_by_orders(10)
         
-        customer_names = [0 for _ in range(nCustomers)]
-        NumberOfOrdersPlaced = [0 for _ in range(nCustomers)]
-        index = 0
-        
-        for cOrder in TopTenCustomersWithOrders:
-            customer_names[index] = cOrder.customer_name
-            NumberOfOrdersPlaced[index] = cOrder.nOrders
-            index = index+1
+        customer_names = [cOrder['customer_name'] for cOrder in TopTenCustomersWithOrders]
+        NumberOfOrdersPlaced = [cOrder['nOrders'] for cOrder in TopTenCustomersWithOrders]
         
        
-        fig = px.bar(
+        fig = figures.bar(
           x= customer_names,
           y= NumberOfOrdersPlaced,
-          color_continuous_scale=px.colors.sequential.Jet,
+          color_continuous_scale='Jet',
           color=NumberOfOrdersPlaced,
           labels={'color':'Number Of Orders'},
           height=600,
@@ -182,33 +177,23 @@ class CustomerOrders(ListView):
         
               
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
         
         #return the html to place in the context and display
         return plot_html
 
     def NCustomerOrders(self):
-        CustomersWithOrders = Customer.objects.all().annotate(
-            nOrders = Count('order')
-        ).order_by('nOrders').reverse()
-        
-        TopTenCustomersWithOrders = CustomersWithOrders[:10].values('customer_name', 'nOrders')
-        
-        nCustomers =  CustomersWithOrders[:10].count()
+        TopTenCustomersWithOrders = leaderboard.top_by_orders(10)
 
-        dFrame = pd.DataFrame(
-            list(TopTenCustomersWithOrders),
-            #columns=["Customer Name", "Number Of Orders"]
-        )
-        print(dFrame)
-        
-        fig = px.bar(
-            dFrame,
-            x= 'customer_name',
-            y= 'nOrders',
-            color_continuous_scale=px.colors.sequential.Jet,
-            color="nOrders",
-            labels={'color':'nOrders'},
+        customer_names = [cOrder['customer_name'] for cOrder in TopTenCustomersWithOrders]
+        NumberOfOrdersPlaced = [cOrder['nOrders'] for cOrder in TopTenCustomersWithOrders]
+        
+        fig = figures.bar(
+            x= customer_names,
+            y= NumberOfOrdersPlaced,
+            color_continuous_scale='Jet',
+            color=NumberOfOrdersPlaced,
+            labels={'x': 'customer_name', 'y': 'nOrders', 'color':'nOrders'},
             height=600,
             width=1000,
             text_auto=True,
@@ -224,29 +209,27 @@ class CustomerOrders(ListView):
         
               
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
         
         #return the html to place in the context and display
         return plot_html
 
-    def get_queryset(self):
-        return super().get_queryset()
-    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["CustomerOrderPlot"] = self.CustomerNumOrdersPlot()
-        context["NCustomerOrdersPlot"] = self.NCustomerOrders()
+        context["CustomerOrderPlot"] = chart_cache.get_or_render('CustomerNumOrdersPlot', None, self.CustomerNumOrdersPlot)
+        context["NCustomerOrdersPlot"] = chart_cache.get_or_render('NCustomerOrders', None, self.NCustomerOrders)
         return context
 
-class DjTradersProductsView(ListView):
+class DjTradersProductsView(KeysetPaginationMixin, ListView):
     model = Product
-    template_name = 'DjTraders/products.html'
+    template_name = 'DjTraders/Products.html'
     context_object_name = 'products'
     paginate_by=15
+    keyset_field = 'product_name'
 
+    # Categories that have products, with product counts, cached per process (see facets.py)
     def all_categories(self):
-        Categories = Category.objects.filter(product__isnull=False).distinct()
-        return Categories.values_list('category_name', flat=True)
+        return facets.category_facet()
     
     def get_queryset(self):
         productQuery = self.request.GET.get('ProductName', '')
@@ -254,9 +237,9 @@ class DjTradersProductsView(ListView):
         priceQuery = self.request.GET.get('ProductPrice', '')
         
         if productQuery:
-            products = self.model.objects.filter(product_name__icontains = productQuery)
+            products = search_filter(self.model.objects.all(), 'product_name', productQuery)
         elif categoryQuery:
-            products = self.model.objects.filter(category__category_name__icontains = categoryQuery)
+            products = search_filter(self.model.objects.all(), 'category__category_name', categoryQuery)
         # elif priceQuery:
         #     try:
         #         price = float(priceQuery)
@@ -292,7 +275,8 @@ class DjTradersProductsView(ListView):
         else:
             products = self.model.objects.all()
         
-        return products.order_by("product_name")
+        # Category names are shown on every row - join them in rather than query per product.
+        return search_ordering(products.select_related('category'), "product_name")
 
     def get_context_data(self, **kwargs):
         
@@ -329,9 +313,12 @@ def GetProductDetails(request):
 def ProductAnnualMonthlySales(request, pk=None):
     selYear = request.GET.get('selOrderYear', "")
     eachProduct = get_object_or_404(Product, pk=pk)
-    OrdersYears = Order.AllOrderYears()
-    yearly_plot = eachProduct.AnnualProductOrders()
-    monthly_plot = eachProduct.MonthlyProductOrders(year=selYear if selYear else None)
+    OrdersYears = facets.order_years()
+    # Independent charts - one's figure is built while the other's query runs, see charts.render_charts.
+    plots = render_charts({
+        'AnnualySalePlot': eachProduct.AnnualProductOrders,
+        'MonthlySalePlot': partial(eachProduct.MonthlyProductOrders, window=window_from_request(request)),
+    })
     return render(
         request,
         'DjTraders/_ProductAnnualSales.html',
@@ -339,195 +326,182 @@ def ProductAnnualMonthlySales(request, pk=None):
             'product': eachProduct,
             'selOrderYear': selYear,
             'OrderYears': OrdersYears,
-            'AnnualySalePlot': yearly_plot,
-            'MonthlySalePlot': monthly_plot,
+            **plots,
         }
     )
 
 def plot_top_bottom_product_analysis(request, selOrderYear=None):
-    OrdersYears = Order.AllOrderYears()
+    OrdersYears = facets.order_years()
     selYear = request.GET.get('selOrderYear', selOrderYear)
-    orders_with_revenue = OrderDetail.objects.annotate(
-        revenue=F('product__price') * F('quantity'),
-        year=ExtractYear('order__order_date')
-    )
-    if selYear:
-        orders_with_revenue = orders_with_revenue.filter(year=selYear)
-    revenue_per_year = orders_with_revenue.values(
-        'product__product_id', 'product__product_name', 'year'
-    ).annotate(
-        total_revenue=Sum('revenue')
-    ).order_by('-total_revenue')
-    top_10 = list(revenue_per_year[:10])  # Top 10
-    bottom_10 = list(revenue_per_year[::-1][:10])  # Bottom 10
-    def generate_bar_charts(data, title, color_scale):
-        df = pd.DataFrame({
-            'Product': [item['product__product_name'] for item in data],
-            'Total Revenue': [item['total_revenue'] for item in data]
-        })
-        fig = px.bar(
-            df, x='Product', y='Total Revenue', title=title,
-            labels={'Total Revenue': 'Revenue ($)', 'Product': 'Product Name'},
-            color='Total Revenue', color_continuous_scale=color_scale
-        )
-        return plot(fig, output_type='div')
-    top_10 = generate_bar_charts(top_10, f'Top 10 Products by Revenue in {selYear or "All Years"}', 'Blues')
-    bottom_10 = generate_bar_charts(bottom_10, f'Bottom 10 Products by Revenue in {selYear or "All Years"}', 'Reds')
+    # The year is part of the chart cache key - an invalid one is a 404 before it gets there, as in window_from_request.
+    try:
+        window = time_window(year=selYear)
+    except ValueError as error:
+        raise Http404(str(error))
+    selYear = window.start.year if window else ""
+    try:
+        topN = min(max(int(request.GET.get('n', 10)), 1), 50)
+    except ValueError:
+        topN = 10
+    top_10, bottom_10 = chart_cache.get_or_render('TopBottomProducts', None, TopBottomProductPlots, selYear, topN)
     context = {
         'top_10_plot': top_10,
         'bottom_10_plot': bottom_10,
         'selOrderYear': selYear,
         'OrderYears': OrdersYears,
+        'TopN': topN,
     }
     return render(request, 'DjTraders/_ProductTopBottomAnalysis.html', context)
 
-def product_sales_analysis(request, pk):
-    eachProduct = Product.objects.get(pk=pk)
-   
-    OrdersYears = Order.AllOrderYears()  
-    selYear = request.GET.get('selOrderYear')
- 
-    total_sales_data = []
+def TopBottomProductPlots(selYear, topN=10):
+    '''
+        Builds the (top N, bottom N) products by revenue charts for selYear (an int, "" for all years).
+        Cached as a pair by plot_top_bottom_product_analysis.
+
+        The ranking is done in the database (Product.RevenueRanks).  The per-year ranking covers every year
+        in one query and is cached on its own, so switching the year selector only redraws the charts.
+    '''
     if selYear:
-        orders = Order.objects.filter(orderdetail__product=eachProduct, order_date__year=selYear)
+        ranks = chart_cache.get_or_render('ProductRevenueRanks', None, Product.RevenueRanks, topN, per_year=True)
+        ranks = ranks[ranks['year'] == selYear]
     else:
-        orders = Order.objects.filter(orderdetail__product=eachProduct)
- 
-    yearly_data = orders.annotate(
-        year=ExtractYear('order_date')
-        ).values('year').annotate(
-        total_orders=Count('order_id'),
-        total_products_sold=Sum('orderdetail__quantity'),
-        total_revenue=Sum(
-            ExpressionWrapper(
-                F('orderdetail__quantity') * F('orderdetail__product__price'),
-                output_field=DecimalField()
-            )
-        )
-    ).order_by('year')
- 
-    for year_data in yearly_data:
-        year = year_data['year']
-        total_orders = year_data['total_orders']
-        total_products_sold = year_data['total_products_sold']
-        total_revenue = year_data['total_revenue']
- 
-        monthly_sales_data = []
-       
-    # Monthly sales data
-        monthly_data = orders.filter(order_date__year=year).annotate(
-        month=ExtractMonth('order_date')
-        ).values('month').annotate(
-        total_orders_month=Count('order_id'),
-        total_products_sold_month=Sum('orderdetail__quantity'),
-        total_revenue_month=Sum(
-            ExpressionWrapper(
-                F('orderdetail__quantity') * F('orderdetail__product__price'),
-                output_field=DecimalField()
-            )
+        ranks = chart_cache.get_or_render('ProductRevenueRanks', None, Product.RevenueRanks, topN, per_year=False)
+
+    top_n = ranks[ranks['top_rank'] <= topN].sort_values('top_rank')
+    bottom_n = ranks[ranks['bottom_rank'] <= topN].sort_values('bottom_rank')
+
+    def generate_bar_charts(data, title, color_scale):
+        fig = figures.bar(
+            x=data['product_name'], y=data['total_revenue'], color=data['total_revenue'], title=title,
+            labels={'x': 'Product Name', 'y': 'Revenue ($)', 'color': 'Revenue ($)'},
+            color_continuous_scale=color_scale
         )
-        ).order_by('month')
- 
-        avg_sales_data = {
-            'avg_orders': total_orders / 12,
-            'avg_products_sold': total_products_sold / 12,
-            'avg_revenue': total_revenue / 12,
-        }
- 
-        for month_data in monthly_data:
-            month = month_data['month']
-            total_orders_month = month_data['total_orders_month']
-            total_products_sold_month = month_data['total_products_sold_month']
-            total_revenue_month = month_data['total_revenue_month']
- 
-            # Compare monthly sales with average
-            comparison = {
-                'orders_vs_avg': total_orders_month - avg_sales_data['avg_orders'],
-                'products_sold_vs_avg': total_products_sold_month - avg_sales_data['avg_products_sold'],
-                'revenue_vs_avg': total_revenue_month - avg_sales_data['avg_revenue'],
-            }
- 
-            monthly_sales_data.append({
-                'month': month,
-                'total_orders_month': total_orders_month,
-                'total_products_sold_month': total_products_sold_month,
-                'total_revenue_month': total_revenue_month,
-                'comparison': comparison,
-            })
- 
-        total_sales_data.append({
-            'year': year,
-            'total_orders': total_orders,
-            'total_products_sold': total_products_sold,
-            'total_revenue': total_revenue,
-            'monthly_sales': monthly_sales_data,
-            'avg_sales': avg_sales_data
-        })
- 
-    # Prepare data for Plotly charts
-    df_annual = pd.DataFrame(total_sales_data)
-    df_annual['year'] = df_annual['year'].astype(int)
-    df_annual['total_orders'] = pd.to_numeric(df_annual['total_orders'], errors='coerce')
-    df_annual['total_revenue'] = pd.to_numeric(df_annual['total_revenue'], errors='coerce')
-    df_annual['total_products_sold'] = pd.to_numeric(df_annual['total_products_sold'], errors='coerce')
-   
-    fig_annual = px.bar(df_annual, x='year', y=['total_orders', 'total_revenue', 'total_products_sold'],
-                    title=f"Annual Sales for {eachProduct.product_name}")
-    annual_chart_html = fig_annual.to_html(full_html=False)
- 
- 
-    # Prepare monthly sales comparison chart
-    df_monthly = pd.DataFrame([{
-        'Month': month_data['month'],
-        'Orders': month_data['total_orders_month'],
-        'Revenue': month_data['total_revenue_month'],
-        'Comparison with Avg': month_data['comparison']['revenue_vs_avg']
-    } for year_data in total_sales_data for month_data in year_data['monthly_sales']])
+        return render_chart(fig)
+    top_n = generate_bar_charts(top_n, f'Top {topN} Products by Revenue in {selYear or "All Years"}', 'Blues')
+    bottom_n = generate_bar_charts(bottom_n, f'Bottom {topN} Products by Revenue in {selYear or "All Years"}', 'Reds')
+    return top_n, bottom_n
+
+def product_sales_analysis(request, pk):
+    eachProduct = Product.objects.get(pk=pk)
    
-    df_monthly['Month'] = df_monthly['Month'].astype(int)
-    df_monthly['Orders'] = pd.to_numeric(df_monthly['Orders'], errors='coerce')
-    df_monthly['Revenue'] = pd.to_numeric(df_monthly['Revenue'], errors='coerce')
-    df_monthly['Comparison with Avg'] = pd.to_numeric(df_monthly['Comparison with Avg'], errors='coerce')
+    OrdersYears = facets.order_years()
+    selYear = request.GET.get('selOrderYear')
+    window = window_from_request(request)
  
-    fig_monthly = px.line(df_monthly, x='Month', y='Revenue', title=f"Monthly Sales Comparison for {eachProduct.product_name}")
-    monthly_chart_html = fig_monthly.to_html(full_html=False)
+    annual_chart_html, monthly_chart_html = chart_cache.get_or_render(
+        'ProductSalesAnalysis', eachProduct.pk,
+        lambda window: ProductSalesAnalysisPlots(eachProduct, window), window)
  
  
     context = {
         'product': eachProduct,
         'ProductAnnualySalesPlot': annual_chart_html,
         'ProductMonthlySalesPlot': monthly_chart_html,
-        'OrderYears': Order.objects.all().values('order_date').distinct(),
+        'OrderYears': OrdersYears,
         'selOrderYear': selYear,
-        'OrdersYears': OrdersYears,
     }
  
     return render(request, 'DjTraders/_ProductSalesAnalysis.html', context)
 
+def ProductSalesAnalysisPlots(eachProduct, window):
+    '''
+        Builds the (annual, monthly) sales charts for product_sales_analysis - cached there as a pair.
+
+        One grouped query returns orders, products sold and revenue for every (year, month) the product sold in
+        within the selected time window.
+        Year totals and each month's revenue difference from its year's average month
+        are then summed up from those rows - the query count does not grow with the number of years.
+    '''
+    return ProductSalesAnalysisFigures(eachProduct, list(ProductSalesAnalysisRows(eachProduct, window)))
+
+def ProductSalesAnalysisRows(eachProduct, window):
+    '''
+        (year, month, orders, products sold, revenue) for every month the product sold in within window.
+    '''
+    productLines = filter_window(OrderDetail.objects.filter(product=eachProduct), 'order__order_date', window)
+
+    return productLines.annotate(
+        year=ExtractYear('order__order_date'),
+        month=ExtractMonth('order__order_date'),
+    ).values('year', 'month').annotate(
+        total_orders_month=Count('order_id', distinct=True),
+        total_products_sold_month=Sum('quantity'),
+        total_revenue_month=Sum('line_total')
+    ).order_by('year', 'month').values_list(
+        'year', 'month', 'total_orders_month', 'total_products_sold_month', 'total_revenue_month'
+    )
+
+def ProductSalesAnalysisFigures(eachProduct, monthly_rows):
+    '''
+        The (annual, monthly) chart HTML for the ProductSalesAnalysisRows() rows - no database access.
+    '''
+    if not monthly_rows:
+        no_data = '<div>No sales data available for this product.</div>'
+        return no_data, no_data
+
+    # Column arithmetic on one float matrix of the rows (NULL sums count as 0).  numpy is imported here,
+    # not at module level - only the analytics charts need it (see tests.ImportTimeTests).
+    import numpy as np
+    data = np.nan_to_num(np.array(monthly_rows, dtype=np.float64))
+    years, inverse = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+
+    # Year totals (orders, products sold, revenue), in year order
+    orders_year = np.bincount(inverse, weights=data[:, 2]).astype(np.int64)
+    products_year = np.bincount(inverse, weights=data[:, 3]).astype(np.int64)
+    revenue_year = np.bincount(inverse, weights=data[:, 4])
+
+    fig_annual = figures.bar(
+        x=years.tolist(),
+        y={
+            'total_orders': orders_year.tolist(),
+            'total_revenue': revenue_year.tolist(),
+            'total_products_sold': products_year.tolist(),
+        },
+        labels={'x': 'year'},
+        title=f"Annual Sales for {eachProduct.product_name}")
+    annual_chart_html = render_chart(fig_annual)
+
+    # Monthly sales comparison chart - each month against the average month of its year
+    revenues = data[:, 4]
+    fig_monthly = figures.line(
+        x=data[:, 1].astype(np.int64).tolist(),
+        y=revenues.tolist(),
+        labels={'x': 'Month', 'y': 'Revenue'},
+        title=f"Monthly Sales Comparison for {eachProduct.product_name}",
+        hover_data={
+            'year': years[inverse].tolist(),
+            'Orders': data[:, 2].astype(np.int64).tolist(),
+            'Comparison with Avg': (revenues - revenue_year[inverse] / 12).tolist(),
+        })
+    monthly_chart_html = render_chart(fig_monthly)
+
+    return annual_chart_html, monthly_chart_html
+
 def CategoryAnalysis(request, pk):
     eachProduct = get_object_or_404(Product, pk=pk)
  
-    category_sales = eachProduct.ProductCategorySalesAnalysisPlot()
-    category_revenue = eachProduct.ProductCategoryRevenuesAnalysisPlot()
+    plots = render_charts({
+        'CategoryPlot': eachProduct.ProductCategorySalesAnalysisPlot,
+        'CategoryRevenuesPlot': eachProduct.ProductCategoryRevenuesAnalysisPlot,
+    })
  
     return render(
         request,
         'DjTraders/_CategorySalesAnalysis.html',
         {
             'product': eachProduct,
-            'CategoryRevenuesPlot': category_revenue,
-            'CategoryPlot': category_sales,
+            **plots,
         }
     )
 
 class DjTradersProductDetailView(DetailView):
     model=Product
-    template_name=  'DjTraders/productDetail.html'
+    template_name=  'DjTraders/ProductDetail.html'
     context_object_name='product'
     
 def ProductAnnualSales(request):
-    year = request.GET.get('year')  # Optional year filter
-    plot_html = Order.GenerateAnnualSalesPlot(year=year)
+    year = request.GET.get('year') or None  # Optional year filter
+    plot_html = Order.GenerateAnnualSalesPlot(year=year, window=window_from_request(request, year_param='year'))
     return render(request, 'DjTraders/Product_Annual_Sales.html', {'plot_html': plot_html})
         
     
@@ -590,73 +564,86 @@ class ProductAnalysisPageView(DetailView):
         context['ProductsSalePlot'] = eachProduct.AnnualProductOrders()
         return context
 
+def ChartCacheStats(request):
+    '''
+        Hit/miss statistics of this worker process's rendered-chart cache.
+    '''
+    return JsonResponse(chart_cache.stats())
+
 class CustomersListJSON(View):
     
     def get(self, request):
         
-        allCustomerData = Customer.objects.all().annotate(
-            nOrders = Count('order')
-        ).order_by('nOrders').reverse()
-            
-
-        x = allCustomerData.values('customer_name', 'country', 'nOrders')[:10]
-        
-        
-        CustomerData = list(x)#serialize("json", allCustomerData)
+        # The ten customers with the most orders (or the highest revenue with ?by=revenue),
+        # answered from the in-memory leaderboard.
+        if request.GET.get('by') == 'revenue':
+            CustomerData = leaderboard.top_by_revenue(10)
+        else:
+            CustomerData = leaderboard.top_by_orders(10)
         
         # print(CustomerData)        
         return JsonResponse(CustomerData, safe=False)
 
 
+def ExportOrders(request, fmt='ndjson'):
+    '''
+        Every order line with its order, customer, product and category, streamed as NDJSON or CSV (see export.py).
+        Filters: selOrderYear / quarter / month / from / to on the order date, customer_id and product_id.
+    '''
+    window = window_from_request(request)
+    try:
+        customer_id = int(request.GET['customer_id']) if request.GET.get('customer_id') else None
+        product_id = int(request.GET['product_id']) if request.GET.get('product_id') else None
+    except ValueError:
+        raise Http404("Invalid customer_id or product_id")
+
+    lines = export.order_lines(window, customer_id=customer_id, product_id=product_id)
+    content = export.astream(lines, fmt) if isinstance(request, ASGIRequest) else export.stream(lines, fmt)
+    response = StreamingHttpResponse(content, content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="orders.{fmt}"'
+    return response
+
 # region Customer Detail View with a OrdersPlaced plot
 # v3.0 Added
 class DjTradersCustomerDetailView(DetailView):
     model=Customer
-    template_name=  'DjTraders/customerDetail.html'
+    template_name=  'DjTraders/CustomerDetail.html'
     context_object_name='customer'
 
     # v3.0 Added
     def OrdersPlacedPlot(self):
         '''
         
-        The OrdersPlacedPlot function uses the "current" customer object using the get_object() function
+        The OrdersPlacedPlot function uses the "current" customer object (self.object, loaded by the DetailView)
         
-        The customer is queried for the customer's orders and extracting the number of orders, 
-        as well as order id, order_date and the total for each order.        
-        These are added to individual arrays, for each order.
+        One grouped query returns the order id, order_date and the total for each of the customer's orders.
+        The columns go straight into the figure - no per-order queries.
         
-        plotly express is used to create a bar chart of order totals arranged by order date.
-        The plotly offline library is plot the chart in a "div" and make it available to the DetailView for the customer
+        figures.bar() builds a bar chart of order totals arranged by order date.
+        render_chart() places the chart in a "div" and make it available to the DetailView for the customer
         
         '''
 
-        # for more on the "get_object()" function, see: https://docs.djangoproject.com/en/5.1/ref/class-based-views/mixins-single-object/
-        
-        #get the specific customer object 
-        theCustomer = self.get_object()
+        #the customer object the DetailView already fetched
+        theCustomer = self.object
         
-        #CustomerOrders() member function returns a queryset of all orders placed by theCustomer.
-        customerOrders = theCustomer.CustomerOrders()
+        #(order_id, order_date, total) for each order placed by theCustomer, in one query.
+        orderRows = list(theCustomer.CustomerOrders().annotate(
+            Total = Coalesce(Sum('orderdetail__line_total'), 0,
+                             output_field=DecimalField(max_digits=12, decimal_places=2)),
+        ).order_by('order_date', 'order_id').values_list('order_id', 'order_date', 'Total'))
 
-        # Create arrays to hold data 
-        number_Of_Orders = customerOrders.count()
-        order_dates = [0 for _ in range(number_Of_Orders)]
-        order_totals = [0 for _ in range(number_Of_Orders)]
-        order_ids = [0 for _ in range(number_Of_Orders)]
-        index = 0
-        
-        # for each order in customerOrders, extract, dates, totals and id in each order.
-        for order in customerOrders:
-            order_ids[index] = order.order_id
-            order_dates[index] = order.order_date
-            order_totals[index] = order.OrderTotal()
-            index = index+1
+        if not orderRows:
+            return '<div> No Orders placed</div>'
+
+        # Unzip the rows into columns; the Decimal totals become one float array
+        order_ids, order_dates, order_totals = zip(*orderRows)
         
         # Create the bar chart - x and y are required, 
         # others are optional formatting.
-        fig = px.bar(
+        fig = figures.bar(
             x=order_dates,
-            y= order_totals,
+            y=figures.floats(order_totals),
             
             color=order_ids,
             labels={'color':'Order'},
@@ -681,7 +668,7 @@ class DjTradersCustomerDetailView(DetailView):
         )
         
         # generate the plot with the figure embedded as a Div
-        plot_html = plot(fig, output_type='div')
+        plot_html = render_chart(fig)
         
         #return the html to place in the context and display
         return plot_html
@@ -691,7 +678,7 @@ class DjTradersCustomerDetailView(DetailView):
         context = super().get_context_data(**kwargs)
         
         # Add the plot to the context to make it available to the template.
-        context['OrdersPlot'] = self.OrdersPlacedPlot()
+        context['OrdersPlot'] = chart_cache.get_or_render('CustomerOrderTotals', self.object.pk, self.OrdersPlacedPlot)
         return context
     
 def OrdersPlaced(request):
@@ -712,11 +699,14 @@ def OrdersByDate(request, selOrderYear=""):
     #use the customer_id to get the right customer.
     customer = Customer.objects.get(customer_id=customer_id)
 
-    # To fill the dropdown, ask the Order Model for all distinct Years an Order was placed BY ANY customer.
-    OrderYears = Order.AllOrderYears()
+    # To fill the dropdown, all distinct Years an Order was placed BY ANY customer (cached, see facets.order_years).
+    OrderYears = facets.order_years()
 
-    TheAnnualOrders = customer.AnnualOrders()
-    ordersByDatePlot = customer.OrdersPlacedPlot(selOrderYear)
+    # The two plots query independently, so one's figure is built while the other's query runs (see charts.render_charts).
+    plots = render_charts({
+        'AnnualOrdersPlot': customer.AnnualOrders,
+        'OrdersByDatePlot': partial(customer.OrdersPlacedPlot, selOrderYear, window=window_from_request(request)),
+    })
 
     return render(
         request, 
@@ -725,8 +715,7 @@ def OrdersByDate(request, selOrderYear=""):
             'customer': customer,
             'selOrderYear': selOrderYear,
             'OrderYears': OrderYears,
-            'OrdersByDatePlot': ordersByDatePlot,
-            'AnnualOrdersPlot': TheAnnualOrders,
+            **plots,
         }
     )
     
@@ -740,16 +729,18 @@ def OrdersByProduct(request):
     #use the customer_id to get the right customer.
     customer = Customer.objects.get(customer_id=customer_id)
 
-    TheProductsRevenuePlot = customer.ProductReveues()
-    TheProductsPlot = customer.ProductsSoldPlot()
+    # Both plots total the same rows (Customer.ProductFacts - loaded once), then build their figures side by side.
+    plots = render_charts({
+        'ProductsRevenuePlot': customer.ProductReveues,
+        'ProductsPlot': customer.ProductsSoldPlot,
+    })
 
     return render(
         request, 
         'DjTraders/_OrdersByProduct.html', 
         {
             'customer': customer,
-            'ProductsPlot': TheProductsPlot,
-            'ProductsRevenuePlot': TheProductsRevenuePlot,
+            **plots,
         }
     )
 
@@ -763,15 +754,16 @@ def OrdersByCategory(request):
     #use the customer_id to get the right customer.
     customer = Customer.objects.get(customer_id=customer_id)
 
-    TheCategoryPlot = customer.ProductCategorySalesPlot()
-    TheCategoryRevenusPlot = customer.ProductCategoryRevenusPlot()
+    plots = render_charts({
+        'CategoryPlot': customer.ProductCategorySalesPlot,
+        'CategoryRevenuesPlot': customer.ProductCategoryRevenusPlot,
+    })
 
     return render(
         request, 
         'DjTraders/_OrdersByCategory.html', 
         {
             'customer': customer,
-            'CategoryRevenuesPlot': TheCategoryRevenusPlot,
-            'CategoryPlot': TheCategoryPlot,
+            **plots,
         }
     )
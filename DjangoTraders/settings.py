@@ -100,6 +100,9 @@ DATABASES = {
     }
 }
 
+# The test database is built from the models, not the migrations (see DjTraders/test_runner.py).
+TEST_RUNNER = "DjTraders.test_runner.NorthwindTestRunner"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -35,3 +35,14 @@ function MakeDataTable(tableDivId)
 	});
 }
 	
+
+
+// Draws a chart rendered by DjTraders/charts.py render_chart().
+// The figure JSON sits in a <script type="application/json"> next to the chart div;
+// plotly.js itself is loaded once in base.html.
+function DjTradersPlot(plotDivId)
+{
+	const figure = JSON.parse(document.getElementById(plotDivId + '-figure').textContent);
+
+	Plotly.newPlot(plotDivId, figure.data, figure.layout, {responsive: true});
+}